@@ -0,0 +1,7 @@
+#
+# IP Address Search Tool
+#
+# Benchmarks, see bench/run.py
+#
+# hidekuno@gmail.com
+#
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Synthetic GeoLite2-like CSV zip files for the benchmarks (no MaxMind token needed)
+#
+# ex.) python bench/geodata.py -d /tmp/bench -r 100000
+#      -> /tmp/bench/GeoLite2-{Country,ASN,City}-CSV.zip
+#
+# hidekuno@gmail.com
+#
+import os
+import io
+import sys
+import csv
+import random
+import zipfile
+import argparse
+import ipaddress
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_create_geoip
+
+RELEASE = "20240102"
+
+COUNTRIES = [
+    ("AS", "JP", "日本"),
+    ("NA", "US", "アメリカ合衆国"),
+    ("AS", "CN", "中国"),
+    ("EU", "DE", "ドイツ連邦共和国"),
+    ("EU", "GB", "イギリス"),
+    ("AS", "KR", "大韓民国"),
+    ("EU", "FR", "フランス共和国"),
+    ("SA", "BR", "ブラジル連邦共和国"),
+    ("OC", "AU", "オーストラリア"),
+    ("AS", "IN", "インド"),
+    ("NA", "CA", "カナダ"),
+    ("EU", "NL", "オランダ王国"),
+    ("AF", "ZA", "南アフリカ"),
+    ("AS", "SG", "シンガポール"),
+]
+SUBDIVISIONS = ["東京都", "大阪府", "北海道", "愛知県", "福岡県", "神奈川県", "京都府", "沖縄県"]
+CITIES = ["中央", "港", "新宿", "北", "南", "和田", "本町", "西", "東", "緑"]
+PROVIDERS = [
+    "Internet Initiative Japan Inc.",
+    "GOOGLE",
+    "CLOUDFLARENET",
+    "NTT Communications Corporation",
+    "AMAZON-02",
+    "Akamai International B.V.",
+    "KDDI CORPORATION",
+    "Chinanet",
+    "Deutsche Telekom AG",
+    "SoftBank Corp.",
+]
+
+COUNTRY_BLOCKS = "network,geoname_id,registered_country_geoname_id,represented_country_geoname_id," \
+    "is_anonymous_proxy,is_satellite_provider,is_anycast"
+CITY_BLOCKS = "network,geoname_id,registered_country_geoname_id,represented_country_geoname_id," \
+    "is_anonymous_proxy,is_satellite_provider,postal_code,latitude,longitude,accuracy_radius,is_anycast"
+ASN_BLOCKS = "network,autonomous_system_number,autonomous_system_organization"
+COUNTRY_LOCATIONS = "geoname_id,locale_code,continent_code,continent_name,country_iso_code,country_name," \
+    "is_in_european_union"
+CITY_LOCATIONS = "geoname_id,locale_code,continent_code,continent_name,country_iso_code,country_name," \
+    "subdivision_1_iso_code,subdivision_1_name,subdivision_2_iso_code,subdivision_2_name,city_name," \
+    "metro_code,time_zone,is_in_european_union"
+
+# prefix lengths of the allocations (country rows), ASN and city rows split them further
+PREFIXLENS = {
+    4: (16, 18, 19, 20, 20, 21, 22, 22, 23, 24, 24, 24),
+    6: (29, 32, 32, 32, 36, 40, 44, 48),
+}
+MAX_PREFIXLEN = {4: 30, 6: 64}
+ADDRESS_SPACE = {
+    4: (int(ipaddress.IPv4Address("1.0.0.0")), int(ipaddress.IPv4Address("224.0.0.0"))),
+    6: (int(ipaddress.IPv6Address("2001:200::")), int(ipaddress.IPv6Address("2c10::"))),
+}
+NETWORK = {4: ipaddress.IPv4Network, 6: ipaddress.IPv6Network}
+
+
+def make_allocations(rnd, version, count):
+    # non-overlapping (start, prefixlen) in address order, with gaps for the "Not Found" searches
+    bits = 32 if version == 4 else 128
+    (n, limit) = ADDRESS_SPACE[version]
+    allocations = []
+    while len(allocations) < count:
+        prefixlen = rnd.choice(PREFIXLENS[version])
+        size = 1 << (bits - prefixlen)
+        n = (n + size - 1) // size * size
+        if n + size > limit:
+            break
+        allocations.append((n, prefixlen))
+        n += size * (1 + rnd.choice((0, 0, 0, 1, 2, 7)))
+    return allocations
+
+
+def split(rnd, version, start, prefixlen, max_diff):
+    diff = min(rnd.randint(0, max_diff), MAX_PREFIXLEN[version] - prefixlen)
+    size = 1 << ((32 if version == 4 else 128) - prefixlen - diff)
+    return [(start + i * size, prefixlen + diff) for i in range(1 << diff)]
+
+
+def cidr(version, start, prefixlen):
+    return str(NETWORK[version]((start, prefixlen)))
+
+
+class GeoData(object):
+    def __init__(self, rows, seed=0):
+        self.rnd = random.Random(seed)
+        self.countries = [1861060 + i for i in range(len(COUNTRIES))]
+        self.cities = {}
+        for i in range(max(10, rows // 50)):
+            geoname_id = 2000000 + i
+            self.cities[geoname_id] = (
+                self.rnd.randrange(len(COUNTRIES)),
+                self.rnd.choice(SUBDIVISIONS),
+                self.rnd.choice(CITIES) + str(i),
+            )
+        self.asns = [(2497 + i * 7, self.rnd.choice(PROVIDERS)) for i in range(max(10, rows // 20))]
+        self.allocations = {
+            4: make_allocations(self.rnd, 4, rows),
+            6: make_allocations(self.rnd, 6, max(1, rows // 4)),
+        }
+
+    def country_blocks(self, version):
+        yield COUNTRY_BLOCKS
+        for (start, prefixlen) in self.allocations[version]:
+            geoname_id = self.rnd.choice(self.countries)
+            r = self.rnd.random()
+            if r < 0.001:
+                # anonymous proxy without a country
+                yield "%s,,,,1,0,0" % cidr(version, start, prefixlen)
+            elif r < 0.05:
+                yield "%s,,%d,,0,0,0" % (cidr(version, start, prefixlen), geoname_id)
+            else:
+                yield "%s,%d,%d,,0,0,0" % (cidr(version, start, prefixlen), geoname_id, geoname_id)
+
+    def asn_blocks(self, version):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="")
+        writer.writerow(ASN_BLOCKS.split(","))
+        yield out.getvalue()
+        for (start, prefixlen) in self.allocations[version]:
+            (asn, provider) = self.rnd.choice(self.asns)
+            if self.rnd.random() < 0.1:
+                # organizations with a comma are quoted
+                provider = provider + ", Inc."
+            for net in split(self.rnd, version, start, prefixlen, 2):
+                out.seek(0)
+                out.truncate()
+                writer.writerow([cidr(version, *net), asn, provider])
+                yield out.getvalue()
+
+    def city_blocks(self, version):
+        yield CITY_BLOCKS
+        geoname_ids = list(self.cities)
+        for (start, prefixlen) in self.allocations[version]:
+            for net in split(self.rnd, version, start, prefixlen, 3):
+                geoname_id = self.rnd.choice(geoname_ids)
+                country = self.countries[self.cities[geoname_id][0]]
+                yield "%s,%d,%d,,0,0,100-0001,35.6%d,139.7%d,%d,0" % (
+                    cidr(version, *net),
+                    geoname_id,
+                    country,
+                    self.rnd.randrange(1000),
+                    self.rnd.randrange(1000),
+                    self.rnd.choice((5, 10, 20, 50, 100, 500, 1000)),
+                )
+
+    def country_locations(self):
+        yield COUNTRY_LOCATIONS
+        for (geoname_id, (continent, iso_code, name)) in zip(self.countries, COUNTRIES):
+            yield "%d,ja,%s,,%s,%s,0" % (geoname_id, continent, iso_code, name)
+
+    def city_locations(self):
+        yield CITY_LOCATIONS
+        for (geoname_id, (c, subdivision, city)) in self.cities.items():
+            (continent, iso_code, name) = COUNTRIES[c]
+            yield "%d,ja,%s,,%s,%s,,%s,,,%s,,Asia/Tokyo,0" % (
+                geoname_id, continent, iso_code, name, subdivision, city
+            )
+
+    def write_zipfile(self, workdir, geofile, files):
+        zip_filename = os.path.join(workdir, geofile + ".zip")
+        with zipfile.ZipFile(zip_filename, "w", zipfile.ZIP_DEFLATED) as z:
+            for (name, lines) in files:
+                with z.open("%s_%s/%s" % (geofile, RELEASE, name), "w") as fd:
+                    for line in lines:
+                        fd.write((line + "\n").encode("utf-8"))
+        return zip_filename
+
+    def write_zipfiles(self, workdir):
+        g = cidr_create_geoip
+        return [
+            self.write_zipfile(workdir, g.COUNTRY_CSV, [
+                (g.GEOIP_COUNTRY_FILE, self.country_locations()),
+                (g.GEOIP_IP_FILE, self.country_blocks(4)),
+                (g.GEOIP_IPV6_FILE, self.country_blocks(6)),
+            ]),
+            self.write_zipfile(workdir, g.ASN_CSV, [
+                (g.GEOIP_ASN_FILE, self.asn_blocks(4)),
+                (g.GEOIP_ASN_IPV6_FILE, self.asn_blocks(6)),
+            ]),
+            self.write_zipfile(workdir, g.CITY_CSV, [
+                (g.GEOIP_CITY_FILE, self.city_locations()),
+                (g.GEOIP_CITY_IP_FILE, self.city_blocks(4)),
+                (g.GEOIP_CITY_IPV6_FILE, self.city_blocks(6)),
+            ]),
+        ]
+
+    def sample_addresses(self, count, miss_ratio=0.1):
+        # addresses inside the allocations, and miss_ratio of random ones
+        addrs = []
+        for _ in range(count):
+            version = 4 if self.rnd.random() < 0.8 else 6
+            bits = 32 if version == 4 else 128
+            if self.rnd.random() < miss_ratio:
+                (low, high) = ADDRESS_SPACE[version]
+                n = self.rnd.randrange(low, high)
+            else:
+                (start, prefixlen) = self.rnd.choice(self.allocations[version])
+                n = start + self.rnd.randrange(1 << (bits - prefixlen))
+            addrs.append(str(NETWORK[version]((n, bits)).network_address))
+        return addrs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--directory", type=str, dest="workdir", default=".", required=False)
+    parser.add_argument("-r", "--rows", type=int, dest="rows", default=10000, required=False)
+    parser.add_argument("-s", "--seed", type=int, dest="seed", default=0, required=False)
+    args = parser.parse_args(sys.argv[1:])
+
+    for zip_filename in GeoData(args.rows, args.seed).write_zipfiles(args.workdir):
+        print(zip_filename)
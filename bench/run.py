@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Benchmarks on a synthetic database (bench/geodata.py), the results are written as JSON.
+#
+# ex.) python bench/run.py -r 100000 -o result.json
+#      python bench/run.py -r 100000 --compare result.json
+#
+# hidekuno@gmail.com
+#
+import os
+import io
+import sys
+import json
+import time
+import sqlite3
+import platform
+import argparse
+import tempfile
+import contextlib
+import traceback
+import subprocess
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_create_geoip
+import cidr_create_range
+import cidr_mmdb
+import cidr_compact
+import cidr_search
+import cidr_open
+from bench import geodata
+
+TOP_DIR = Path(__file__).parent.parent
+ENGINES = ["like", "range", "merged", "memory", "dir248", "trie", "mmdb"]
+BATCH_SIZE = 1000
+
+
+class Timer(object):
+    def __init__(self, results, name):
+        self.results = results
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.results[self.name] = round(time.perf_counter() - self.start, 6)
+
+
+def bench_build(data, workdir):
+    results = {}
+    cidr_create_geoip.WORK_DIR = workdir
+    g = cidr_create_geoip
+
+    with Timer(results, "generate"):
+        data.write_zipfiles(workdir)
+
+    dbpath = os.path.join(workdir, "database.cidr")
+    writer = g.DatabaseWriter(dbpath)
+    for (name, geofile, obj) in (
+        ("country", g.COUNTRY_CSV, g.Country()),
+        ("asn", g.ASN_CSV, None),
+        ("city", g.CITY_CSV, g.City()),
+    ):
+        with Timer(results, name + "_regions"):
+            (z, regions, ipvfile, ipv6file) = g.read_zipfile(geofile, obj)
+        with z:
+            for (version, csv_file) in ((4, ipvfile), (6, ipv6file)):
+                # read, convert and load are one stream
+                with Timer(results, "%s_v%d" % (name, version)):
+                    writer.write(obj, version, g.make_rows(version, regions, g.read_csv(z, csv_file), obj))
+    with Timer(results, "finish"):
+        writer.close()
+
+    conn = sqlite3.connect(dbpath)
+    with Timer(results, "range"):
+        cidr_create_range.make_range_tables(conn)
+    with Timer(results, "merged"):
+        cidr_create_range.make_merged_tables(conn)
+
+    mmdbpath = os.path.join(workdir, "database.mmdb")
+    with Timer(results, "mmdb"):
+        cidr_mmdb.write_database(conn.cursor(), mmdbpath)
+    compactpath = os.path.join(workdir, "database.compact")
+    with Timer(results, "compact"):
+        cidr_compact.write_database(conn.cursor(), compactpath)
+    conn.close()
+
+    results["rows"] = count_rows(dbpath)
+    results["size"] = dict([(os.path.basename(p), os.path.getsize(p)) for p in (dbpath, mmdbpath, compactpath)])
+    return (results, dbpath, mmdbpath)
+
+
+def count_rows(dbpath):
+    conn = sqlite3.connect(dbpath)
+    cursor = conn.cursor()
+    rows = {}
+    for table in cidr_create_range.get_tables(cursor):
+        cursor.execute("select count(*) from %s" % table)
+        rows[table] = cursor.fetchone()[0]
+    conn.close()
+    return rows
+
+
+def bench_engine(name, dbpath, mmdbpath, ipaddrs):
+    results = {}
+    with Timer(results, "open"):
+        engine = cidr_open.open_engine(name, mmdbpath if name == "mmdb" else dbpath)
+    city_mode = engine.has_city()
+
+    found = 0
+    with Timer(results, "single"):
+        for ipaddr in ipaddrs:
+            try:
+                cidr_search.eval_ipaddr(ipaddr, engine, city_mode)
+                found += 1
+            except cidr_search.EvalIpException:
+                pass
+
+    with Timer(results, "batch"):
+        for i in range(0, len(ipaddrs), BATCH_SIZE):
+            cidr_search.eval_ipaddrs(ipaddrs[i:i + BATCH_SIZE], engine, city_mode)
+
+    outfd = io.StringIO()
+    with Timer(results, "batch_csv"), contextlib.redirect_stderr(io.StringIO()):
+        cidr_search.do_batch(io.StringIO("\n".join(ipaddrs)), outfd, engine, city_mode, "csv", BATCH_SIZE)
+    engine.close()
+
+    for key in ("single", "batch", "batch_csv"):
+        results[key + "_per_sec"] = round(len(ipaddrs) / results[key]) if results[key] else None
+    results["found"] = found
+    return results
+
+
+def bench_api(dbpath, mmdbpath, ipaddrs):
+    try:
+        from fastapi.testclient import TestClient
+        import cidr_api
+        import cidr_cache
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    results = {}
+    headers = {"x-api-key": "apitest"}
+    for (name, engine_name, path) in (("sqlite", "sql", None), ("memory", "memory", None), ("mmdb", "sql", mmdbpath)):
+        for cache_size in (0, cidr_cache.DEFAULT_SIZE):
+            cidr_api.dbpath = dbpath
+            cidr_api.engine_name = engine_name
+            cidr_api.mmdbpath = path
+            cidr_api.cache = cidr_cache.LookupCache(cache_size)
+
+            key = name + ("_cached" if cache_size else "")
+            with TestClient(cidr_api.app) as client:
+                with Timer(results, key):
+                    for _ in range(2 if cache_size else 1):
+                        for ipaddr in ipaddrs:
+                            client.get("/search", params={"ipv4": ipaddr}, headers=headers)
+            count = len(ipaddrs) * (2 if cache_size else 1)
+            results[key + "_per_sec"] = round(count / results[key]) if results[key] else None
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=TOP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base, result):
+    # ratio of the throughputs, > 1.0 is faster than base
+    for key in ("rows", "seed", "queries"):
+        if base.get(key) != result[key]:
+            print("warning: %s differs (%s, %s)" % (key, base.get(key), result[key]), file=sys.stderr)
+    for section in ("lookup", "api"):
+        for (name, values) in result.get(section, {}).items():
+            if not isinstance(values, dict):
+                continue
+            for (key, value) in values.items():
+                old = base.get(section, {}).get(name, {}).get(key)
+                if key.endswith("_per_sec") and value and old:
+                    print(
+                        "%s %s %s: %d -> %d (x%.2f)" % (section, name, key, old, value, value / old),
+                        file=sys.stderr,
+                    )
+    for (key, value) in result["build"].items():
+        old = base.get("build", {}).get(key)
+        if isinstance(value, float) and old:
+            print("build %s: %.3fs -> %.3fs (x%.2f)" % (key, old, value, old / value), file=sys.stderr)
+
+
+def run(args):
+    data = geodata.GeoData(args.rows, args.seed)
+    ipaddrs = data.sample_addresses(args.queries)
+    result = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rows": args.rows,
+        "seed": args.seed,
+        "queries": args.queries,
+    }
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        (result["build"], dbpath, mmdbpath) = bench_build(data, workdir)
+        result["lookup"] = {}
+        for name in args.engines:
+            sys.stderr.write("engine %s\n" % name)
+            result["lookup"][name] = bench_engine(name, dbpath, mmdbpath, ipaddrs)
+        if not args.no_api:
+            result["api"] = bench_api(dbpath, mmdbpath, ipaddrs)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--rows", type=int, dest="rows", default=10000, required=False)
+    parser.add_argument("-q", "--queries", type=int, dest="queries", default=10000, required=False)
+    parser.add_argument("-s", "--seed", type=int, dest="seed", default=0, required=False)
+    parser.add_argument("-e", "--engine", dest="engines", action="append", choices=ENGINES, required=False)
+    parser.add_argument("-d", "--directory", type=str, dest="workdir", default=None, required=False)
+    parser.add_argument("-o", "--output", type=str, dest="output", default="-", required=False)
+    parser.add_argument("--compare", type=str, dest="compare", default=None, required=False)
+    parser.add_argument("--no-api", default=False, action="store_true", required=False)
+    args = parser.parse_args(sys.argv[1:])
+    args.engines = args.engines or ENGINES
+
+    try:
+        result = run(args)
+        if args.output == "-":
+            json.dump(result, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.output, "w") as fd:
+                json.dump(result, fd, indent=2)
+
+        if args.compare:
+            with open(args.compare) as fd:
+                compare(json.load(fd), result)
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
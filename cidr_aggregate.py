@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Prefix aggregation: sibling networks with the same values are merged into their parent,
+# networks covered by a network with the same values are dropped. Longest prefix match
+# gives the same values for every address before and after.
+#
+# hidekuno@gmail.com
+#
+import ipaddress
+import cidr_codec
+
+NETWORK = {4: ipaddress.IPv4Network, 6: ipaddress.IPv6Network}
+
+
+def parent_end(start, prefixlen, bits):
+    # last address of the parent network, the only place the network can still be merged in
+    if prefixlen == 0:
+        return (1 << bits) - 1
+    size = 1 << (bits - prefixlen + 1)
+    return (start & ~(size - 1)) + size - 1
+
+
+def aggregate(networks, bits):
+    # networks: [start, prefixlen, values, ...] sorted by start and prefixlen,
+    # yields the smallest equivalent set in the same order (merged ones have None after values)
+    stack = []
+    last = (0, 0)
+    for net in networks:
+        if (net[0], net[1]) < last:
+            raise ValueError("networks are not sorted")
+        last = (net[0], net[1])
+
+        if stack:
+            (start, prefixlen) = stack[-1][0:2]
+            if net[0] > parent_end(start, prefixlen, bits):
+                # nothing after this can be merged with the networks on the stack
+                yield from stack
+                stack = []
+
+        stack.append(net)
+        while len(stack) >= 2:
+            (s1, p1, v1) = stack[-2][0:3]
+            (s2, p2, v2) = stack[-1][0:3]
+            if v1 != v2:
+                break
+            if p1 <= p2 and s2 >> (bits - p1) == s1 >> (bits - p1):
+                # covered
+                stack.pop()
+            elif (
+                p1 == p2
+                and p1 > 0
+                and s2 == s1 + (1 << (bits - p1))
+                and not s1 & (1 << (bits - p1))
+                and not (len(stack) >= 3 and tuple(stack[-3][0:2]) == (s1, p1 - 1))
+            ):
+                # siblings (their parent is not there with other values)
+                stack.pop()
+                stack[-1] = [s1, p1 - 1, v1, None]
+            else:
+                break
+    yield from stack
+
+
+def aggregate_rows(rows, version, counts=None):
+    # rows: (addr, prefixlen, cidr, values...) of database.cidr sorted by addr,
+    # yields the rows of the merged networks. counts gets the number of rows before and after.
+    bits = cidr_codec.BITS[version]
+    before = 0
+    after = 0
+
+    def networks():
+        nonlocal before
+        for row in rows:
+            before += 1
+            yield [cidr_codec.bin_to_int(row[0]), int(row[1]), tuple(row[3:]), row]
+
+    for (start, prefixlen, values, row) in aggregate(networks(), bits):
+        after += 1
+        if row:
+            yield row
+        else:
+            yield (
+                cidr_codec.int_to_bin(start, version),
+                str(prefixlen),
+                str(NETWORK[version]((start, prefixlen))),
+            ) + values
+
+    if counts is not None:
+        counts["before"] = counts.get("before", 0) + before
+        counts["after"] = counts.get("after", 0) + after
+
+
+def format_counts(name, counts):
+    before = counts.get("before", 0)
+    after = counts.get("after", 0)
+    return "%s: %d -> %d rows (-%.1f%%)" % (name, before, after, 100.0 * (before - after) / before if before else 0)
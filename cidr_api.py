@@ -4,6 +4,8 @@
 # python -m uvicorn cidr_api:app --reload --host 0.0.0.0
 #
 # ex.) curl -v http://localhost:8000/search?ipv4=192.168.3.2
+#      curl -v -X POST -H 'Content-Type: application/json' -d '{"ipaddrs": ["192.168.3.2", "2001:db8::1"]}' \
+#           http://localhost:8000/search
 #
 # hidekuno@gmail.com
 #
@@ -11,9 +13,19 @@ from fastapi import FastAPI, Request, Security, Depends, HTTPException
 from fastapi.security.api_key import APIKeyHeader
 from databases import Database
 import os
+import sys
+import signal
+import asyncio
 import ipaddress
-from pydantic import IPvAnyAddress
+from pydantic import IPvAnyAddress, BaseModel, Field
 import cidr_ipattr
+import cidr_codec
+import cidr_engine
+import cidr_mmdb
+import cidr_cache
+import cidr_reload
+import cidr_compact
+import cidr_open
 
 
 async def check_api(request: Request,
@@ -25,18 +37,131 @@ async def check_api(request: Request,
 
 
 app = FastAPI(dependencies=[Depends(check_api)])
-dbpath = os.path.join(os.environ.get("HOME"), "database.cidr")
-database = Database("sqlite:///" + dbpath)
+# CIDR_DATABASE=$HOME/database.compact searches the compact database made by cidr_create_compact.py
+dbpath = os.environ.get("CIDR_DATABASE", os.path.join(os.environ.get("HOME"), "database.cidr"))
+
+# The tables are loaded into an in-memory index at startup (on their start_addr) and
+# /search runs on the event loop without database I/O. CIDR_ENGINE=dir248 or trie loads
+# another index, CIDR_ENGINE=sql searches the tables through databases (aiosqlite) instead.
+# A database without start_addr (--tsv and init.sql) is searched as with CIDR_ENGINE=sql.
+engine_name = os.environ.get("CIDR_ENGINE", "memory")
+INDEX_ENGINES = ("memory", "dir248", "trie")
+
+# CIDR_MMDB=$HOME/database.mmdb searches the mmap file made by cidr_create_mmdb.py
+mmdbpath = os.environ.get("CIDR_MMDB")
+
+# A new database renamed into place is opened and swapped in (checked every
+# CIDR_RELOAD_INTERVAL seconds, 0 disables it), also on SIGHUP or POST /reload.
+reload_interval = float(os.environ.get("CIDR_RELOAD_INTERVAL", cidr_reload.DEFAULT_INTERVAL))
+reloader = None
+
+# the most addresses of a POST /search request
+BATCH_MAX_SIZE = int(os.environ.get("CIDR_BATCH_MAX_SIZE", 1000))
+# the most bound values in one statement of a batch
+# (SQLITE_MAX_VARIABLE_NUMBER of sqlite before 3.32)
+BATCH_KEYS = 999
+BATCH_TABLES = [
+    ("ipaddr_v%d", "cidr, country"),
+    ("asn_v%d", "provider, asn"),
+    ("city_v%d", "city"),
+]
+RECORD_COLUMNS = ("cidr", "country", "provider", "asn", "city")
+MERGED_BATCH_SQL = """
+with lookup(seq, addr) as (values %s)
+select l.seq, t.cidr, t.country, t.provider, t.asn, t.city
+from lookup l join ipgeo_v%d t on t.rowid =
+    (select rowid from ipgeo_v%d where start_addr <= l.addr order by start_addr desc limit 1)
+where t.end_addr >= l.addr and t.country is not null
+"""
+
+# CIDR_CACHE_SIZE=0 disables the cache, CIDR_CACHE_PREFIX=1 keys the mmdb results on their network
+cache = cidr_cache.LookupCache(
+    int(os.environ.get("CIDR_CACHE_SIZE", cidr_cache.DEFAULT_SIZE)),
+    bool(os.environ.get("CIDR_CACHE_PREFIX")),
+)
+
+
+class SearchBatch(BaseModel):
+    ipaddrs: list[str] = Field(..., max_length=BATCH_MAX_SIZE)
+
+
+class Backend(object):
+    def __init__(self, database=None, engine=None, merged=False):
+        self.database = database
+        self.engine = engine
+        self.merged = merged
+
+
+async def open_backend(path):
+    if mmdbpath:
+        return Backend(engine=cidr_mmdb.MmapEngine(path))
+    if engine_name != "sql":
+        # loaded in a thread, the old index goes on serving during a reload
+        engine = await asyncio.to_thread(load_index, path)
+        if engine:
+            return Backend(engine=engine)
+    if is_compact(path):
+        # the views of the compact database need the functions of cidr_compact.connect()
+        return Backend(engine=cidr_compact.CompactEngine(path))
+
+    database = Database("sqlite:///" + path)
+    await database.connect()
+    # ipgeo_v* are made by cidr_create_range.py --merge
+    merged = 2 == await database.fetch_val(
+        "select count(*) from sqlite_master where type='table' and name like 'ipgeo_v%'"
+    )
+    return Backend(database, None, merged)
+
+
+def load_index(path):
+    if engine_name not in INDEX_ENGINES:
+        raise RuntimeError("CIDR_ENGINE is one of %s or sql" % ", ".join(INDEX_ENGINES))
+
+    # None if the tables have no start_addr
+    conn = cidr_compact.connect_readonly(path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("pragma table_info(ipaddr_v4)")
+        if "start_addr" not in [r[1] for r in cursor.fetchall()]:
+            sys.stderr.write("%s has no start_addr (run cidr_create_range.py), searching it with sql\n" % path)
+            return None
+    finally:
+        conn.close()
+    return cidr_open.open_engine(engine_name, path)
+
+
+def is_compact(path):
+    conn = cidr_compact.connect_readonly(path)
+    try:
+        return cidr_compact.is_compact(conn.cursor())
+    finally:
+        conn.close()
+
+
+async def close_backend(backend):
+    if backend.engine:
+        backend.engine.close()
+    else:
+        await backend.database.disconnect()
 
 
 @app.on_event("startup")
 async def startup():
-    await database.connect()
+    global reloader
+    reloader = cidr_reload.AsyncReloader(
+        mmdbpath or dbpath, open_backend, close_backend, reload_interval, cache.clear
+    )
+    await reloader.open()
+    try:
+        signal.signal(signal.SIGHUP, lambda signum, frame: reloader.request())
+    except ValueError:
+        # not the main thread (TestClient)
+        pass
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await database.disconnect()
+    await reloader.close()
 
 
 @app.get("/")
@@ -44,22 +169,151 @@ def read_root():
     return {"Hello": "World"}
 
 
-@app.get("/search")
-async def read_ipgeo(ipv4: IPvAnyAddress):
-    attr = cidr_ipattr.IpAttribute(4)
-    param = attr.bin_addr(ipaddress.ip_address(ipv4))
+async def search_ipgeo(backend, ip):
+    if backend.engine:
+        return backend.engine.lookup(ip, True)
+
+    database = backend.database
+    if backend.merged:
+        # one probe, a missing ASN or city does not hide the country
+        query = f"""
+        select cidr, country, provider, asn, city
+        from (select * from ipgeo_v{ip.version} where start_addr <= :addr order by start_addr desc limit 1)
+        where end_addr >= :addr and country is not null
+        """
+        return await database.fetch_one(query=query, values={"addr": ip.packed})
+
+    attr = cidr_ipattr.IpAttribute(ip.version)
+    param = cidr_codec.bin_addr(ip)
 
-    query = """
+    query = f"""
     select cidr, country, provider, asn, city
     from
-    (select cidr, country from ipaddr_v4 where addr like :param_like and addr like substr(:param,1,prefixlen) || '%'),
-    (select provider, asn from asn_v4 where addr like :param_like and addr like substr(:param,1,prefixlen) || '%'),
-    (select city from city_v4 where addr like :param_like and addr like substr(:param,1,prefixlen) || '%')
+    (select cidr, country from ipaddr_v{ip.version}
+     where addr like :param_like and addr like substr(:param,1,prefixlen) || '%'),
+    (select provider, asn from asn_v{ip.version}
+     where addr like :param_like and addr like substr(:param,1,prefixlen) || '%'),
+    (select city from city_v{ip.version}
+     where addr like :param_like and addr like substr(:param,1,prefixlen) || '%')
     """
-    ipgeo = await database.fetch_one(
+    return await database.fetch_one(
         query=query, values={"param": param, "param_like": param[: attr.matches] + "%"}
     )
+
+
+async def fetch_networks(database, table, columns, addrs):
+    rows = {}
+    for i in range(0, len(addrs), BATCH_KEYS):
+        chunk = addrs[i: i + BATCH_KEYS]
+        query = "select addr, prefixlen, %s from %s where addr in (%s)" % (
+            columns, table, ",".join([":a%d" % n for n in range(len(chunk))])
+        )
+        values = dict([("a%d" % n, addr) for (n, addr) in enumerate(chunk)])
+        for row in await database.fetch_all(query=query, values=values):
+            rows[(row["addr"], row["prefixlen"])] = row
+    return rows
+
+
+async def search_ipgeo_many(backend, ips):
+    if backend.engine:
+        return backend.engine.lookup_many(ips, True)
+
+    database = backend.database
+    results = [None] * len(ips)
+    for version in (4, 6):
+        seqs = [i for (i, ip) in enumerate(ips) if ip.version == version]
+        if not seqs:
+            continue
+
+        if backend.merged:
+            # the addresses are joined as a VALUES table, one statement for each chunk
+            for n in range(0, len(seqs), BATCH_KEYS // 2):
+                chunk = seqs[n: n + BATCH_KEYS // 2]
+                values = {}
+                for i in chunk:
+                    values["s%d" % i] = i
+                    values["a%d" % i] = ips[i].packed
+                query = MERGED_BATCH_SQL % (
+                    ",".join(["(:s%d, :a%d)" % (i, i) for i in chunk]), version, version
+                )
+                for row in await database.fetch_all(query=query, values=values):
+                    results[row["seq"]] = row
+            continue
+
+        # the networks that can hold the addresses are searched on the addr index
+        attr = cidr_ipattr.IpAttribute(version)
+        prefixes = dict([(i, cidr_codec.prefix_addrs(ips[i], attr.matches)) for i in seqs])
+        addrs = sorted(set([addr for i in seqs for (addr, _) in prefixes[i]]))
+        found = [await fetch_networks(database, table % version, columns, addrs) for (table, columns) in BATCH_TABLES]
+        for i in seqs:
+            (country, asn, city) = [cidr_engine.match_prefix(prefixes[i], rows) for rows in found]
+            if country and asn and city:
+                results[i] = {
+                    "cidr": country["cidr"],
+                    "country": country["country"],
+                    "provider": asn["provider"],
+                    "asn": asn["asn"],
+                    "city": city["city"],
+                }
+    return results
+
+
+@app.get("/search")
+async def read_ipgeo(ipv4: IPvAnyAddress):
+    ip = ipaddress.ip_address(ipv4)
+    ipgeo = cache.get(ip, True)
+    if ipgeo is cidr_cache.MISS:
+        generation = cache.generation
+        async with reloader.use() as backend:
+            ipgeo = await search_ipgeo(backend, ip)
+        cache.put(ip, True, ipgeo, generation)
+
+    if isinstance(ipgeo, cidr_engine.GeoRecord):
+        ipgeo = cidr_engine.record_to_dict(ipgeo)
     if not ipgeo:
         raise HTTPException(status_code=404, detail="Ip not found")
 
     return ipgeo
+
+
+@app.post("/search")
+async def read_ipgeos(batch: SearchBatch):
+    ips = []
+    for (i, ipaddr) in enumerate(batch.ipaddrs):
+        try:
+            ips.append((i, ipaddress.ip_address(ipaddr)))
+        except ValueError:
+            pass
+
+    ipgeos = [cache.get(ip, True) for (_, ip) in ips]
+    misses = [n for (n, ipgeo) in enumerate(ipgeos) if ipgeo is cidr_cache.MISS]
+    if misses:
+        generation = cache.generation
+        async with reloader.use() as backend:
+            found = await search_ipgeo_many(backend, [ips[n][1] for n in misses])
+        for (n, ipgeo) in zip(misses, found):
+            cache.put(ips[n][1], True, ipgeo, generation)
+            ipgeos[n] = ipgeo
+
+    # in the order of ipaddrs, an error for each address instead of HTTPException
+    results = [{"ipaddr": ipaddr, "error": "Not IP address"} for ipaddr in batch.ipaddrs]
+    for ((i, _), ipgeo) in zip(ips, ipgeos):
+        if isinstance(ipgeo, cidr_engine.GeoRecord):
+            ipgeo = cidr_engine.record_to_dict(ipgeo)
+        if ipgeo:
+            # a dict or a row of the database
+            results[i] = dict([("ipaddr", batch.ipaddrs[i])] + [(k, ipgeo[k]) for k in RECORD_COLUMNS])
+        else:
+            results[i] = {"ipaddr": batch.ipaddrs[i], "error": "Ip not found"}
+    return results
+
+
+@app.get("/cache")
+def read_cache():
+    return cache.stats()
+
+
+@app.post("/reload")
+async def reload_database():
+    await reloader.reload()
+    return reloader.stats()
@@ -4,25 +4,44 @@
 #
 # hidekuno@gmail.com
 #
+import os
+import signal
+import asyncio
 from fastapi import FastAPI, Request, Security, Depends, HTTPException
 from fastapi.security.api_key import APIKeyHeader
 from pydantic import BaseModel, Field
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.sql import text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import text, bindparam, select
 from sqlalchemy import Column, String, SmallInteger, Integer
 from sqlalchemy.exc import IntegrityError
 from typing import TypeVar, Generic
 from ipaddress import IPv4Address, IPv6Address, IPv4Network, IPv6Network, ip_address, ip_network
 import cidr_ipattr
+import cidr_codec
+import cidr_engine
+import cidr_mmdb
+import cidr_cache
+import cidr_reload
+import cidr_compact
 
 
 T = TypeVar('T')
 
+# the most addresses of a POST /search request
+BATCH_MAX_SIZE = int(os.environ.get("CIDR_BATCH_MAX_SIZE", 1000))
+# the most addr values in one "addr in (...)" of a batch
+BATCH_KEYS = 5000
+BATCH_TABLES = [
+    ("ipaddr_v%d", "cidr, country"),
+    ("asn_v%d", "provider, asn"),
+    ("city_v%d", "city"),
+]
 
-def check_api(request: Request,
-              api_key: str = Security(APIKeyHeader(name='x-api-key', auto_error=False))):
+
+async def check_api(request: Request,
+                    api_key: str = Security(APIKeyHeader(name='x-api-key', auto_error=False))):
     safe_clients = ['127.0.0.1', '10.250.10.129', 'testclient']
     API_KEY = 'apitest'
 
@@ -45,15 +64,18 @@ class IpGeoModel(BaseModel, Generic[T]):
 
     def make_dictionary(self, version):
         m = self.model_dump()
-        attr = cidr_ipattr.IpAttribute(version)
         net_addr = ip_network(m['cidr'])
 
         m['cidr'] = str(m['cidr'])
-        m['addr'] = attr.bin_addr(net_addr.network_address)
+        m['addr'] = cidr_codec.bin_addr(net_addr.network_address)
         m['prefixlen'] = net_addr.prefixlen
         return m
 
 
+class SearchBatch(BaseModel):
+    ipaddrs: list[str] = Field(..., max_length=BATCH_MAX_SIZE)
+
+
 class Country(IpGeoModel[T]):
     country: str = Field(..., min_length=2, max_length=2)
 
@@ -134,7 +156,16 @@ def createMySQL():
     host = 'db'
     port = 3306
 
-    return create_engine(f'mysql+mysqlconnector://{user}:{password}@{host}:{port}/{db_name}')
+    # CIDR_DB_POOL_SIZE connections are kept, CIDR_DB_MAX_OVERFLOW more are opened under load.
+    # CIDR_DB_POOL_PRE_PING=0 skips the check of a connection taken from the pool,
+    # CIDR_DB_POOL_RECYCLE seconds (< wait_timeout of MySQL) replaces an old one.
+    return create_async_engine(
+        f'mysql+aiomysql://{user}:{password}@{host}:{port}/{db_name}',
+        pool_size=int(os.environ.get("CIDR_DB_POOL_SIZE", 10)),
+        max_overflow=int(os.environ.get("CIDR_DB_MAX_OVERFLOW", 20)),
+        pool_pre_ping=os.environ.get("CIDR_DB_POOL_PRE_PING", "1") == "1",
+        pool_recycle=int(os.environ.get("CIDR_DB_POOL_RECYCLE", 3600)),
+    )
 
 
 CN = TypeVar('CN', IPv4CountryTable, IPv6CountryTable)
@@ -157,44 +188,83 @@ You can process CRUD for IPV6 regional, ASN, and country.
 
 """
 app = FastAPI(title="GeoIP REST API",description=description,)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=createMySQL())
+db_engine = createMySQL()
+# the records are read after commit, they must not be expired (no lazy loading on AsyncSession)
+SessionLocal = sessionmaker(autoflush=False, bind=db_engine, class_=AsyncSession, expire_on_commit=False)
+
+# CIDR_CACHE_SIZE=0 disables the cache, CIDR_CACHE_PREFIX=1 keys the mmdb results on their network.
+# Every insert, update and delete clears it.
+search_cache = cidr_cache.LookupCache(
+    int(os.environ.get("CIDR_CACHE_SIZE", cidr_cache.DEFAULT_SIZE)),
+    bool(os.environ.get("CIDR_CACHE_PREFIX")),
+)
+
+# CIDR_MMDB=/app/database.mmdb searches the mmap file made by cidr_create_mmdb.py,
+# CIDR_COMPACT=/app/database.compact the database made by cidr_create_compact.py.
+# It is a read-only snapshot, CRUD requests do not change it. A new file renamed into place
+# is swapped in (checked every CIDR_RELOAD_INTERVAL seconds), also on SIGHUP or POST /reload.
+search_engine_class = cidr_mmdb.MmapEngine if os.environ.get("CIDR_MMDB") else cidr_compact.CompactEngine
+search_engine = cidr_reload.Reloader(
+    os.environ.get("CIDR_MMDB") or os.environ["CIDR_COMPACT"],
+    search_engine_class,
+    search_engine_class.close,
+    float(os.environ.get("CIDR_RELOAD_INTERVAL", cidr_reload.DEFAULT_INTERVAL)),
+    search_cache.clear,
+) if os.environ.get("CIDR_MMDB") or os.environ.get("CIDR_COMPACT") else None
+
+if search_engine:
+    try:
+        signal.signal(signal.SIGHUP, lambda signum, frame: search_engine.request())
+    except ValueError:
+        pass
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+def use_search_engine(search):
+    # the engines are synchronous (sqlite statements of CompactEngine, a reload opens the file),
+    # the handlers run it in a thread instead of the event loop
+    with search_engine.use() as engine:
+        return search(engine)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await db_engine.dispose()
+
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def do_insert(db: Session, record: Base):
-    do_insert_multi(db, [record])
+async def do_insert(db: AsyncSession, record: Base):
+    await do_insert_multi(db, [record])
 
 
-def do_insert_multi(db: Session, records: list[Base]):
+async def do_insert_multi(db: AsyncSession, records: list[Base]):
     try:
         for record in records:
             db.add(record)
-        db.commit()
+        await db.commit()
+        search_cache.clear()
         for record in records:
-            db.refresh(record)
+            await db.refresh(record)
     except IntegrityError as e:
-        # 23000 is duplicate error of MySQL
-        if e.orig.sqlstate == '23000':
+        # 1062 is duplicate error of MySQL (ER_DUP_ENTRY)
+        if e.orig.args[0] == 1062:
             raise HTTPException(status_code=422, detail='Duplicate Error')
         else:
             raise e
 
 
-def do_delete(db: Session, record: Base):
-    do_delete_multi(db, [record])
+async def do_delete(db: AsyncSession, record: Base):
+    await do_delete_multi(db, [record])
 
 
-def do_delete_multi(db: Session, records: list[Base]):
+async def do_delete_multi(db: AsyncSession, records: list[Base]):
     for record in records:
-        db.delete(record)
-    db.commit()
+        await db.delete(record)
+    await db.commit()
+    search_cache.clear()
 
 
 def do_update_country(country: Generic[CN], values: dict):
@@ -219,18 +289,22 @@ def do_update_city(city: Generic[CITY], values: dict):
     city.city = values["city"]
 
 
-def get_ip_records(db: Session, cidr: str, CN, ASN, CITY):
-    country = db.query(CN).filter(CN.cidr == cidr).first()
-    asn = db.query(ASN).filter(ASN.cidr == cidr).first()
-    city = db.query(CITY).filter(CITY.cidr == cidr).first()
+async def get_ip_record(db: AsyncSession, table: Base, cidr: str):
+    return (await db.execute(select(table).filter(table.cidr == cidr))).scalars().first()
+
+
+async def get_ip_records(db: AsyncSession, cidr: str, CN, ASN, CITY):
+    country = await get_ip_record(db, CN, cidr)
+    asn = await get_ip_record(db, ASN, cidr)
+    city = await get_ip_record(db, CITY, cidr)
     if not country or not asn or not city:
         raise HTTPException(status_code=404, detail="IP not found")
 
     return (country, asn, city)
 
 
-def do_all_insert(values: dict, db: Session, CN, ASN, CITY):
-    do_insert_multi(
+async def do_all_insert(values: dict, db: AsyncSession, CN, ASN, CITY):
+    await do_insert_multi(
         db,
         [
             CN(
@@ -257,18 +331,22 @@ def do_all_insert(values: dict, db: Session, CN, ASN, CITY):
     return values
 
 
-def do_all_update(values: dict, cidr: str, db: Session, CN, ASN, CITY):
-    (country, asn, city) = get_ip_records(db, cidr, CN, ASN, CITY)
+async def do_all_update(values: dict, cidr: str, db: AsyncSession, CN, ASN, CITY):
+    (country, asn, city) = await get_ip_records(db, cidr, CN, ASN, CITY)
 
     do_update_country(country, values)
     do_update_asn(asn, values)
     do_update_city(city, values)
 
-    db.commit()
+    await db.commit()
+    search_cache.clear()
     return values
 
 
-def search_query(db: Session, ipaddress: IPADDRESS, version: int):
+async def fetch_ipgeo(db: AsyncSession, ipaddress: IPADDRESS, version: int):
+    if search_engine:
+        return await asyncio.to_thread(use_search_engine, lambda engine: engine.lookup(ipaddress, True))
+
     query = f"""
     select cidr, country, provider, asn, city
     from
@@ -280,179 +358,287 @@ def search_query(db: Session, ipaddress: IPADDRESS, version: int):
      where addr like :param_like and addr like concat(substring(:param,1,prefixlen),'%')) as city
     """
     attr = cidr_ipattr.IpAttribute(version)
-    param = attr.bin_addr(ipaddress)
+    param = cidr_codec.bin_addr(ipaddress)
 
     ipgeo = (
-        db.execute(
+        await db.execute(
             text(query), {"param": param, "param_like": param[: attr.matches] + "%"}
         )
-        .mappings()
-        .first()
-    )
+    ).mappings().first()
+    return dict(ipgeo) if ipgeo else None
+
+
+async def search_query(db: AsyncSession, ipaddress: IPADDRESS, version: int):
+    ipgeo = search_cache.get(ipaddress, True)
+    if ipgeo is cidr_cache.MISS:
+        generation = search_cache.generation
+        ipgeo = await fetch_ipgeo(db, ipaddress, version)
+        search_cache.put(ipaddress, True, ipgeo, generation)
+
+    if isinstance(ipgeo, cidr_engine.GeoRecord):
+        ipgeo = cidr_engine.record_to_dict(ipgeo)
     if not ipgeo:
         raise HTTPException(status_code=404, detail="IP not found")
     return ipgeo
 
 
+async def fetch_networks(db: AsyncSession, table: str, columns: str, addrs: list[str]):
+    query = text(f"select addr, prefixlen, {columns} from {table} where addr in :addrs").bindparams(
+        bindparam("addrs", expanding=True)
+    )
+    rows = {}
+    for i in range(0, len(addrs), BATCH_KEYS):
+        for row in (await db.execute(query, {"addrs": addrs[i: i + BATCH_KEYS]})).mappings():
+            rows[(row["addr"], row["prefixlen"])] = row
+    return rows
+
+
+async def fetch_ipgeo_many(db: AsyncSession, ipaddrs: list):
+    if search_engine:
+        return await asyncio.to_thread(use_search_engine, lambda engine: engine.lookup_many(ipaddrs, True))
+
+    # one statement for each table and family instead of the LIKE query for each address:
+    # the networks that can hold the addresses are searched on the primary key
+    results = [None] * len(ipaddrs)
+    for version in (4, 6):
+        seqs = [i for (i, ip) in enumerate(ipaddrs) if ip.version == version]
+        if not seqs:
+            continue
+
+        attr = cidr_ipattr.IpAttribute(version)
+        prefixes = dict([(i, cidr_codec.prefix_addrs(ipaddrs[i], attr.matches)) for i in seqs])
+        addrs = sorted(set([addr for i in seqs for (addr, _) in prefixes[i]]))
+        found = [await fetch_networks(db, table % version, columns, addrs) for (table, columns) in BATCH_TABLES]
+
+        for i in seqs:
+            (country, asn, city) = [cidr_engine.match_prefix(prefixes[i], rows) for rows in found]
+            if country and asn and city:
+                results[i] = {
+                    "cidr": country["cidr"],
+                    "country": country["country"],
+                    "provider": asn["provider"],
+                    "asn": asn["asn"],
+                    "city": city["city"],
+                }
+    return results
+
+
+async def search_query_many(db: AsyncSession, ipaddrs: list[str]):
+    ips = []
+    for (i, ipaddr) in enumerate(ipaddrs):
+        try:
+            ips.append((i, ip_address(ipaddr)))
+        except ValueError:
+            pass
+
+    ipgeos = [search_cache.get(ip, True) for (_, ip) in ips]
+    misses = [n for (n, ipgeo) in enumerate(ipgeos) if ipgeo is cidr_cache.MISS]
+    generation = search_cache.generation
+    for (n, ipgeo) in zip(misses, await fetch_ipgeo_many(db, [ips[n][1] for n in misses])):
+        search_cache.put(ips[n][1], True, ipgeo, generation)
+        ipgeos[n] = ipgeo
+
+    # in the order of ipaddrs, an error for each address instead of HTTPException
+    results = [{"ipaddr": ipaddr, "error": "Not IP address"} for ipaddr in ipaddrs]
+    for ((i, _), ipgeo) in zip(ips, ipgeos):
+        if isinstance(ipgeo, cidr_engine.GeoRecord):
+            ipgeo = cidr_engine.record_to_dict(ipgeo)
+        results[i] = dict(ipaddr=ipaddrs[i], **ipgeo) if ipgeo else {"ipaddr": ipaddrs[i], "error": "IP not found"}
+    return results
+
+
 @app.get("/")
-def read_root():
+async def read_root():
     """
     Root endpoint. Returns a simple greeting message.
     """
     return "Hello,World"
 
 
+@app.get("/cache", dependencies=[Depends(check_api)])
+async def read_cache():
+    """
+    Returns the hit, miss and eviction counters of the search cache.
+    """
+    return search_cache.stats()
+
+
+@app.post("/reload", dependencies=[Depends(check_api)])
+def reload_engine():
+    """
+    Opens the mmap database file (CIDR_MMDB) again and clears the search cache.
+    Searches in progress finish on the old file.
+    """
+    if not search_engine:
+        raise HTTPException(status_code=400, detail="CIDR_MMDB is not set")
+    search_engine.reload()
+    return search_engine.stats()
+
+
 @app.get("/ipv4/search")
-def read_ipv4(ipv4: IPv4Address, db: Session = Depends(get_db)):
+async def read_ipv4(ipv4: IPv4Address, db: AsyncSession = Depends(get_db)):
     """
     Searches IPv4 address information.
 
     - **ipv4**: The IPv4 address.
     """
-    return search_query(db, ip_address(ipv4), 4)
+    return await search_query(db, ip_address(ipv4), 4)
+
+
+@app.post("/search")
+async def search_ipaddrs(batch: SearchBatch, db: AsyncSession = Depends(get_db)):
+    """
+    Searches IPv4 and IPv6 addresses in one request.
+
+    - **ipaddrs**: The addresses, at most CIDR_BATCH_MAX_SIZE (1000).
+
+    The results are in the order of the addresses, an address that is not
+    valid or not found has an error instead of the columns.
+    """
+    return await search_query_many(db, batch.ipaddrs)
 
 
 @app.post("/ipv4/country", response_model=Country[IPv4Network], dependencies=[Depends(check_api)])
-def create_country_ipv4(country: Country[IPv4Network], db: Session = Depends(get_db)):
+async def create_country_ipv4(country: Country[IPv4Network], db: AsyncSession = Depends(get_db)):
     """
     Creates a new IPv4 country record.
 
     - **country**: The country data including CIDR.
     """
     values = country.make_dictionary(4)
-    do_insert(db, IPv4CountryTable(**values))
+    await do_insert(db, IPv4CountryTable(**values))
     return values
 
 
 @app.post("/ipv4/asn", response_model=Asn[IPv4Network], dependencies=[Depends(check_api)])
-def create_asn_ipv4(asn: Asn[IPv4Network], db: Session = Depends(get_db)):
+async def create_asn_ipv4(asn: Asn[IPv4Network], db: AsyncSession = Depends(get_db)):
     """
     Creates a new IPv4 ASN record.
 
     - **asn**: The ASN data including CIDR.
     """
     values = asn.make_dictionary(4)
-    do_insert(db, IPv4AsnTable(**values))
+    await do_insert(db, IPv4AsnTable(**values))
     return values
 
 
 @app.post("/ipv4/city", response_model=City[IPv4Network], dependencies=[Depends(check_api)])
-def create_city_ipv4(city: City[IPv4Network], db: Session = Depends(get_db)):
+async def create_city_ipv4(city: City[IPv4Network], db: AsyncSession = Depends(get_db)):
     """
     Creates a new IPv4 city record.
 
     - **city**: The city data including CIDR.
     """
     values = city.make_dictionary(4)
-    do_insert(db, IPv4CityTable(**values))
+    await do_insert(db, IPv4CityTable(**values))
     return values
 
 
 @app.post("/ipv4", response_model=IpGeo[IPv4Network], dependencies=[Depends(check_api)])
-def create_ipv4(ipgeo: IpGeo[IPv4Network], db: Session = Depends(get_db)):
+async def create_ipv4(ipgeo: IpGeo[IPv4Network], db: AsyncSession = Depends(get_db)):
     """
     Creates a new IPv4 record with country, ASN, and city information.
 
     - **ipgeo**: The IP geolocation data including CIDR.
     """
-    return do_all_insert(ipgeo.make_dictionary(4), db, IPv4CountryTable, IPv4AsnTable, IPv4CityTable)
+    return await do_all_insert(ipgeo.make_dictionary(4), db, IPv4CountryTable, IPv4AsnTable, IPv4CityTable)
 
 
 @app.delete("/ipv4", status_code=200, dependencies=[Depends(check_api)])
-def delete_ipv4(cidr: IPv4Network, db: Session = Depends(get_db)):
+async def delete_ipv4(cidr: IPv4Network, db: AsyncSession = Depends(get_db)):
     """
     Deletes an existing IPv4 record.
 
     - **cidr**: The CIDR of the record to delete.
     """
-    do_delete_multi(db, list(get_ip_records(db, str(cidr), IPv4CountryTable, IPv4AsnTable, IPv4CityTable)))
+    await do_delete_multi(db, list(await get_ip_records(db, str(cidr), IPv4CountryTable, IPv4AsnTable, IPv4CityTable)))
     return "OK"
 
 
 @app.put("/ipv4", response_model=IpGeo[IPv4Network], dependencies=[Depends(check_api)])
-def update_ipv4(cidr: IPv4Network, ipgeo: IpGeo[IPv4Network], db: Session = Depends(get_db)):
+async def update_ipv4(cidr: IPv4Network, ipgeo: IpGeo[IPv4Network], db: AsyncSession = Depends(get_db)):
     """
     Updates an existing IPv4 record.
 
     - **cidr**: The CIDR of the record to update.
     - **ipgeo**: The new IP geolocation data.
     """
-    return do_all_update(ipgeo.make_dictionary(4), str(cidr), db, IPv4CountryTable, IPv4AsnTable, IPv4CityTable)
+    return await do_all_update(ipgeo.make_dictionary(4), str(cidr), db, IPv4CountryTable, IPv4AsnTable, IPv4CityTable)
 
 
 @app.get("/ipv6/search")
-def read_ipv6(ipv6: IPv6Address, db: Session = Depends(get_db)):
+async def read_ipv6(ipv6: IPv6Address, db: AsyncSession = Depends(get_db)):
     """
     Searches IPv6 address information.
 
     - **ipv6**: The IPv6 address to search for.
     """
-    return search_query(db, ip_address(ipv6), 6)
+    return await search_query(db, ip_address(ipv6), 6)
 
 
 @app.post("/ipv6/country", response_model=Country[IPv6Network], dependencies=[Depends(check_api)])
-def create_country_ipv6(country: Country[IPv6Network], db: Session = Depends(get_db)):
+async def create_country_ipv6(country: Country[IPv6Network], db: AsyncSession = Depends(get_db)):
     """
     Creates a new IPv6 country record.
 
     - **country**: The country data including CIDR.
     """
     values = country.make_dictionary(6)
-    do_insert(db, IPv6CountryTable(**values))
+    await do_insert(db, IPv6CountryTable(**values))
     return values
 
 
 @app.post("/ipv6/asn", response_model=Asn[IPv6Network], dependencies=[Depends(check_api)])
-def create_asn_ipv6(asn: Asn[IPv6Network], db: Session = Depends(get_db)):
+async def create_asn_ipv6(asn: Asn[IPv6Network], db: AsyncSession = Depends(get_db)):
     """
     Creates a new IPv6 ASN record.
 
     - **asn**: The ASN data including CIDR.
     """
     values = asn.make_dictionary(6)
-    do_insert(db, IPv6AsnTable(**values))
+    await do_insert(db, IPv6AsnTable(**values))
     return values
 
 
 @app.post("/ipv6/city", response_model=City[IPv6Network], dependencies=[Depends(check_api)])
-def create_city_ipv6(city: City[IPv6Network], db: Session = Depends(get_db)):
+async def create_city_ipv6(city: City[IPv6Network], db: AsyncSession = Depends(get_db)):
     """
     Creates a new IPv6 city record.
 
     - **city**: The city data including CIDR.
     """
     values = city.make_dictionary(6)
-    do_insert(db, IPv6CityTable(**values))
+    await do_insert(db, IPv6CityTable(**values))
     return values
 
 
 @app.post("/ipv6", response_model=IpGeo[IPv6Network], dependencies=[Depends(check_api)])
-def create_ipv6(ipgeo: IpGeo[IPv6Network], db: Session = Depends(get_db)):
+async def create_ipv6(ipgeo: IpGeo[IPv6Network], db: AsyncSession = Depends(get_db)):
     """
     Creates a new IPv6 record with country, ASN, and city information.
 
     - **ipgeo**: The IP geolocation data including CIDR.
     """
-    return do_all_insert(ipgeo.make_dictionary(6), db, IPv6CountryTable, IPv6AsnTable, IPv6CityTable)
+    return await do_all_insert(ipgeo.make_dictionary(6), db, IPv6CountryTable, IPv6AsnTable, IPv6CityTable)
 
 
 @app.delete("/ipv6", status_code=200, dependencies=[Depends(check_api)])
-def delete_ipv6(cidr: IPv6Network, db: Session = Depends(get_db)):
+async def delete_ipv6(cidr: IPv6Network, db: AsyncSession = Depends(get_db)):
     """
     Deletes an existing IPv6 record.
 
     - **cidr**: The CIDR of the record to delete.
     """
-    do_delete_multi(db, list(get_ip_records(db, str(cidr), IPv6CountryTable, IPv6AsnTable, IPv6CityTable)))
+    await do_delete_multi(db, list(await get_ip_records(db, str(cidr), IPv6CountryTable, IPv6AsnTable, IPv6CityTable)))
     return "OK"
 
 
 @app.put("/ipv6", response_model=IpGeo[IPv6Network], dependencies=[Depends(check_api)])
-def update_ipv6(cidr: IPv6Network, ipgeo: IpGeo[IPv6Network], db: Session = Depends(get_db)):
+async def update_ipv6(cidr: IPv6Network, ipgeo: IpGeo[IPv6Network], db: AsyncSession = Depends(get_db)):
     """
     Updates an existing IPv6 record.
 
     - **cidr**: The CIDR of the record to update.
     - **ipgeo**: The new IP geolocation data.
     """
-    return do_all_update(ipgeo.make_dictionary(6), str(cidr), db, IPv6CountryTable, IPv6AsnTable, IPv6CityTable)
+    return await do_all_update(ipgeo.make_dictionary(6), str(cidr), db, IPv6CountryTable, IPv6AsnTable, IPv6CityTable)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# LRU lookup cache
+#
+# hidekuno@gmail.com
+#
+import collections
+import threading
+import cidr_engine
+
+DEFAULT_SIZE = 65536
+MISS = object()
+
+
+class LookupCache(object):
+    # prefix=True keys a GeoRecord on its matched network (GeoRecord.prefixlen),
+    # so every address of that network hits the same entry. This holds when
+    # the networks of a table do not overlap, as in GeoLite2.
+    def __init__(self, maxsize=DEFAULT_SIZE, prefix=False):
+        self.maxsize = maxsize
+        self.prefix = prefix
+        self.entries = collections.OrderedDict()
+        self.prefixlens = {4: collections.Counter(), 6: collections.Counter()}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # clear() counts up, a value searched before a clear is not put
+        self.generation = 0
+
+    def make_key(self, ip, prefixlen, city_mode):
+        return (ip.version, int(ip) >> (ip.max_prefixlen - prefixlen), prefixlen, city_mode)
+
+    def get(self, ip, city_mode=False):
+        with self.lock:
+            if self.prefix:
+                prefixlens = sorted(self.prefixlens[ip.version], reverse=True)
+            else:
+                prefixlens = [ip.max_prefixlen]
+
+            for prefixlen in prefixlens:
+                key = self.make_key(ip, prefixlen, city_mode)
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key]
+            self.misses += 1
+        return MISS
+
+    def put(self, ip, city_mode, value, generation=None):
+        if self.maxsize <= 0:
+            return
+
+        if self.prefix and isinstance(value, cidr_engine.GeoRecord):
+            prefixlen = value.prefixlen
+        else:
+            prefixlen = ip.max_prefixlen
+        key = self.make_key(ip, prefixlen, city_mode)
+
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key not in self.entries:
+                self.prefixlens[ip.version][prefixlen] += 1
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                ((version, _, prefixlen, _), _) = self.entries.popitem(last=False)
+                self.prefixlens[version][prefixlen] -= 1
+                if not self.prefixlens[version][prefixlen]:
+                    del self.prefixlens[version][prefixlen]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            for counter in self.prefixlens.values():
+                counter.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "generation": self.generation,
+        }
+
+
+class CachedEngine(cidr_engine.SearchEngine):
+    def __init__(self, engine, maxsize=DEFAULT_SIZE, prefix=False):
+        self.engine = engine
+        self.cache = LookupCache(maxsize, prefix)
+
+    def has_city(self):
+        return self.engine.has_city()
+
+    def find_country(self, ip):
+        return self.engine.find_country(ip)
+
+    def find_asn(self, ip):
+        return self.engine.find_asn(ip)
+
+    def find_city(self, ip):
+        return self.engine.find_city(ip)
+
+    def lookup(self, ip, city_mode=False):
+        rec = self.cache.get(ip, city_mode)
+        if rec is MISS:
+            rec = self.engine.lookup(ip, city_mode)
+            self.cache.put(ip, city_mode, rec)
+        return rec
+
+    def lookup_many(self, ips, city_mode=False):
+        results = [self.cache.get(ip, city_mode) for ip in ips]
+        misses = [i for (i, rec) in enumerate(results) if rec is MISS]
+        recs = self.engine.lookup_many([ips[i] for i in misses], city_mode)
+        for (i, rec) in zip(misses, recs):
+            self.cache.put(ips[i], city_mode, rec)
+            results[i] = rec
+        return results
+
+    def close(self):
+        self.engine.close()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Address codec on integers and packed bytes.
+# bin_addr() is the addr column format of database.cidr
+# (the address as a 32 or 128 character binary string).
+#
+# hidekuno@gmail.com
+#
+import socket
+import ipaddress
+
+FAMILY = {4: socket.AF_INET, 6: socket.AF_INET6}
+BITS = {4: 32, 6: 128}
+BIN_FORMAT = {4: "032b", 6: "0128b"}
+
+
+def get_version(addr):
+    return 6 if ":" in addr else 4
+
+
+def pack(addr, version=None):
+    version = version or get_version(addr)
+    return socket.inet_pton(FAMILY[version], addr)
+
+
+def to_int(addr, version=None):
+    return int.from_bytes(pack(addr, version), "big")
+
+
+def int_to_bin(n, version):
+    return format(n, BIN_FORMAT[version])
+
+
+def bin_to_int(addr):
+    return int(addr, 2)
+
+
+def int_to_packed(n, version):
+    return n.to_bytes(BITS[version] // 8, "big")
+
+
+def int_to_text(n, version):
+    if version == 4:
+        return socket.inet_ntop(socket.AF_INET, int_to_packed(n, 4))
+    # the text of ipaddress (inet_ntop writes ::ffff:1.2.3.4 for the mapped addresses)
+    return str(ipaddress.IPv6Address(n))
+
+
+def bin_addr(ip):
+    # ip: ipaddress.IPv4Address or IPv6Address
+    return format(int(ip), BIN_FORMAT[ip.version])
+
+
+def parse_cidr(cidr, version=None):
+    # "192.0.2.0/24" -> (network address as int, prefixlen), host bits are cleared
+    (addr, prefixlen) = cidr.split("/")
+    version = version or get_version(addr)
+    prefixlen = int(prefixlen)
+    bits = BITS[version]
+    if not 0 <= prefixlen <= bits:
+        raise ValueError("invalid prefixlen: %s" % cidr)
+
+    n = to_int(addr, version)
+    return (n >> (bits - prefixlen) << (bits - prefixlen), prefixlen)
+
+
+def cidr_range(cidr, version=None):
+    # "192.0.2.0/24" -> (first address, last address) as int
+    version = version or get_version(cidr)
+    (n, prefixlen) = parse_cidr(cidr, version)
+    return (n, n | ((1 << (BITS[version] - prefixlen)) - 1))
+
+
+def summarize_range(start, end, version):
+    # start..end (int) -> [(network address as int, prefixlen)], like ipaddress.summarize_address_range
+    bits = BITS[version]
+    networks = []
+    while start <= end:
+        size = min((start & -start).bit_length() - 1 if start else bits, (end - start + 1).bit_length() - 1)
+        networks.append((start, bits - size))
+        start += 1 << size
+    return networks
+
+
+def prefix_addrs(ip, min_prefixlen=0):
+    # the addr column of every network that can hold ip, longest prefix first:
+    # [(addr, prefixlen)], a batch searches them with "addr in (...)" on the addr index
+    n = int(ip)
+    bits = ip.max_prefixlen
+    return [
+        (format(n >> (bits - p) << (bits - p), BIN_FORMAT[ip.version]), p)
+        for p in range(bits, min_prefixlen - 1, -1)
+    ]
+
+
+def encoder(version):
+    # returns a function "192.0.2.0/24" -> (addr, prefixlen as str) for the rows of a CSV file
+    family = FAMILY[version]
+    bits = BITS[version]
+    fmt = BIN_FORMAT[version]
+    inet_pton = socket.inet_pton
+    from_bytes = int.from_bytes
+
+    def encode(cidr):
+        (addr, prefixlen) = cidr.split("/")
+        shift = bits - int(prefixlen)
+        return (format(from_bytes(inet_pton(family, addr), "big") >> shift << shift, fmt), prefixlen)
+
+    return encode
+
+
+def encode_cidrs(cidrs, version):
+    # batch encoder for a CSV network column: yields (addr, prefixlen)
+    return map(encoder(version), cidrs)
+
+
+def encode_ranges(cidrs, version):
+    # batch encoder for start_addr/end_addr: yields (packed start, packed end)
+    size = BITS[version] // 8
+    for cidr in cidrs:
+        (start, end) = cidr_range(cidr, version)
+        yield (start.to_bytes(size, "big"), end.to_bytes(size, "big"))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Compact database: the networks are packed start_addr/end_addr blobs, the attributes are ids
+# of the deduplicated countries, providers and cities tables. ipaddr_v*, asn_v* and city_v*
+# are views with the columns of database.cidr (after cidr_create_range.py), addr and cidr
+# are made by functions of connect(), so the readers open it with connect().
+#
+# ex.) python cidr_create_compact.py -d database.cidr -o database.compact
+#
+# hidekuno@gmail.com
+#
+import os
+import sqlite3
+import urllib.parse
+import ipaddress
+import threading
+import cidr_codec
+import cidr_engine
+
+CACHE_SIZE_KB = 131072
+
+# (view, dictionary table, id column, attribute columns)
+TABLES = (
+    ("ipaddr_v%d", "countries", "country_id", ("country",)),
+    ("asn_v%d", "providers", "provider_id", ("asn", "provider")),
+    ("city_v%d", "cities", "city_id", ("city",)),
+)
+
+
+def bin_text(packed):
+    return cidr_codec.int_to_bin(int.from_bytes(packed, "big"), 4 if len(packed) == 4 else 6)
+
+
+def cidr_text(packed, prefixlen):
+    return "%s/%d" % (ipaddress.ip_address(packed), prefixlen)
+
+
+def connect(path, **kwargs):
+    conn = sqlite3.connect(path, **kwargs)
+    conn.create_function("bin_text", 1, bin_text, deterministic=True)
+    conn.create_function("cidr_text", 2, cidr_text, deterministic=True)
+    return conn
+
+
+def connect_readonly(path):
+    # a wrong path fails here instead of leaving an empty database behind
+    return connect("file:%s?mode=ro" % urllib.parse.quote(os.path.abspath(path)), uri=True)
+
+
+def is_compact(cursor):
+    cursor.execute("select count(*) from sqlite_master where type='table' and name='countries'")
+    return cursor.fetchone()[0] == 1
+
+
+def create_table(cursor, view, dictionary, id_column, columns):
+    table = "net_" + view
+    cursor.execute(
+        "create table %s (start_addr blob, end_addr blob, prefixlen smallint, %s int)" % (table, id_column)
+    )
+    # rowid is there for the batch statements of cidr_engine.RangeEngine
+    cursor.execute(
+        "create view %s as select n.rowid as rowid, bin_text(n.start_addr) as addr, n.prefixlen,"
+        " cidr_text(n.start_addr, n.prefixlen) as cidr, %s, n.start_addr, n.end_addr"
+        " from %s n join %s d on d.id = n.%s"
+        % (view, ", ".join(["d." + c for c in columns]), table, dictionary, id_column)
+    )
+
+
+def make_rows(cursor, view, columns, version, ids):
+    cursor.execute("select cidr, prefixlen, %s from %s order by addr" % (", ".join(columns), view))
+    for r in cursor:
+        values = tuple(r[2:])
+        if values not in ids:
+            ids[values] = len(ids) + 1
+        (start, end) = cidr_codec.cidr_range(r[0], version)
+        yield (
+            cidr_codec.int_to_packed(start, version),
+            cidr_codec.int_to_packed(end, version),
+            r[1],
+            ids[values],
+        )
+
+
+def write_database(cursor, path):
+    # cursor: database.cidr, the compact database is built in path.tmp and renamed to path
+    tmppath = path + ".tmp"
+    if os.path.exists(tmppath):
+        os.remove(tmppath)
+
+    cursor.execute("select name from sqlite_master where type='table'")
+    tables = [r[0] for r in cursor.fetchall()]
+    conn = connect(tmppath)
+    conn.execute("pragma journal_mode=OFF")
+    conn.execute("pragma synchronous=OFF")
+    conn.execute("pragma cache_size=-%d" % CACHE_SIZE_KB)
+    out = conn.cursor()
+    for (view, dictionary, id_column, columns) in TABLES:
+        # the ids are shared by IPv4 and IPv6
+        ids = {}
+        out.execute("create table %s (id integer primary key, %s)" % (dictionary, ", ".join(columns)))
+        for version in (4, 6):
+            if view % version not in tables:
+                continue
+            create_table(out, view % version, dictionary, id_column, columns)
+            out.executemany(
+                "insert into net_%s values (?, ?, ?, ?)" % (view % version),
+                make_rows(cursor, view % version, columns, version, ids),
+            )
+            out.execute("create index net_%s_idx1 on net_%s(start_addr)" % (view % version, view % version))
+        out.executemany(
+            "insert into %s values (?, %s)" % (dictionary, ",".join(["?"] * len(columns))),
+            [(i,) + values for (values, i) in ids.items()],
+        )
+    conn.commit()
+    out.execute("analyze")
+    out.execute("vacuum")
+    conn.close()
+    os.replace(tmppath, path)
+
+
+class CompactEngine(cidr_engine.SearchEngine):
+    # a RangeEngine on the views for each thread (the handlers of cidr_api2 run in a thread pool)
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.engines = []
+        self.lock = threading.Lock()
+        self.city_mode = self.get_engine().has_city()
+
+    def get_engine(self):
+        engine = getattr(self.local, "engine", None)
+        if engine is None:
+            engine = cidr_engine.RangeEngine(connect(self.path, check_same_thread=False).cursor())
+            with self.lock:
+                self.engines.append(engine)
+            self.local.engine = engine
+        return engine
+
+    def has_city(self):
+        return self.city_mode
+
+    def find_country(self, ip):
+        return self.get_engine().find_country(ip)
+
+    def find_asn(self, ip):
+        return self.get_engine().find_asn(ip)
+
+    def find_city(self, ip):
+        return self.get_engine().find_city(ip)
+
+    def lookup_many(self, ips, city_mode=False):
+        return self.get_engine().lookup_many(ips, city_mode)
+
+    def close(self):
+        with self.lock:
+            for engine in self.engines:
+                engine.close()
+            self.engines = []
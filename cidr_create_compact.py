@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Write database.cidr out as the compact database (cidr_compact.py)
+#
+# hidekuno@gmail.com
+#
+import os
+import sys
+import sqlite3
+import argparse
+import traceback
+import cidr_compact
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        dest="dbpath",
+        default=os.path.join(os.environ.get("HOME"), "database.cidr"),
+        required=False,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        dest="compactpath",
+        default=os.path.join(os.environ.get("HOME"), "database.compact"),
+        required=False,
+    )
+    args = parser.parse_args(sys.argv[1:])
+
+    try:
+        conn = sqlite3.connect(args.dbpath)
+        cidr_compact.write_database(conn.cursor(), args.compactpath)
+        conn.close()
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -6,13 +6,21 @@
 #
 import os
 import os.path
+import io
 import sys
+import time
+import sqlite3
+import itertools
+import concurrent.futures
 import zipfile
-import urllib.request
+import urllib.parse
 import argparse
 import traceback
-import ipaddress
+import cidr_codec
+import cidr_aggregate
+import cidr_download
 import cidr_ipattr
+import cidr_create_range
 import csv
 
 WORK_DIR = os.path.join(os.sep, "tmp")
@@ -47,91 +55,550 @@ IPV6_GROUP = (
     GEOIP_CITY_IPV6_FILE,
 )
 
+ASN_TABLE = "asn_v%d"
+CACHE_SIZE_KB = 131072
+DELTA_BATCH = 10000
+COLUMNS = {
+    "ipaddr": "country char(2)",
+    "asn": "asn int, provider text",
+    "city": "city text",
+}
+
+
+def get_target(args):
+    # what an edition is built into with --tsv or --mysql, a release is built once for each
+    if args.tsv:
+        target = "tsv:" + os.path.abspath(WORK_DIR)
+    else:
+        target = "mysql:" + args.mysql.split("@")[-1]
+    return target + (" aggregate" if args.aggregate else "")
+
+
+def get_edition_obj(geofile):
+    if geofile == COUNTRY_CSV:
+        return Country()
+    if geofile == CITY_CSV:
+        return City()
+    return None
+
+
+def get_stamps(geofile, sha256, args):
+    # the build_stamp rows of the tables of an edition
+    stamp = "%s %s%s" % (geofile, sha256, " aggregate" if args.aggregate else "")
+    obj = get_edition_obj(geofile)
+    return {get_table_name(obj, version): stamp for version in (4, 6)}
+
+
+def read_stamps(dbpath):
+    # the stamps of the tables that are in the database, {} without it
+    if not os.path.exists(dbpath):
+        return {}
+    conn = sqlite3.connect("file:%s?mode=ro" % urllib.parse.quote(os.path.abspath(dbpath)), uri=True)
+    try:
+        cursor = conn.execute(
+            "select s.name, s.stamp from build_stamp s"
+            " join sqlite_master m on m.type = 'table' and m.name = s.name"
+        )
+        return dict(cursor.fetchall())
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+
+
+def write_stamps(cursor, tables, stamps):
+    # tables were rebuilt, the ones without a stamp (cidr_create_rir.py etc.) lose the old one
+    cursor.execute("create table if not exists build_stamp (name text primary key, stamp text)")
+    cursor.executemany("delete from build_stamp where name = ?", [(t,) for t in tables])
+    cursor.executemany("insert into build_stamp values (?, ?)", stamps.items())
+
+
+def is_built(geofile, sha256, args):
+    # sqlite: the build_stamp table of the database itself, --tsv and --mysql: the cache
+    if not args.tsv and not args.mysql:
+        stamps = read_stamps(args.dbpath)
+        return all(stamps.get(table) == stamp for (table, stamp) in get_stamps(geofile, sha256, args).items())
+
+    obj = get_edition_obj(geofile)
+    if args.tsv and not all(os.path.exists(get_tsv_path(obj, version)) for version in (4, 6)):
+        return False
+    return cidr_download.is_built(args.cache_dir, geofile, sha256, get_target(args))
+
 
 def download_zipfile(geofile, args):
+    # the release is fetched into the cache (conditional, resumed) and linked to WORK_DIR.
+    # returns its sha256, None if it has been built into the target already
     try:
-        zip_filename = os.path.join(WORK_DIR, geofile + ".zip")
-        fd = open(zip_filename, "wb")
-        url = urllib.request.urlopen(format(CSV_URL % (geofile, args.token)))
-        fd.write(url.read())
-        fd.close()
-        url.close()
+        artifact = cidr_download.fetch(CSV_URL % (geofile, args.token), geofile, args.cache_dir)
+        cidr_download.link(artifact.path, os.path.join(WORK_DIR, geofile + ".zip"))
     except Exception:
         traceback.print_exc()
         sys.exit(1)
 
+    if not args.force and is_built(geofile, artifact.sha256, args):
+        sys.stderr.write("%s: not changed\n" % geofile)
+        return None
+    return artifact.sha256
+
 
-def extract_zipfile(geofile, obj):
-    regions = {}
+def mark_built(built, args):
+    # the sqlite tables have their stamps (DatabaseWriter and DeltaWriter)
+    if not args.tsv and not args.mysql:
+        return
+    for (geofile, sha256) in built:
+        cidr_download.mark_built(args.cache_dir, geofile, sha256, get_target(args))
+
+
+def read_csv(z, csv_file):
+    # rows of a CSV file in the zip, read as a text stream (the header is skipped)
+    with z.open(csv_file) as fd:
+        reader = csv.reader(io.TextIOWrapper(fd, encoding="utf-8", newline=""))
+        next(reader, None)
+        yield from reader
+
+
+def read_zipfile(geofile, obj, regions=None):
+    # regions: the names read before (read_regions), the locations CSV is not read again
+    read_names = regions is None
+    regions = {} if read_names else regions
     ipvfile = None
     ipv6file = None
     zip_filename = os.path.join(WORK_DIR, geofile + ".zip")
 
-    with zipfile.ZipFile(zip_filename, "r") as z:
-        for csv_file in z.namelist():
-            base = csv_file.split("/")[1]
-            if base in REGION_GROUP:
-                z.extract(csv_file, path=WORK_DIR)
-                with open(os.path.join(WORK_DIR, csv_file), "r") as fd:
-                    for line in fd:
-                        rec = line.rstrip().split(",")
-                        regions[rec[0]] = obj.getName(rec)
+    z = zipfile.ZipFile(zip_filename, "r")
+    for csv_file in z.namelist():
+        base = csv_file.split("/")[-1]
+        if base in REGION_GROUP and read_names:
+            for rec in read_csv(z, csv_file):
+                regions[rec[0]] = obj.getName(rec)
 
-            if base in IPV4_GROUP:
-                z.extract(csv_file, path=WORK_DIR)
-                ipvfile = os.path.join(WORK_DIR, csv_file)
+        if base in IPV4_GROUP:
+            ipvfile = csv_file
 
-            if base in IPV6_GROUP:
-                z.extract(csv_file, path=WORK_DIR)
-                ipv6file = os.path.join(WORK_DIR, csv_file)
+        if base in IPV6_GROUP:
+            ipv6file = csv_file
 
     if not ipvfile or not ipv6file:
+        z.close()
         sys.exit(1)
 
-    return (regions, ipvfile, ipv6file)
+    return (z, regions, ipvfile, ipv6file)
+
+
+def read_regions(geofile, obj):
+    (z, regions, _, _) = read_zipfile(geofile, obj)
+    z.close()
+    return regions
+
 
+def make_cidr_rows(version, regions, rows, obj):
+    encode = cidr_codec.encoder(version)
+    for rec in rows:
+        c = obj.getIdNumber(rec)
+        if not c:
+            continue
+        (addr, prefix) = encode(rec[0])
+        yield (addr, prefix, rec[0], regions[c])
 
-def make_cidr_file(version, regions, ipvfile, obj):
+
+def make_asn_rows(version, rows):
+    encode = cidr_codec.encoder(version)
+    for r in rows:
+        (addr, prefix) = encode(r[0])
+        yield tuple([addr, prefix] + r)
+
+
+def make_rows(version, regions, rows, obj):
+    if obj:
+        return make_cidr_rows(version, regions, rows, obj)
+    return make_asn_rows(version, rows)
+
+
+def add_ranges(version, rows):
+    # start_addr/end_addr of cidr_create_range.py, made from the cidr column
+    for r in rows:
+        (start, end) = cidr_codec.cidr_range(r[2], version)
+        yield (*r, cidr_codec.int_to_packed(start, version), cidr_codec.int_to_packed(end, version))
+
+
+def get_tsv_path(obj, version):
     attr = cidr_ipattr.IpAttribute(version)
-    wfd = open(os.path.join(os.sep, "tmp", obj.gefCsvName(attr)), "w")
+    return os.path.join(WORK_DIR, obj.gefCsvName(attr) if obj else attr.asn_csvfile)
 
-    with open(ipvfile, "r") as fd:
-        for line in fd:
-            rec = line.rstrip().split(",")
-            if rec[0][:7] == "network":
-                continue
 
-            cidr = ipaddress.ip_network(rec[0])
-            naddr = cidr.network_address
-            prefix = cidr.prefixlen
+class TsvWriter(object):
+    # the /tmp/cidr.txt style files for init.sql and city.sql
+    def write(self, obj, version, rows):
+        with open(get_tsv_path(obj, version), "w") as wfd:
+            for row in rows:
+                print("\t".join(row), file=wfd)
+
+    def close(self):
+        pass
+
+
+def get_table_name(obj, version):
+    return (obj.getTableName() if obj else ASN_TABLE) % version
+
+
+def get_columns(table):
+    return ["addr", "prefixlen", "cidr"] + [c.split()[0] for c in COLUMNS[table[:-3]].split(",")]
+
 
-            c = obj.getIdNumber(rec)
-            if not c:
+def create_table(cursor, table, version, name=None, ranges=False):
+    (addr_size, cidr_size) = (32, 18) if version == 4 else (128, 43)
+    columns = COLUMNS[table[:-3]] + (", start_addr blob, end_addr blob" if ranges else "")
+    cursor.execute(
+        "create table %s (addr char(%d), prefixlen smallint, cidr varchar(%d), %s)"
+        % (name or table, addr_size, cidr_size, columns)
+    )
+
+
+def create_index(cursor, table, ranges=False):
+    cursor.execute("create index %s_idx1 on %s(addr)" % (table, table))
+    if ranges:
+        cursor.execute("create index %s_range_idx on %s(start_addr)" % (table, table))
+
+
+class DatabaseWriter(object):
+    # same tables as init.sql and city.sql, with the start_addr/end_addr columns of
+    # cidr_create_range.py (the range, memory, dir248 and trie engines need them).
+    # The tables are built in dbpath.tmp without
+    # a journal, close() adds the tables of the old database that were not rebuilt,
+    # creates the indexes, runs ANALYZE and VACUUM and replaces dbpath.
+    # finish=False leaves bare tables (the parts of make_pipeline).
+    # stamps: {table: stamp} of the editions, written to build_stamp by close()
+    def __init__(self, dbpath, finish=True):
+        self.dbpath = dbpath
+        self.tmppath = dbpath + ".tmp"
+        self.finish = finish
+        self.tables = []
+        self.stamps = {}
+        if os.path.exists(self.tmppath):
+            os.remove(self.tmppath)
+
+        self.conn = sqlite3.connect(self.tmppath)
+        self.conn.execute("pragma journal_mode=OFF")
+        self.conn.execute("pragma synchronous=OFF")
+        self.conn.execute("pragma cache_size=-%d" % CACHE_SIZE_KB)
+
+    def write(self, obj, version, rows):
+        table = get_table_name(obj, version)
+        cursor = self.conn.cursor()
+        create_table(cursor, table, version, ranges=True)
+        # one transaction for the table
+        cursor.executemany(
+            "insert into %s values (%s)" % (table, ",".join(["?"] * (len(get_columns(table)) + 2))),
+            add_ranges(version, rows),
+        )
+        self.conn.commit()
+        self.tables.append(table)
+
+    def merge(self, table, partpath):
+        # copy a table made by convert_job
+        cursor = self.conn.cursor()
+        cursor.execute("attach database ? as part", (partpath,))
+        cursor.execute("select sql from part.sqlite_master where type='table' and name=?", (table,))
+        cursor.execute(cursor.fetchone()[0])
+        cursor.execute("insert into main.%s select * from part.%s" % (table, table))
+        self.conn.commit()
+        cursor.execute("detach database part")
+        self.tables.append(table)
+        os.remove(partpath)
+
+    def copy_tables(self, cursor):
+        # ipgeo_v* are made from the other tables by cidr_create_range.py --merge, they are not copied
+        cursor.execute("attach database ? as old", (self.dbpath,))
+        cursor.execute("select name, sql from old.sqlite_master where type='table'")
+        for (table, sql) in cursor.fetchall():
+            if table in self.tables or table.startswith("ipgeo_v") or table.startswith("sqlite_"):
                 continue
-            print(
-                format(
-                    "%s\t%s\t%s\t%s"
-                    % (attr.bin_addr(naddr), prefix, rec[0], regions[c])
-                ),
-                file=wfd,
+            cursor.execute(sql)
+            cursor.execute("insert into main.%s select * from old.%s" % (table, table))
+            cursor.execute(
+                "select sql from old.sqlite_master where type='index' and tbl_name=? and sql is not null",
+                (table,),
+            )
+            for (index_sql,) in cursor.fetchall():
+                cursor.execute(index_sql)
+        self.conn.commit()
+        cursor.execute("detach database old")
+
+    def close(self):
+        if self.finish and not self.tables:
+            # nothing was rebuilt, dbpath is kept as it is
+            self.conn.close()
+            os.remove(self.tmppath)
+            return
+        if self.finish:
+            cursor = self.conn.cursor()
+            if os.path.exists(self.dbpath):
+                self.copy_tables(cursor)
+            write_stamps(cursor, self.tables, self.stamps)
+            for table in self.tables:
+                create_index(cursor, table, ranges=True)
+            cursor.execute("analyze")
+            self.conn.commit()
+            cursor.execute("vacuum")
+        self.conn.close()
+        os.replace(self.tmppath, self.dbpath)
+
+
+def write_tables(dbpath, tables):
+    # (obj, version, rows) of each table, the other tables of dbpath are kept (tool/cidr_create_*.py)
+    writer = DatabaseWriter(dbpath)
+    for (obj, version, rows) in tables:
+        writer.write(obj, version, rows)
+    writer.close()
+
+
+class DeltaWriter(object):
+    # applies only the difference between a release and the tables of conn (sqlite3 or
+    # a DB-API connection of MySQL with placeholder="%s"). The rows are compared in a
+    # staging database on (addr, prefixlen), the changes are written in batches of DELTA_BATCH.
+    def __init__(self, conn, placeholder="?"):
+        self.conn = conn
+        self.placeholder = placeholder
+        self.summary = {}
+        self.stamps = {}
+        self.stagepath = os.path.join(WORK_DIR, "delta.stage")
+        if os.path.exists(self.stagepath):
+            os.remove(self.stagepath)
+
+        self.stage = sqlite3.connect(self.stagepath)
+        self.stage.execute("pragma journal_mode=OFF")
+        self.stage.execute("pragma synchronous=OFF")
+
+    def is_sqlite(self):
+        return isinstance(self.conn, sqlite3.Connection)
+
+    def get_target_columns(self, table):
+        # None if the table is not there yet
+        if not self.is_sqlite():
+            return get_columns(table)
+        cursor = self.conn.cursor()
+        cursor.execute("pragma table_info(%s)" % table)
+        return [r[1] for r in cursor.fetchall()] or None
+
+    def read_table(self, table, columns):
+        cursor = self.conn.cursor()
+        cursor.execute("select %s from %s" % (",".join(columns), table))
+        while True:
+            rows = cursor.fetchmany(DELTA_BATCH)
+            if not rows:
+                break
+            yield from rows
+
+    def execute_batches(self, stmt, rows):
+        count = 0
+        cursor = self.conn.cursor()
+        batch = list(itertools.islice(rows, DELTA_BATCH))
+        while batch:
+            cursor.executemany(stmt.replace("?", self.placeholder), batch)
+            self.conn.commit()
+            count += len(batch)
+            batch = list(itertools.islice(rows, DELTA_BATCH))
+        return count
+
+    def write(self, obj, version, rows):
+        table = get_table_name(obj, version)
+        columns = get_columns(table)
+        values = columns[2:]
+        target_columns = self.get_target_columns(table)
+        if target_columns is None:
+            # a new sqlite table gets the range columns like the ones of DatabaseWriter
+            cursor = self.conn.cursor()
+            create_table(cursor, table, version, ranges=self.is_sqlite())
+            create_index(cursor, table, ranges=self.is_sqlite())
+            self.conn.commit()
+            target_columns = columns + (["start_addr"] if self.is_sqlite() else [])
+
+        stage = self.stage.cursor()
+        for name in ("new", "old"):
+            stage.execute("drop table if exists %s" % name)
+            create_table(stage, table, version, name)
+        holders = ",".join(["?"] * len(columns))
+        stage.executemany("insert into new values (%s)" % holders, rows)
+        stage.executemany("insert into old values (%s)" % holders, self.read_table(table, columns))
+        stage.execute("create index new_idx on new(addr, prefixlen)")
+        stage.execute("create index old_idx on old(addr, prefixlen)")
+        self.stage.commit()
+
+        key = "n.addr = o.addr and n.prefixlen = o.prefixlen"
+        summary = {}
+        stage.execute("select o.addr, o.prefixlen from old o left join new n on %s where n.addr is null" % key)
+        summary["delete"] = self.execute_batches(
+            "delete from %s where addr = ? and prefixlen = ?" % table, iter(stage)
+        )
+
+        stage.execute(
+            "select %s, n.addr, n.prefixlen from new n join old o on %s where %s"
+            % (
+                ",".join(["n." + c for c in values]),
+                key,
+                " or ".join(["n.%s is not o.%s" % (c, c) for c in values]),
+            )
+        )
+        summary["update"] = self.execute_batches(
+            "update %s set %s where addr = ? and prefixlen = ?"
+            % (table, ",".join(["%s = ?" % c for c in values])),
+            iter(stage),
+        )
+
+        stage.execute(
+            "select %s from new n left join old o on %s where o.addr is null"
+            % (",".join(["n." + c for c in columns]), key)
+        )
+        if "start_addr" in target_columns:
+            # the range columns of cidr_create_range.py
+            self.conn.create_function("net_start", 1, cidr_create_range.net_start, deterministic=True)
+            self.conn.create_function("net_end", 1, cidr_create_range.net_end, deterministic=True)
+            stmt = "insert into %s (%s, start_addr, end_addr) values (%s, net_start(?), net_end(?))" % (
+                table, ",".join(columns), holders
+            )
+            inserts = ((*r, r[2], r[2]) for r in stage)
+        else:
+            stmt = "insert into %s (%s) values (%s)" % (table, ",".join(columns), holders)
+            inserts = iter(stage)
+        summary["insert"] = self.execute_batches(stmt, inserts)
+
+        stage.execute("select count(*) from new")
+        summary["unchanged"] = stage.fetchone()[0] - summary["update"] - summary["insert"]
+        self.summary[table] = summary
+
+    def close(self):
+        changed = any(s["delete"] + s["update"] + s["insert"] for s in self.summary.values())
+        if changed and self.is_sqlite():
+            cursor = self.conn.cursor()
+            cursor.execute("select count(*) from sqlite_master where type='table' and name like 'ipgeo_v%'")
+            if cursor.fetchone()[0] == 2:
+                # ipgeo_v* are made from the changed tables
+                cidr_create_range.make_merged_tables(self.conn)
+        if self.is_sqlite():
+            write_stamps(self.conn.cursor(), self.summary.keys(), self.stamps)
+            self.conn.commit()
+        self.conn.close()
+        self.stage.close()
+        os.remove(self.stagepath)
+
+        for (table, s) in self.summary.items():
+            sys.stderr.write(
+                "%s: %d inserted, %d updated, %d deleted, %d unchanged\n"
+                % (table, s["insert"], s["update"], s["delete"], s["unchanged"])
             )
-
-    wfd.close()
 
 
-def make_asn_file(version, ipvfile):
-    attr = cidr_ipattr.IpAttribute(version)
-    wfd = open(os.path.join(os.sep, "tmp", attr.asn_csvfile), "w")
+def connect_target(args):
+    # --mysql user:password@host:port/database updates the tables of cidr_api2
+    if not args.mysql:
+        return (sqlite3.connect(args.dbpath), "?")
 
-    with open(ipvfile, "r") as fd:
-        next(csv.reader(fd))
-        for r in csv.reader(fd):
-            cidr = ipaddress.ip_network(r[0])
-            naddr = cidr.network_address
-            prefix = cidr.prefixlen
+    import mysql.connector
 
-            print("\t".join([attr.bin_addr(naddr), str(prefix)] + r), file=wfd)
-    wfd.close()
+    url = urllib.parse.urlsplit("mysql://" + args.mysql)
+    conn = mysql.connector.connect(
+        user=url.username,
+        password=url.password,
+        host=url.hostname,
+        port=url.port or 3306,
+        database=url.path.lstrip("/"),
+    )
+    return (conn, "%s")
+
+
+def write_table(writer, obj, version, rows, aggregate=False):
+    # aggregate merges the sibling networks with the same values (the CSV files are sorted)
+    if not aggregate:
+        writer.write(obj, version, rows)
+        return
+
+    counts = {}
+    writer.write(obj, version, cidr_aggregate.aggregate_rows(rows, version, counts))
+    sys.stderr.write(cidr_aggregate.format_counts(get_table_name(obj, version), counts) + "\n")
+
+
+def make_tables(geofile, obj, writer, aggregate=False):
+    (z, regions, ipvfile, ipv6file) = read_zipfile(geofile, obj)
+    with z:
+        for (version, csv_file) in ((4, ipvfile), (6, ipv6file)):
+            write_table(writer, obj, version, make_rows(version, regions, read_csv(z, csv_file), obj), aggregate)
+
+
+def convert_job(work_dir, geofile, obj, version, tsv, aggregate=False, regions=None):
+    # one (edition, version) in a worker process, the table goes to its own database file.
+    # regions are read once for the edition by timed_download
+    global WORK_DIR
+    WORK_DIR = work_dir
+    start = time.time()
+
+    table = get_table_name(obj, version)
+    partpath = os.path.join(WORK_DIR, table + ".part")
+    writer = TsvWriter() if tsv else DatabaseWriter(partpath, False)
+    (z, regions, ipvfile, ipv6file) = read_zipfile(geofile, obj, regions)
+    with z:
+        csv_file = ipvfile if version == 4 else ipv6file
+        write_table(writer, obj, version, make_rows(version, regions, read_csv(z, csv_file), obj), aggregate)
+    writer.close()
+
+    return (table, None if tsv else partpath, time.time() - start)
+
+
+def timed_download(download, geofile, obj, args):
+    # the names of the regions are read here too, once for the v4 and v6 jobs
+    start = time.time()
+    sha256 = download(geofile, args)
+    regions = read_regions(geofile, obj) if sha256 else None
+    return (sha256, regions, time.time() - start)
+
+
+def make_pipeline(editions, args, download=download_zipfile):
+    # downloads run in threads, each edition is converted (v4 and v6) in the process pool
+    # as soon as its zip file is there. Tables are merged in the order of editions.
+    # returns the timings and the (edition, sha256) that were built
+    timings = {}
+    built = []
+    start = time.time()
+    jobs = []
+    with concurrent.futures.ThreadPoolExecutor(len(editions)) as downloader, \
+            concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+        downloads = {
+            downloader.submit(timed_download, download, geofile, obj, args): (geofile, obj)
+            for (geofile, obj) in editions
+        }
+        for future in concurrent.futures.as_completed(downloads):
+            (geofile, obj) = downloads[future]
+            (sha256, regions, timings["download " + geofile]) = future.result()
+            if not sha256:
+                continue
+            built.append((geofile, sha256))
+            for version in (4, 6):
+                jobs.append(
+                    executor.submit(
+                        convert_job, WORK_DIR, geofile, obj, version, args.tsv, args.aggregate, regions
+                    )
+                )
+        results = {}
+        for future in jobs:
+            (table, partpath, elapsed) = future.result()
+            timings["convert " + table] = elapsed
+            results[table] = partpath
+    timings["download+convert"] = time.time() - start
+
+    if results and not args.tsv:
+        merge_start = time.time()
+        writer = DatabaseWriter(args.dbpath)
+        for (geofile, sha256) in built:
+            writer.stamps.update(get_stamps(geofile, sha256, args))
+        for (_, obj) in editions:
+            for version in (4, 6):
+                table = get_table_name(obj, version)
+                if table in results:
+                    writer.merge(table, results[table])
+        writer.close()
+        timings["merge"] = time.time() - merge_start
+
+    timings["total"] = time.time() - start
+    return (timings, built)
 
 
 class Country(object):
@@ -144,6 +611,9 @@ class Country(object):
     def gefCsvName(self, attr):
         return attr.csvfile
 
+    def getTableName(self):
+        return "ipaddr_v%d"
+
 
 class City(object):
     def getName(self, rec):
@@ -155,6 +625,9 @@ class City(object):
     def gefCsvName(self, attr):
         return attr.city_csvfile
 
+    def getTableName(self):
+        return "city_v%d"
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -168,25 +641,76 @@ if __name__ == "__main__":
     parser.add_argument(
         "-C", "--city", default=False, action="store_true", required=False
     )
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        dest="dbpath",
+        default=os.path.join(os.environ.get("HOME"), "database.cidr"),
+        required=False,
+    )
+    parser.add_argument(
+        "--tsv", default=False, action="store_true", required=False
+    )
+    parser.add_argument(
+        "-p", "--pipeline", default=False, action="store_true", required=False
+    )
+    parser.add_argument("-j", "--jobs", type=int, dest="jobs", default=None, required=False)
+    parser.add_argument(
+        "--diff", default=False, action="store_true", required=False
+    )
+    parser.add_argument("--mysql", type=str, dest="mysql", default=None, required=False)
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        dest="cache_dir",
+        default=cidr_download.CACHE_DIR,
+        required=False,
+    )
+    parser.add_argument(
+        "-f", "--force", default=False, action="store_true", required=False
+    )
+    parser.add_argument(
+        "--aggregate", default=False, action="store_true", required=False
+    )
     args = parser.parse_args(sys.argv[1:])
+    if args.pipeline and (args.diff or args.mysql):
+        # the pipeline rebuilds the tables of the sqlite database (or the TSV files)
+        parser.error("--pipeline can not be used with --diff or --mysql")
 
     all_kind = not args.country and not args.asn and not args.city
+    editions = []
     if args.country or all_kind:
-        obj = Country()
-        download_zipfile(COUNTRY_CSV, args)
-        (countries, ipvfile, ipv6file) = extract_zipfile(COUNTRY_CSV, obj)
-        make_cidr_file(4, countries, ipvfile, obj)
-        make_cidr_file(6, countries, ipv6file, obj)
-
+        editions.append((COUNTRY_CSV, Country()))
     if args.asn or all_kind:
-        download_zipfile(ASN_CSV, args)
-        (_dummy, ipvfile, ipv6file) = extract_zipfile(ASN_CSV, None)
-        make_asn_file(4, ipvfile)
-        make_asn_file(6, ipv6file)
-
+        editions.append((ASN_CSV, None))
     if args.city or all_kind:
-        obj = City()
-        download_zipfile(CITY_CSV, args)
-        (citiese, ipvfile, ipv6file) = extract_zipfile(CITY_CSV, obj)
-        make_cidr_file(4, citiese, ipvfile, obj)
-        make_cidr_file(6, citiese, ipv6file, obj)
+        editions.append((CITY_CSV, City()))
+
+    if args.pipeline:
+        (timings, built) = make_pipeline(editions, args)
+        for (stage, elapsed) in timings.items():
+            sys.stderr.write("%s: %.1f sec\n" % (stage, elapsed))
+        mark_built(built, args)
+        sys.exit(0)
+
+    # --tsv writes the files for init.sql and city.sql instead of the database,
+    # --diff (or --mysql) applies only the changed rows to the existing tables
+    if args.tsv:
+        writer = TsvWriter()
+    elif args.diff or args.mysql:
+        writer = DeltaWriter(*connect_target(args))
+    else:
+        writer = DatabaseWriter(args.dbpath)
+
+    built = []
+    for (geofile, obj) in editions:
+        sha256 = download_zipfile(geofile, args)
+        if sha256:
+            make_tables(geofile, obj, writer, args.aggregate)
+            built.append((geofile, sha256))
+            if not args.tsv:
+                writer.stamps.update(get_stamps(geofile, sha256, args))
+
+    writer.close()
+    mark_built(built, args)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Write database.cidr out as the mmap binary database (cidr_mmdb.py)
+#
+# hidekuno@gmail.com
+#
+import os
+import sys
+import argparse
+import traceback
+import cidr_mmdb
+import cidr_compact
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        dest="dbpath",
+        default=os.path.join(os.environ.get("HOME"), "database.cidr"),
+        required=False,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        dest="mmdbpath",
+        default=os.path.join(os.environ.get("HOME"), "database.mmdb"),
+        required=False,
+    )
+    args = parser.parse_args(sys.argv[1:])
+
+    try:
+        conn = cidr_compact.connect(args.dbpath)
+        cidr_mmdb.write_database(conn.cursor(), args.mmdbpath)
+        conn.close()
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
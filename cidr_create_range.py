@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Add start_addr/end_addr columns to database.cidr for cidr_engine.RangeEngine,
+# and the merged country+ASN+city tables (ipgeo_v*) for cidr_engine.MergedEngine
+#
+# hidekuno@gmail.com
+#
+import os
+import sys
+import sqlite3
+import argparse
+import traceback
+import cidr_codec
+import cidr_engine
+import cidr_index
+
+TABLES = ("ipaddr_v%d", "asn_v%d", "city_v%d")
+
+
+def net_start(cidr):
+    version = cidr_codec.get_version(cidr)
+    return cidr_codec.int_to_packed(cidr_codec.cidr_range(cidr, version)[0], version)
+
+
+def net_end(cidr):
+    version = cidr_codec.get_version(cidr)
+    return cidr_codec.int_to_packed(cidr_codec.cidr_range(cidr, version)[1], version)
+
+
+def get_tables(cursor):
+    cursor.execute("select name from sqlite_master where type='table'")
+    names = [r[0] for r in cursor.fetchall()]
+    return [t % v for t in TABLES for v in (4, 6) if t % v in names]
+
+
+def make_range_table(cursor, table):
+    cursor.execute("pragma table_info(%s)" % table)
+    if "start_addr" not in [r[1] for r in cursor.fetchall()]:
+        cursor.execute("alter table %s add column start_addr blob" % table)
+        cursor.execute("alter table %s add column end_addr blob" % table)
+
+    cursor.execute(
+        "update %s set start_addr = net_start(cidr), end_addr = net_end(cidr)" % table
+    )
+    cursor.execute(
+        "create index if not exists %s_range_idx on %s(start_addr)" % (table, table)
+    )
+
+
+def make_range_tables(conn):
+    conn.create_function("net_start", 1, net_start, deterministic=True)
+    conn.create_function("net_end", 1, net_end, deterministic=True)
+
+    cursor = conn.cursor()
+    for table in get_tables(cursor):
+        make_range_table(cursor, table)
+    conn.commit()
+
+
+def make_merged_table(cursor, version, city_mode):
+    indexes = [
+        cidr_index.load_index(cursor, cidr_index.COUNTRY_SQL, version),
+        cidr_index.load_index(cursor, cidr_index.ASN_SQL, version),
+    ]
+    if city_mode:
+        indexes.append(cidr_index.load_index(cursor, cidr_index.CITY_SQL, version))
+    size = 4 if version == 4 else 16
+
+    def rows():
+        for (start, end, found) in cidr_index.merge_indexes(indexes):
+            (country, provider, city) = found + (None,) * (3 - len(found))
+            yield (
+                start.to_bytes(size, "big"),
+                end.to_bytes(size, "big"),
+                country[1] if country else None,
+                country[0] if country else None,
+                country[2] if country else None,
+                provider[0] if provider else None,
+                provider[1] if provider else None,
+                provider[2] if provider else None,
+                city[0] if city else None,
+                city[1] if city else None,
+            )
+
+    table = "ipgeo_v%d" % version
+    cursor.execute("drop table if exists %s" % table)
+    cursor.execute(
+        """
+        create table %s (
+          start_addr        blob,
+          end_addr          blob,
+          cidr              varchar(43),
+          country           char(2),
+          country_prefixlen smallint,
+          provider          text,
+          asn               int,
+          asn_prefixlen     smallint,
+          city              text,
+          city_prefixlen    smallint
+        )
+        """
+        % table
+    )
+    cursor.executemany("insert into %s values (?,?,?,?,?,?,?,?,?,?)" % table, rows())
+    cursor.execute("create index %s_idx1 on %s(start_addr)" % (table, table))
+
+
+def make_merged_tables(conn):
+    cursor = conn.cursor()
+    city_mode = cidr_engine.LikeEngine(cursor).has_city()
+    for version in (4, 6):
+        make_merged_table(cursor, version, city_mode)
+    conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        dest="dbpath",
+        default=os.path.join(os.environ.get("HOME"), "database.cidr"),
+        required=False,
+    )
+    parser.add_argument(
+        "-m", "--merge", default=False, action="store_true", required=False
+    )
+    args = parser.parse_args(sys.argv[1:])
+
+    try:
+        conn = sqlite3.connect(args.dbpath)
+        make_range_tables(conn)
+        if args.merge:
+            make_merged_tables(conn)
+        conn.close()
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
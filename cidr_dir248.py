@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# DIR-24-8 table for IPv4 (needs cidr_create_range.py)
+#
+# hidekuno@gmail.com
+#
+import ipaddress
+from array import array
+import cidr_engine
+import cidr_index
+
+BLOCK = 0x80000000
+
+
+class Dir248Table(object):
+    # tbl24 is indexed by the top 24 bits. An entry is a result id
+    # (0 is not found) or BLOCK | n, a 256-entry block of tbl8 for
+    # networks longer than /24.
+    def __init__(self):
+        self.tbl24 = array("I", bytes(4 << 24))
+        self.tbl8 = array("I")
+        self.results = [None]
+        self.ids = {}
+
+    def result_id(self, result):
+        if result not in self.ids:
+            self.ids[result] = len(self.results)
+            self.results.append(result)
+        return self.ids[result]
+
+    def get_block(self, hi):
+        entry = self.tbl24[hi]
+        if entry & BLOCK:
+            return entry & ~BLOCK
+
+        n = len(self.tbl8) >> 8
+        self.tbl8.extend(array("I", [entry]) * 256)
+        self.tbl24[hi] = BLOCK | n
+        return n
+
+    def add(self, start, end, result):
+        r = self.result_id(result)
+        while start <= end:
+            hi = start >> 8
+            if start & 0xFF == 0 and end - start >= 0xFF:
+                n = (end + 1 - start) >> 8
+                self.tbl24[hi: hi + n] = array("I", [r]) * n
+                start += n << 8
+            else:
+                last = min(end, start | 0xFF)
+                base = self.get_block(hi) << 8
+                self.tbl8[base + (start & 0xFF): base + (last & 0xFF) + 1] = array(
+                    "I", [r]
+                ) * (last - start + 1)
+                start = last + 1
+
+    def find(self, n):
+        entry = self.tbl24[n >> 8]
+        if entry & BLOCK:
+            entry = self.tbl8[((entry & ~BLOCK) << 8) | (n & 0xFF)]
+        return self.results[entry]
+
+
+class Dir248Engine(cidr_index.MemoryEngine):
+    # IPv4 goes to the DIR-24-8 table, IPv6 stays on the sorted arrays
+    def __init__(self, cursor):
+        super().__init__(cursor)
+
+        indexes = [self.countries[4], self.asns[4]]
+        if self.city_mode:
+            indexes.append(self.cities[4])
+
+        self.table = Dir248Table()
+        for (start, end, rows) in cidr_index.merge_indexes(indexes):
+            (country, provider, city) = rows + (None,) * (3 - len(rows))
+            if country:
+                # the cidr is rebuilt from the address, so results dedupe well
+                country = (country[0], country[-1])
+            self.table.add(start, end, (country, provider, city))
+        self.table.ids.clear()
+
+        del self.countries[4]
+        del self.asns[4]
+        self.cities.pop(4, None)
+
+    def find_v4(self, ip, i):
+        result = self.table.find(int(ip))
+        if not result or not result[i]:
+            return None
+        return result[i]
+
+    def make_country(self, ip, country):
+        (name, prefixlen) = country
+        return (name, str(ipaddress.ip_network((ip, prefixlen), strict=False)), prefixlen)
+
+    def find_country(self, ip):
+        if ip.version == 6:
+            return super().find_country(ip)
+        country = self.find_v4(ip, 0)
+        return self.make_country(ip, country) if country else None
+
+    def find_asn(self, ip):
+        if ip.version == 6:
+            return super().find_asn(ip)
+        return self.find_v4(ip, 1)
+
+    def find_city(self, ip):
+        if ip.version == 6:
+            return super().find_city(ip)
+        return self.find_v4(ip, 2)
+
+    def lookup(self, ip, city_mode=False):
+        if ip.version == 6:
+            return super().lookup(ip, city_mode)
+
+        result = self.table.find(int(ip))
+        if not result or not result[0]:
+            return None
+        (country, provider, city) = result
+        return cidr_engine.make_record(
+            ip, self.make_country(ip, country), provider, city if city_mode else None, city_mode
+        )
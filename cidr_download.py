@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Downloads with a local cache of the GeoLite2 editions.
+#
+# cache_dir/objects/<sha256>.zip   the files, by their content
+# cache_dir/<edition>.json         ETag, Last-Modified, sha256 and the targets built from it
+# cache_dir/<edition>.part         a download in progress, resumed with Range/If-Range
+#
+# hidekuno@gmail.com
+#
+import os
+import json
+import hashlib
+import collections
+import urllib.error
+import urllib.request
+
+CHUNK_SIZE = 1 << 20
+TIMEOUT = 60
+CACHE_DIR = os.path.join(os.environ.get("HOME", ""), ".cache", "cidr-lite")
+
+Artifact = collections.namedtuple("Artifact", ["path", "sha256", "changed"])
+
+
+class DownloadError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def get_meta_path(cache_dir, name):
+    return os.path.join(cache_dir, name + ".json")
+
+
+def get_object_path(cache_dir, sha256):
+    return os.path.join(cache_dir, "objects", sha256 + ".zip")
+
+
+def load_meta(cache_dir, name):
+    try:
+        with open(get_meta_path(cache_dir, name)) as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_meta(cache_dir, name, meta):
+    path = get_meta_path(cache_dir, name)
+    with open(path + ".tmp", "w") as fd:
+        json.dump(meta, fd, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def file_sha256(path, chunk_size=CHUNK_SIZE):
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_request(url, meta, cached, offset):
+    headers = {}
+    if cached:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    # If-Range: the rest of the file only if it is still the same file, else all of it
+    part = meta.get("part", {})
+    validator = part.get("etag") or part.get("last_modified")
+    if offset and validator:
+        headers["Range"] = "bytes=%d-" % offset
+        headers["If-Range"] = validator
+    return urllib.request.Request(url, headers=headers)
+
+
+def fetch(url, name, cache_dir=CACHE_DIR, chunk_size=CHUNK_SIZE):
+    # url is not stored (the MaxMind URL has the license key)
+    os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+    meta = load_meta(cache_dir, name)
+    partpath = os.path.join(cache_dir, name + ".part")
+    cached = "sha256" in meta and os.path.exists(get_object_path(cache_dir, meta["sha256"]))
+    offset = os.path.getsize(partpath) if os.path.exists(partpath) else 0
+
+    try:
+        response = urllib.request.urlopen(make_request(url, meta, cached, offset), timeout=TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            return Artifact(get_object_path(cache_dir, meta["sha256"]), meta["sha256"], False)
+        if e.code == 416 and offset:
+            # the part is not a prefix of the file on the server any more
+            os.remove(partpath)
+            meta.pop("part", None)
+            save_meta(cache_dir, name, meta)
+            return fetch(url, name, cache_dir, chunk_size)
+        raise
+
+    with response:
+        resumed = response.status == 206
+        headers = response.headers
+        meta["part"] = {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+        save_meta(cache_dir, name, meta)
+
+        size = 0
+        with open(partpath, "ab" if resumed else "wb") as fd:
+            for chunk in iter(lambda: response.read(chunk_size), b""):
+                fd.write(chunk)
+                size += len(chunk)
+
+    length = headers.get("Content-Length")
+    if length is not None and size != int(length):
+        # the part is kept, the next run resumes it
+        raise DownloadError("%s: %d of %s bytes" % (name, size, length))
+
+    sha256 = file_sha256(partpath, chunk_size)
+    old = meta.get("sha256")
+    os.replace(partpath, get_object_path(cache_dir, sha256))
+    if old and old != sha256 and os.path.exists(get_object_path(cache_dir, old)):
+        os.remove(get_object_path(cache_dir, old))
+
+    part = meta.pop("part")
+    meta.update(etag=part["etag"], last_modified=part["last_modified"], sha256=sha256)
+    if old != sha256:
+        meta["built"] = []
+    save_meta(cache_dir, name, meta)
+    return Artifact(get_object_path(cache_dir, sha256), sha256, old != sha256)
+
+
+def is_built(cache_dir, name, sha256, target):
+    meta = load_meta(cache_dir, name)
+    return meta.get("sha256") == sha256 and target in meta.get("built", [])
+
+
+def mark_built(cache_dir, name, sha256, target):
+    meta = load_meta(cache_dir, name)
+    if meta.get("sha256") == sha256 and target not in meta.setdefault("built", []):
+        meta["built"].append(target)
+        save_meta(cache_dir, name, meta)
+
+
+def open_url(url):
+    # a URL (http://, file://) or a local file, read as a stream (the tools of tool/)
+    if "://" not in url:
+        return open(url, "rb")
+    return urllib.request.urlopen(url, timeout=TIMEOUT)
+
+
+def link(path, dest):
+    # dest points to the cached file (no copy)
+    tmp = dest + ".link"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(os.path.abspath(path), tmp)
+    os.replace(tmp, dest)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+import collections
+import cidr_ipattr
+import cidr_codec
+
+GeoRecord = collections.namedtuple(
+    "GeoRecord", ["cidr", "country", "provider", "asn", "city", "prefixlen"]
+)
+
+
+def make_record(ip, country, provider, city, city_mode=False):
+    # prefixlen is the most specific matched network, i.e. the range over
+    # which this record stays the same. A missing row pins it to the address.
+    rows = [country, provider] + ([city] if city_mode else [])
+    if None in rows:
+        prefixlen = ip.max_prefixlen
+    else:
+        prefixlen = max([r[-1] for r in rows])
+
+    return GeoRecord(
+        country[1],
+        country[0],
+        provider[0] if provider else None,
+        provider[1] if provider else None,
+        city[0] if city else None,
+        prefixlen,
+    )
+
+
+def record_to_dict(rec):
+    # same columns as the cross-joined SQL of the REST APIs
+    if not rec or rec.provider is None or rec.city is None:
+        return None
+    return {
+        "cidr": rec.cidr,
+        "country": rec.country,
+        "provider": rec.provider,
+        "asn": rec.asn,
+        "city": rec.city,
+    }
+
+
+def match_prefix(prefixes, rows):
+    # prefixes: cidr_codec.prefix_addrs() of an address (longest first),
+    # rows: {(addr, prefixlen): row} found by them. addr is not unique, networks
+    # with the same start address differ in prefixlen
+    for key in prefixes:
+        row = rows.get(key)
+        if row is not None:
+            return row
+    return None
+
+
+class SearchEngine(object):
+    def has_city(self):
+        raise NotImplementedError
+
+    def find_country(self, ip):
+        raise NotImplementedError
+
+    def find_asn(self, ip):
+        raise NotImplementedError
+
+    def find_city(self, ip):
+        raise NotImplementedError
+
+    def lookup(self, ip, city_mode=False):
+        country = self.find_country(ip)
+        if not country:
+            return None
+
+        provider = self.find_asn(ip)
+        city = self.find_city(ip) if city_mode else None
+        return make_record(ip, country, provider, city, city_mode)
+
+    def lookup_many(self, ips, city_mode=False):
+        return [self.lookup(ip, city_mode) for ip in ips]
+
+    def close(self):
+        pass
+
+
+class SqlEngine(SearchEngine):
+    COUNTRY_SQL = None
+    ASN_SQL = None
+    CITY_SQL = None
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def close(self):
+        self.cursor.connection.close()
+
+    def has_city(self):
+        self.cursor.execute(
+            "select count(*) from sqlite_master where type in ('table', 'view') and name like 'city_v%'"
+        )
+        return 2 == self.cursor.fetchone()[0]
+
+    def params(self, ip):
+        raise NotImplementedError
+
+    def find(self, stmt, ip):
+        self.cursor.execute(stmt % ip.version, self.params(ip))
+        return self.cursor.fetchone()
+
+    def load_lookup(self, ips, version):
+        # put the addresses of one family into the temp table for the batch statements
+        seqs = [i for (i, ip) in enumerate(ips) if ip.version == version]
+        self.cursor.execute(
+            "create temp table if not exists lookup (seq integer primary key, addr blob)"
+        )
+        self.cursor.execute("delete from lookup")
+        self.cursor.executemany(
+            "insert into lookup values (?, ?)", [(i, ips[i].packed) for i in seqs]
+        )
+        return seqs
+
+    def find_country(self, ip):
+        return self.find(self.COUNTRY_SQL, ip)
+
+    def find_asn(self, ip):
+        return self.find(self.ASN_SQL, ip)
+
+    def find_city(self, ip):
+        return self.find(self.CITY_SQL, ip)
+
+
+class LikeEngine(SqlEngine):
+    COUNTRY_SQL = """
+        select country, cidr, prefixlen
+        from (select addr, country, cidr, prefixlen from ipaddr_v%d where addr like ?)
+        where addr like substr(?,1,prefixlen) || ?
+        """
+    ASN_SQL = """
+        select provider, asn, prefixlen
+        from (select addr, provider, asn, prefixlen from asn_v%d where addr like ?)
+        where addr like substr(?,1,prefixlen) || ?
+        """
+    CITY_SQL = """
+        select city, prefixlen
+        from (select addr, city, prefixlen from city_v%d where addr like ?)
+        where addr like substr(?,1,prefixlen) || ?
+        """
+
+    # batch lookup: the networks that can hold the addresses (cidr_codec.prefix_addrs)
+    # are joined on the addr index, the longest one is taken by match_prefix
+    COUNTRY_BATCH_SQL = """
+        select t.addr, t.prefixlen, t.country, t.cidr, t.prefixlen
+        from prefixes p join ipaddr_v%d t on t.addr = p.addr and t.prefixlen = p.prefixlen
+        """
+    ASN_BATCH_SQL = """
+        select t.addr, t.prefixlen, t.provider, t.asn, t.prefixlen
+        from prefixes p join asn_v%d t on t.addr = p.addr and t.prefixlen = p.prefixlen
+        """
+    CITY_BATCH_SQL = """
+        select t.addr, t.prefixlen, t.city, t.prefixlen
+        from prefixes p join city_v%d t on t.addr = p.addr and t.prefixlen = p.prefixlen
+        """
+
+    def params(self, ip):
+        attr = cidr_ipattr.IpAttribute(ip.version)
+        param = cidr_codec.bin_addr(ip)
+        return (param[: attr.matches] + "%", param, "%")
+
+    def load_prefixes(self, ips, version):
+        # put the networks that can hold the addresses of one family into the temp table
+        seqs = [i for (i, ip) in enumerate(ips) if ip.version == version]
+        matches = cidr_ipattr.IpAttribute(version).matches
+        prefixes = dict([(i, cidr_codec.prefix_addrs(ips[i], matches)) for i in seqs])
+        self.cursor.execute(
+            "create temp table if not exists prefixes (addr text, prefixlen integer, primary key (addr, prefixlen))"
+        )
+        self.cursor.execute("delete from prefixes")
+        self.cursor.executemany(
+            "insert or ignore into prefixes values (?, ?)", [p for i in seqs for p in prefixes[i]]
+        )
+        return (seqs, prefixes)
+
+    def lookup_many(self, ips, city_mode=False):
+        results = [None] * len(ips)
+        for version in (4, 6):
+            (seqs, prefixes) = self.load_prefixes(ips, version)
+            if not seqs:
+                continue
+
+            stmts = [self.COUNTRY_BATCH_SQL, self.ASN_BATCH_SQL]
+            if city_mode:
+                stmts.append(self.CITY_BATCH_SQL)
+
+            found = []
+            for stmt in stmts:
+                self.cursor.execute(stmt % version)
+                found.append(dict([((r[0], r[1]), r[2:]) for r in self.cursor]))
+
+            for i in seqs:
+                rows = [match_prefix(prefixes[i], f) for f in found]
+                if rows[0]:
+                    results[i] = make_record(ips[i], rows[0], rows[1], rows[2] if city_mode else None, city_mode)
+        return results
+
+
+class RangeEngine(SqlEngine):
+    # needs start_addr/end_addr columns, see cidr_create_range.py
+    COUNTRY_SQL = """
+        select country, cidr, prefixlen
+        from (select country, cidr, prefixlen, end_addr from ipaddr_v%d
+              where start_addr <= ? order by start_addr desc limit 1)
+        where end_addr >= ?
+        """
+    ASN_SQL = """
+        select provider, asn, prefixlen
+        from (select provider, asn, prefixlen, end_addr from asn_v%d
+              where start_addr <= ? order by start_addr desc limit 1)
+        where end_addr >= ?
+        """
+    CITY_SQL = """
+        select city, prefixlen
+        from (select city, prefixlen, end_addr from city_v%d
+              where start_addr <= ? order by start_addr desc limit 1)
+        where end_addr >= ?
+        """
+
+    # batch lookup: one statement per table for the addresses in the temp table
+    COUNTRY_BATCH_SQL = """
+        select l.seq, t.country, t.cidr, t.prefixlen
+        from lookup l join ipaddr_v%d t on t.rowid =
+            (select rowid from ipaddr_v%d where start_addr <= l.addr order by start_addr desc limit 1)
+        where t.end_addr >= l.addr
+        """
+    ASN_BATCH_SQL = """
+        select l.seq, t.provider, t.asn, t.prefixlen
+        from lookup l join asn_v%d t on t.rowid =
+            (select rowid from asn_v%d where start_addr <= l.addr order by start_addr desc limit 1)
+        where t.end_addr >= l.addr
+        """
+    CITY_BATCH_SQL = """
+        select l.seq, t.city, t.prefixlen
+        from lookup l join city_v%d t on t.rowid =
+            (select rowid from city_v%d where start_addr <= l.addr order by start_addr desc limit 1)
+        where t.end_addr >= l.addr
+        """
+
+    def params(self, ip):
+        return (ip.packed, ip.packed)
+
+    def lookup_many(self, ips, city_mode=False):
+        results = [None] * len(ips)
+        for version in (4, 6):
+            seqs = self.load_lookup(ips, version)
+            if not seqs:
+                continue
+
+            stmts = [self.COUNTRY_BATCH_SQL, self.ASN_BATCH_SQL]
+            if city_mode:
+                stmts.append(self.CITY_BATCH_SQL)
+
+            found = []
+            for stmt in stmts:
+                self.cursor.execute(stmt % (version, version))
+                found.append(dict([(r[0], r[1:]) for r in self.cursor]))
+
+            for i in seqs:
+                if i in found[0]:
+                    results[i] = make_record(
+                        ips[i],
+                        found[0][i],
+                        found[1].get(i),
+                        found[2].get(i) if city_mode else None,
+                        city_mode,
+                    )
+        return results
+
+
+class MergedEngine(SqlEngine):
+    # one probe of the ipgeo_v* table made by cidr_create_range.py --merge
+    MERGED_SQL = """
+        select country, cidr, country_prefixlen, provider, asn, asn_prefixlen, city, city_prefixlen
+        from (select * from ipgeo_v%d where start_addr <= ? order by start_addr desc limit 1)
+        where end_addr >= ?
+        """
+    MERGED_BATCH_SQL = """
+        select l.seq, t.country, t.cidr, t.country_prefixlen,
+               t.provider, t.asn, t.asn_prefixlen, t.city, t.city_prefixlen
+        from lookup l join ipgeo_v%d t on t.rowid =
+            (select rowid from ipgeo_v%d where start_addr <= l.addr order by start_addr desc limit 1)
+        where t.end_addr >= l.addr
+        """
+
+    def params(self, ip):
+        return (ip.packed, ip.packed)
+
+    def split_row(self, row):
+        if not row:
+            return (None, None, None)
+        return tuple(
+            [r if r[0] is not None else None for r in (row[0:3], row[3:6], row[6:8])]
+        )
+
+    def find_country(self, ip):
+        return self.split_row(self.find(self.MERGED_SQL, ip))[0]
+
+    def find_asn(self, ip):
+        return self.split_row(self.find(self.MERGED_SQL, ip))[1]
+
+    def find_city(self, ip):
+        return self.split_row(self.find(self.MERGED_SQL, ip))[2]
+
+    def row_to_record(self, ip, row, city_mode):
+        (country, provider, city) = self.split_row(row)
+        if not country:
+            return None
+        return make_record(ip, country, provider, city if city_mode else None, city_mode)
+
+    def lookup(self, ip, city_mode=False):
+        return self.row_to_record(ip, self.find(self.MERGED_SQL, ip), city_mode)
+
+    def lookup_many(self, ips, city_mode=False):
+        results = [None] * len(ips)
+        for version in (4, 6):
+            seqs = self.load_lookup(ips, version)
+            if not seqs:
+                continue
+
+            self.cursor.execute(self.MERGED_BATCH_SQL % (version, version))
+            for r in self.cursor.fetchall():
+                results[r[0]] = self.row_to_record(ips[r[0]], r[1:], city_mode)
+        return results
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# In-memory sorted array index (needs cidr_create_range.py)
+#
+# hidekuno@gmail.com
+#
+from array import array
+from bisect import bisect_left, bisect_right
+import cidr_engine
+
+MASK64 = (1 << 64) - 1
+
+COUNTRY_SQL = "select start_addr, end_addr, country, cidr, prefixlen from ipaddr_v%d order by start_addr"
+ASN_SQL = "select start_addr, end_addr, provider, asn, prefixlen from asn_v%d order by start_addr"
+CITY_SQL = "select start_addr, end_addr, city, prefixlen from city_v%d order by start_addr"
+
+
+class SortedIndex(object):
+    # IPv4 keys fit in one 'I' array, IPv6 keys are split into hi/lo 'Q' arrays.
+    def __init__(self, version):
+        self.version = version
+        self.rows = []
+        if version == 4:
+            self.starts = array("I")
+            self.ends = array("I")
+        else:
+            self.starts_hi = array("Q")
+            self.starts_lo = array("Q")
+            self.ends_hi = array("Q")
+            self.ends_lo = array("Q")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def append(self, start, end, row):
+        if self.version == 4:
+            self.starts.append(start)
+            self.ends.append(end)
+        else:
+            self.starts_hi.append(start >> 64)
+            self.starts_lo.append(start & MASK64)
+            self.ends_hi.append(end >> 64)
+            self.ends_lo.append(end & MASK64)
+        self.rows.append(row)
+
+    def start(self, i):
+        if self.version == 4:
+            return self.starts[i]
+        return (self.starts_hi[i] << 64) | self.starts_lo[i]
+
+    def end(self, i):
+        if self.version == 4:
+            return self.ends[i]
+        return (self.ends_hi[i] << 64) | self.ends_lo[i]
+
+    def search(self, n):
+        # index of the last network starting at or before n, -1 if none
+        if self.version == 4:
+            return bisect_right(self.starts, n) - 1
+
+        hi = n >> 64
+        lo = bisect_left(self.starts_hi, hi)
+        hi_end = bisect_right(self.starts_hi, hi, lo)
+        return bisect_right(self.starts_lo, n & MASK64, lo, hi_end) - 1
+
+    def find(self, n):
+        i = self.search(n)
+        if i >= 0 and self.end(i) >= n:
+            return self.rows[i]
+        return None
+
+
+def load_index(cursor, stmt, version):
+    index = SortedIndex(version)
+    # the rows with the same country, provider or city share one string
+    names = {}
+    cursor.execute(stmt % version)
+    for r in cursor:
+        index.append(
+            int.from_bytes(r[0], "big"), int.from_bytes(r[1], "big"), (names.setdefault(r[2], r[2]),) + tuple(r[3:])
+        )
+    return index
+
+
+class MemoryEngine(cidr_engine.SearchEngine):
+    def __init__(self, cursor):
+        self.city_mode = cidr_engine.LikeEngine(cursor).has_city()
+        self.countries = {}
+        self.asns = {}
+        self.cities = {}
+        for version in (4, 6):
+            self.countries[version] = load_index(cursor, COUNTRY_SQL, version)
+            self.asns[version] = load_index(cursor, ASN_SQL, version)
+            if self.city_mode:
+                self.cities[version] = load_index(cursor, CITY_SQL, version)
+
+    def has_city(self):
+        return self.city_mode
+
+    def find_country(self, ip):
+        return self.countries[ip.version].find(int(ip))
+
+    def find_asn(self, ip):
+        return self.asns[ip.version].find(int(ip))
+
+    def find_city(self, ip):
+        if not self.city_mode:
+            return None
+        return self.cities[ip.version].find(int(ip))
+
+
+def merge_indexes(indexes):
+    # sweep the non-overlapping networks of several indexes into
+    # elementary ranges, each with the row of every index (or None)
+    pos = [0] * len(indexes)
+    heads = [index.start(0) for index in indexes if len(index)]
+    if not heads:
+        return
+
+    cur = min(heads)
+    while True:
+        rows = []
+        nxt = None
+        for (k, index) in enumerate(indexes):
+            i = pos[k]
+            while i < len(index) and index.end(i) < cur:
+                i += 1
+            pos[k] = i
+            if i == len(index):
+                rows.append(None)
+                continue
+
+            if index.start(i) <= cur:
+                rows.append(index.rows[i])
+                bound = index.end(i) + 1
+            else:
+                rows.append(None)
+                bound = index.start(i)
+            nxt = bound if nxt is None else min(nxt, bound)
+
+        if nxt is None:
+            break
+        if rows.count(None) < len(rows):
+            yield (cur, nxt - 1, tuple(rows))
+        cur = nxt
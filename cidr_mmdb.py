@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Read-only binary database (search trees + data section) shared by mmap
+#
+# hidekuno@gmail.com
+#
+import os
+import mmap
+import struct
+import ipaddress
+from array import array
+import cidr_engine
+
+MAGIC = b"CIDRMMDB"
+FORMAT_VERSION = 1
+
+TREES = ((4, "ipaddr_v%d"), (4, "asn_v%d"), (4, "city_v%d"),
+         (6, "ipaddr_v%d"), (6, "asn_v%d"), (6, "city_v%d"))
+HEADER = struct.Struct("<8sHH" + "QI" * len(TREES) + "Q")
+NODE = struct.Struct("<II")
+RECORD = struct.Struct("<I")
+
+# data records: prefixlen, (asn), utf-8 length, utf-8 bytes
+NAME_DATA = struct.Struct("<BH")
+ASN_DATA = struct.Struct("<BIH")
+
+COUNTRY_SQL = "select addr, prefixlen, country from ipaddr_v%d order by prefixlen"
+ASN_SQL = "select addr, prefixlen, asn, provider from asn_v%d order by prefixlen"
+CITY_SQL = "select addr, prefixlen, city from city_v%d order by prefixlen"
+
+EMPTY = -1
+
+
+class TreeWriter(object):
+    # records >= 0 are nodes, EMPTY is not found, <= -2 is -(data offset + 2)
+    def __init__(self, width):
+        self.width = width
+        self.left = array("q", [EMPTY])
+        self.right = array("q", [EMPTY])
+
+    def new_node(self, rec):
+        self.left.append(rec)
+        self.right.append(rec)
+        return len(self.left) - 1
+
+    def get(self, node, bit):
+        return self.right[node] if bit else self.left[node]
+
+    def set(self, node, bit, rec):
+        if bit:
+            self.right[node] = rec
+        else:
+            self.left[node] = rec
+
+    def insert(self, key, bits, offset):
+        # prefixes must come shortest first
+        data = -(offset + 2)
+        if bits == 0:
+            self.left[0] = self.right[0] = data
+            return
+
+        node = 0
+        for depth in range(bits):
+            b = (key >> (self.width - 1 - depth)) & 1
+            rec = self.get(node, b)
+            if depth == bits - 1:
+                self.set(node, b, data)
+            elif rec >= 0:
+                node = rec
+            else:
+                # push the shorter prefix (or EMPTY) down to both children
+                child = self.new_node(rec)
+                self.set(node, b, child)
+                node = child
+
+    def __len__(self):
+        return len(self.left)
+
+    def to_bytes(self):
+        count = len(self)
+
+        def encode(rec):
+            if rec >= 0:
+                return rec
+            if rec == EMPTY:
+                return count
+            return count + 1 + (-rec - 2)
+
+        buf = bytearray(NODE.size * count)
+        for i in range(count):
+            NODE.pack_into(buf, i * NODE.size, encode(self.left[i]), encode(self.right[i]))
+        return bytes(buf)
+
+
+class DataWriter(object):
+    def __init__(self):
+        self.buf = bytearray()
+        self.offsets = {}
+
+    def add(self, fmt, *values):
+        if values in self.offsets:
+            return self.offsets[values]
+
+        text = (values[-1] or "").encode("utf-8")
+        offset = len(self.buf)
+        self.buf += fmt.pack(*(values[:-1] + (len(text),))) + text
+        self.offsets[values] = offset
+        return offset
+
+
+def write_database(cursor, path):
+    city_mode = cidr_engine.LikeEngine(cursor).has_city()
+    data = DataWriter()
+    trees = []
+    for (version, table) in TREES:
+        if table == "city_v%d" and not city_mode:
+            trees.append(b"")
+            continue
+
+        tree = TreeWriter(32 if version == 4 else 128)
+        if table == "ipaddr_v%d":
+            cursor.execute(COUNTRY_SQL % version)
+            for r in cursor:
+                tree.insert(int(r[0], 2), r[1], data.add(NAME_DATA, r[1], r[2]))
+        elif table == "asn_v%d":
+            cursor.execute(ASN_SQL % version)
+            for r in cursor:
+                tree.insert(int(r[0], 2), r[1], data.add(ASN_DATA, r[1], r[2], r[3]))
+        else:
+            cursor.execute(CITY_SQL % version)
+            for r in cursor:
+                tree.insert(int(r[0], 2), r[1], data.add(NAME_DATA, r[1], r[2]))
+        trees.append(tree.to_bytes())
+
+    header = []
+    offset = HEADER.size
+    for tree in trees:
+        header += [offset, len(tree) // NODE.size]
+        offset += len(tree)
+    if offset + len(data.buf) >= 1 << 32:
+        raise ValueError("database too large")
+
+    tmppath = path + ".tmp"
+    with open(tmppath, "wb") as fd:
+        fd.write(HEADER.pack(MAGIC, FORMAT_VERSION, city_mode, *(header + [offset])))
+        for tree in trees:
+            fd.write(tree)
+        fd.write(data.buf)
+    os.replace(tmppath, path)
+
+
+class MmapEngine(cidr_engine.SearchEngine):
+    def __init__(self, path):
+        self.fd = open(path, "rb")
+        self.mm = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = HEADER.unpack_from(self.mm, 0)
+        if header[0] != MAGIC or header[1] != FORMAT_VERSION:
+            self.close()
+            raise ValueError("%s is not a cidr mmdb file" % path)
+
+        self.city_mode = bool(header[2])
+        self.trees = {}
+        for (i, (version, table)) in enumerate(TREES):
+            self.trees[(version, table)] = header[3 + i * 2: 5 + i * 2]
+        self.data_offset = header[-1]
+
+    def close(self):
+        self.mm.close()
+        self.fd.close()
+
+    def has_city(self):
+        return self.city_mode
+
+    def find(self, ip, table):
+        (offset, count) = self.trees[(ip.version, table)]
+        if count == 0:
+            return None
+
+        n = int(ip)
+        width = ip.max_prefixlen
+        node = 0
+        depth = 0
+        while node < count:
+            b = (n >> (width - 1 - depth)) & 1
+            node = RECORD.unpack_from(self.mm, offset + node * NODE.size + b * RECORD.size)[0]
+            depth += 1
+        if node == count:
+            return None
+        return self.data_offset + node - count - 1
+
+    def read_name(self, o):
+        (prefixlen, size) = NAME_DATA.unpack_from(self.mm, o)
+        o += NAME_DATA.size
+        return (prefixlen, self.mm[o: o + size].decode("utf-8"))
+
+    def find_country(self, ip):
+        o = self.find(ip, "ipaddr_v%d")
+        if o is None:
+            return None
+
+        (prefixlen, country) = self.read_name(o)
+        net = ipaddress.ip_network((ip, prefixlen), strict=False)
+        return (country, str(net), prefixlen)
+
+    def find_asn(self, ip):
+        o = self.find(ip, "asn_v%d")
+        if o is None:
+            return None
+
+        (prefixlen, asn, size) = ASN_DATA.unpack_from(self.mm, o)
+        o += ASN_DATA.size
+        return (self.mm[o: o + size].decode("utf-8"), asn, prefixlen)
+
+    def find_city(self, ip):
+        if not self.city_mode:
+            return None
+
+        o = self.find(ip, "city_v%d")
+        if o is None:
+            return None
+
+        (prefixlen, city) = self.read_name(o)
+        return (city, prefixlen)
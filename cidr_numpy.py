@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Vectorized lookups over NumPy arrays (needs numpy and cidr_create_range.py)
+#
+# ex.)
+#   index = VectorIndex(cursor)
+#   (country_ids, asn_ids, city_ids) = index.lookup_ipv4(addrs)   # addrs: uint32 array
+#   countries = index.take(4, "country", country_ids)
+#
+# hidekuno@gmail.com
+#
+import numpy as np
+import cidr_engine
+import cidr_index
+
+NAMES = ("country", "asn", "city")
+NOT_FOUND = -1
+
+IPV4_DTYPE = np.dtype(">u4")
+IPV6_DTYPE = np.dtype([("hi", "<u8"), ("lo", "<u8")])
+IPV6_PACKED = np.dtype([("hi", ">u8"), ("lo", ">u8")])
+
+
+class VectorTable(object):
+    def __init__(self, version, starts, ends, rows):
+        self.version = version
+        self.starts = starts
+        self.ends = ends
+        self.rows = rows
+
+    def covers(self, ends, keys):
+        if self.version == 4:
+            return ends >= keys
+        return (ends["hi"] > keys["hi"]) | ((ends["hi"] == keys["hi"]) & (ends["lo"] >= keys["lo"]))
+
+    def search(self, keys):
+        ids = np.searchsorted(self.starts, keys, side="right") - 1
+        if len(self.rows) == 0:
+            return ids
+
+        found = (ids >= 0) & self.covers(self.ends[np.maximum(ids, 0)], keys)
+        ids[~found] = NOT_FOUND
+        return ids
+
+
+def load_table(cursor, stmt, version):
+    starts = []
+    ends = []
+    rows = []
+    cursor.execute(stmt % version)
+    for r in cursor:
+        starts.append(r[0])
+        ends.append(r[1])
+        rows.append(tuple(r[2:]))
+
+    if version == 4:
+        def to_array(blobs):
+            return np.frombuffer(b"".join(blobs), dtype=IPV4_DTYPE).astype(np.uint32)
+    else:
+        def to_array(blobs):
+            return np.frombuffer(b"".join(blobs), dtype=IPV6_PACKED).astype(IPV6_DTYPE)
+
+    return VectorTable(version, to_array(starts), to_array(ends), rows)
+
+
+class VectorIndex(object):
+    def __init__(self, cursor):
+        self.city_mode = cidr_engine.LikeEngine(cursor).has_city()
+        self.tables = {}
+        for version in (4, 6):
+            for (name, stmt) in zip(NAMES, (cidr_index.COUNTRY_SQL, cidr_index.ASN_SQL, cidr_index.CITY_SQL)):
+                if name != "city" or self.city_mode:
+                    self.tables[(version, name)] = load_table(cursor, stmt, version)
+
+    def lookup(self, version, keys):
+        result = []
+        for name in NAMES:
+            if (version, name) in self.tables:
+                result.append(self.tables[(version, name)].search(keys))
+            else:
+                result.append(np.full(len(keys), NOT_FOUND, dtype=np.int64))
+        return tuple(result)
+
+    def lookup_ipv4(self, addrs):
+        # addrs: uint32 array, returns the row ids of country, ASN and city (NOT_FOUND is -1)
+        return self.lookup(4, np.asarray(addrs, dtype=np.uint32))
+
+    def lookup_ipv6(self, hi, lo):
+        # hi, lo: upper and lower 64 bits of the addresses as uint64 arrays
+        keys = np.empty(len(hi), dtype=IPV6_DTYPE)
+        keys["hi"] = hi
+        keys["lo"] = lo
+        return self.lookup(6, keys)
+
+    def take(self, version, name, ids, column=0):
+        # map row ids to a column of the rows, None for NOT_FOUND
+        rows = self.tables[(version, name)].rows if (version, name) in self.tables else []
+        values = np.array([r[column] for r in rows] + [None], dtype=object)
+        # NOT_FOUND (-1) picks the trailing None
+        return values[ids]
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Opens a search engine by its name (cidr_search.py, cidr_api.py, bench)
+#
+# hidekuno@gmail.com
+#
+import cidr_engine
+import cidr_cache
+import cidr_index
+import cidr_dir248
+import cidr_mmdb
+import cidr_trie
+import cidr_compact
+
+
+def make_engine(name, cursor):
+    if name == "range":
+        return cidr_engine.RangeEngine(cursor)
+    if name == "merged":
+        return cidr_engine.MergedEngine(cursor)
+    if name == "memory":
+        return cidr_index.MemoryEngine(cursor)
+    if name == "dir248":
+        return cidr_dir248.Dir248Engine(cursor)
+    if name == "trie":
+        return cidr_trie.TrieEngine(cursor)
+    return cidr_engine.LikeEngine(cursor)
+
+
+def open_engine(name, dbpath, cache_size=0, cache_prefix=False):
+    if name == "mmdb":
+        engine = cidr_mmdb.MmapEngine(dbpath)
+    else:
+        conn = cidr_compact.connect_readonly(dbpath)
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA case_sensitive_like=ON;")
+        if name == "like" and cidr_compact.is_compact(cursor):
+            # addr is not stored in the compact database, it is searched on start_addr
+            name = "range"
+        engine = make_engine(name, cursor)
+        if not isinstance(engine, cidr_engine.SqlEngine):
+            # loaded into memory, sqlite is no longer needed
+            conn.close()
+
+    if cache_size > 0:
+        engine = cidr_cache.CachedEngine(engine, cache_size, cache_prefix)
+    return engine
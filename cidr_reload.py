@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Hot reload of the search database for the API servers.
+# cidr_create_geoip.py, cidr_create_mmdb.py build a new file and rename it into place,
+# the reloader sees the new file (stat), a signal (request()) or an admin call (reload()),
+# opens it and swaps it in. Requests that started on the old one finish on it,
+# it is closed when the last of them is done.
+#
+# hidekuno@gmail.com
+#
+import os
+import time
+import threading
+import traceback
+import contextlib
+
+DEFAULT_INTERVAL = 1.0
+
+
+def get_signature(path):
+    # a rename changes the inode, an update in place the mtime or the size
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class Generation(object):
+    def __init__(self, resource, signature, number):
+        self.resource = resource
+        self.signature = signature
+        self.number = number
+        self.users = 0
+        self.retired = False
+
+
+class BaseReloader(object):
+    # on_swap is called after a swap (the cache is cleared there)
+    def __init__(self, path, interval=DEFAULT_INTERVAL, on_swap=None):
+        self.path = path
+        self.interval = interval
+        self.on_swap = on_swap
+        self.current = None
+        self.pending = False
+        self.reloading = False
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def request(self):
+        # safe in a signal handler, the next request reloads
+        self.pending = True
+
+    def need_reload(self):
+        if self.pending:
+            return True
+        if not self.interval:
+            return False
+        now = time.monotonic()
+        if now - self.checked < self.interval:
+            return False
+        self.checked = now
+        return get_signature(self.path) != self.current.signature
+
+    def start_reload(self):
+        # True for the one request that reloads, the others go on with the current one
+        with self.lock:
+            if self.reloading or not self.need_reload():
+                return False
+            self.reloading = True
+            return True
+
+    def swap(self, resource, signature):
+        with self.lock:
+            old = self.current
+            number = old.number + 1 if old else 1
+            self.current = Generation(resource, signature, number)
+            self.pending = False
+            if not old:
+                return None
+            old.retired = True
+            close = old.users == 0
+
+        if self.on_swap:
+            self.on_swap()
+        return old if close else None
+
+    def acquire(self):
+        with self.lock:
+            gen = self.current
+            gen.users += 1
+        return gen
+
+    def release(self, gen):
+        with self.lock:
+            gen.users -= 1
+            return gen.retired and gen.users == 0
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "generation": self.current.number if self.current else 0,
+            "users": self.current.users if self.current else 0,
+        }
+
+
+class Reloader(BaseReloader):
+    # opener(path) returns the resource, closer(resource) closes it
+    def __init__(self, path, opener, closer, interval=DEFAULT_INTERVAL, on_swap=None):
+        super().__init__(path, interval, on_swap)
+        self.opener = opener
+        self.closer = closer
+        self.reload()
+
+    def reload(self):
+        signature = get_signature(self.path)
+        old = self.swap(self.opener(self.path), signature)
+        if old:
+            self.closer(old.resource)
+
+    @contextlib.contextmanager
+    def use(self):
+        if self.start_reload():
+            try:
+                self.reload()
+            except Exception:
+                # go on with the current one, the file is tried again at the next check
+                traceback.print_exc()
+                self.pending = False
+            finally:
+                self.reloading = False
+        gen = self.acquire()
+        try:
+            yield gen.resource
+        finally:
+            if self.release(gen):
+                self.closer(gen.resource)
+
+    def close(self):
+        with self.lock:
+            gen = self.current
+            gen.retired = True
+            close = gen.users == 0
+        if close:
+            self.closer(gen.resource)
+
+
+class AsyncReloader(BaseReloader):
+    # opener and closer are coroutines, call open() before use()
+    def __init__(self, path, opener, closer, interval=DEFAULT_INTERVAL, on_swap=None):
+        super().__init__(path, interval, on_swap)
+        self.opener = opener
+        self.closer = closer
+
+    async def open(self):
+        await self.reload()
+
+    async def reload(self):
+        signature = get_signature(self.path)
+        old = self.swap(await self.opener(self.path), signature)
+        if old:
+            await self.closer(old.resource)
+
+    @contextlib.asynccontextmanager
+    async def use(self):
+        if self.start_reload():
+            try:
+                await self.reload()
+            except Exception:
+                # go on with the current one, the file is tried again at the next check
+                traceback.print_exc()
+                self.pending = False
+            finally:
+                self.reloading = False
+        gen = self.acquire()
+        try:
+            yield gen.resource
+        finally:
+            if self.release(gen):
+                await self.closer(gen.resource)
+
+    async def close(self):
+        with self.lock:
+            gen = self.current
+            gen.retired = True
+            close = gen.users == 0
+        if close:
+            await self.closer(gen.resource)
@@ -6,11 +6,26 @@
 #
 import os
 import sys
-import sqlite3
 import ipaddress
 import argparse
 import traceback
-import cidr_ipattr
+import io
+import csv
+import json
+import time
+import collections
+import concurrent.futures
+import cidr_engine
+import cidr_cache
+import cidr_open
+
+BATCH_CHUNK_SIZE = 10000
+BATCH_COLUMNS = ["ipaddr", "country", "cidr", "provider", "asn", "city", "error"]
+
+
+worker_engine = None
+worker_city_mode = False
+worker_fmt = None
 
 
 class EvalIpException(Exception):
@@ -21,7 +36,7 @@ class EvalIpException(Exception):
         return self.message
 
 
-def eval_ipaddr(ipaddr, cursor, city_mode=False):
+def make_ipaddr(ipaddr):
     try:
         ip = ipaddress.ip_address(ipaddr)
         if ip.is_private is True:
@@ -32,46 +47,148 @@ def eval_ipaddr(ipaddr, cursor, city_mode=False):
     except ValueError:
         raise EvalIpException("Not IP address")
 
-    attr = cidr_ipattr.IpAttribute(ip.version)
+    return ip
+
+
+def eval_ipaddr(ipaddr, cursor, city_mode=False):
+    # cursor is a sqlite3 cursor (LIKE search) or a cidr_engine.SearchEngine
+    ip = make_ipaddr(ipaddr)
 
-    def get_ip_record(stmt):
-        param = attr.bin_addr(ip)
-        cursor.execute(
-            stmt % ip.version, tuple([param[: attr.matches] + "%", param, "%"])
+    rec = get_engine(cursor).lookup(ip, city_mode)
+    if not rec:
+        raise EvalIpException("Not Found")
+
+    return format_record(rec, city_mode)
+
+
+def format_record(rec, city_mode):
+    if city_mode:
+        return format(
+            "%s,%s,%s,AS%s,%s" % (rec.country, rec.cidr, rec.provider, rec.asn, rec.city)
         )
-        row = cursor.fetchone()
-        return row
-
-    country = get_ip_record(
-        """
-        select country, cidr
-        from (select addr, country, cidr, prefixlen from ipaddr_v%d where addr like ?)
-        where addr like substr(?,1,prefixlen) || ?
-        """
-    )
+    else:
+        return format("%s,%s,%s,AS%s" % (rec.country, rec.cidr, rec.provider, rec.asn))
 
-    provider = get_ip_record(
-        """
-        select provider,asn
-        from (select addr, provider, asn, prefixlen from asn_v%d where addr like ?)
-        where addr like substr(?,1,prefixlen) || ?
-        """
-    )
 
-    if country:
-        if city_mode:
-            city = get_ip_record(
-                """
-                select city
-                from (select addr, city, prefixlen from city_v%d where addr like ?)
-                where addr like substr(?,1,prefixlen) || ?
-                """
-            )
-            return format("%s,%s,%s,AS%s,%s" % (country + provider + city))
-        else:
-            return format("%s,%s,%s,AS%s" % (country + provider))
+def eval_ipaddrs(ipaddrs, cursor, city_mode=False):
+    # batch version of eval_ipaddr, returns a GeoRecord or an EvalIpException per address
+    results = [None] * len(ipaddrs)
+    ips = []
+    for (i, ipaddr) in enumerate(ipaddrs):
+        try:
+            ips.append((i, make_ipaddr(ipaddr)))
+        except EvalIpException as e:
+            results[i] = e
+
+    recs = get_engine(cursor).lookup_many([ip for (_, ip) in ips], city_mode)
+    for ((i, _), rec) in zip(ips, recs):
+        results[i] = rec if rec else EvalIpException("Not Found")
+    return results
+
+
+def format_batch(ipaddrs, results, city_mode, fmt):
+    buf = io.StringIO()
+    if fmt == "ndjson":
+        for (ipaddr, rec) in zip(ipaddrs, results):
+            if isinstance(rec, EvalIpException):
+                value = {"ipaddr": ipaddr, "error": str(rec)}
+            else:
+                value = {"ipaddr": ipaddr, **rec._asdict()}
+                del value["prefixlen"]
+                if not city_mode:
+                    del value["city"]
+            print(json.dumps(value, ensure_ascii=False), file=buf)
     else:
-        raise EvalIpException("Not Found")
+        writer = csv.writer(buf, delimiter="\t" if fmt == "tsv" else ",", lineterminator="\n")
+        for (ipaddr, rec) in zip(ipaddrs, results):
+            if isinstance(rec, EvalIpException):
+                row = [ipaddr, "", "", "", "", "", str(rec)]
+            else:
+                row = [ipaddr, rec.country, rec.cidr, rec.provider, rec.asn, rec.city or "", ""]
+            writer.writerow(row if city_mode else row[:5] + row[6:])
+    return buf.getvalue()
+
+
+def read_chunks(fd, chunk_size):
+    chunk = []
+    for line in fd:
+        ipaddr = line.strip()
+        if ipaddr == "":
+            continue
+        chunk.append(ipaddr)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_batch(outfd, outputs, city_mode, fmt):
+    if fmt != "ndjson":
+        columns = BATCH_COLUMNS if city_mode else [c for c in BATCH_COLUMNS if c != "city"]
+        outfd.write(("\t" if fmt == "tsv" else ",").join(columns) + "\n")
+
+    start = time.time()
+    count = 0
+    for (n, text) in outputs:
+        outfd.write(text)
+
+        count += n
+        elapsed = time.time() - start
+        print(
+            "\r%d addresses, %.1f sec, %.0f/sec" % (count, elapsed, count / elapsed if elapsed else 0),
+            end="",
+            file=sys.stderr,
+        )
+    outfd.flush()
+    print("", file=sys.stderr)
+    return count
+
+
+def do_batch(infd, outfd, cursor, city_mode, fmt="csv", chunk_size=BATCH_CHUNK_SIZE):
+    outputs = (
+        (len(chunk), format_batch(chunk, eval_ipaddrs(chunk, cursor, city_mode), city_mode, fmt))
+        for chunk in read_chunks(infd, chunk_size)
+    )
+    return write_batch(outfd, outputs, city_mode, fmt)
+
+
+def init_worker(name, dbpath, fmt, cache_size=0, cache_prefix=False):
+    # every worker process opens its own connection or index
+    global worker_engine, worker_city_mode, worker_fmt
+    worker_engine = cidr_open.open_engine(name, dbpath, cache_size, cache_prefix)
+    worker_city_mode = get_city_mode(worker_engine)
+    worker_fmt = fmt
+
+
+def get_worker_city_mode():
+    return worker_city_mode
+
+
+def search_chunk(chunk):
+    results = eval_ipaddrs(chunk, worker_engine, worker_city_mode)
+    return (len(chunk), format_batch(chunk, results, worker_city_mode, worker_fmt))
+
+
+def do_parallel_batch(
+    infd, outfd, name, dbpath, jobs, fmt="csv", chunk_size=BATCH_CHUNK_SIZE, cache_size=0, cache_prefix=False
+):
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_worker, initargs=(name, dbpath, fmt, cache_size, cache_prefix)
+    ) as executor:
+        city_mode = executor.submit(get_worker_city_mode).result()
+
+        def outputs():
+            # keep a bounded window of chunks in flight, results come back in input order
+            futures = collections.deque()
+            for chunk in read_chunks(infd, chunk_size):
+                futures.append(executor.submit(search_chunk, chunk))
+                if len(futures) >= jobs * 2:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+        return write_batch(outfd, outputs(), city_mode, fmt)
 
 
 def do_eval_ipaddr(ipaddr, cursor, city_mode):
@@ -82,11 +199,14 @@ def do_eval_ipaddr(ipaddr, cursor, city_mode):
         print(e)
 
 
+def get_engine(cursor):
+    if isinstance(cursor, cidr_engine.SearchEngine):
+        return cursor
+    return cidr_engine.LikeEngine(cursor)
+
+
 def get_city_mode(cursor):
-    cursor.execute(
-        "select count(*) from sqlite_master where type='table' and name like 'city_v%'"
-    )
-    return 2 == cursor.fetchone()[0]
+    return get_engine(cursor).has_city()
 
 
 def repl(cursor):
@@ -112,19 +232,64 @@ def repl(cursor):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--ip", type=str, dest="ipaddr", required=False)
+    parser.add_argument(
+        "-e",
+        "--engine",
+        type=str,
+        dest="engine",
+        default="like",
+        choices=["like", "range", "merged", "memory", "dir248", "trie", "mmdb"],
+        required=False,
+    )
+    parser.add_argument("-f", "--file", type=str, dest="infile", required=False)
+    parser.add_argument("-o", "--output", type=str, dest="outfile", required=False)
+    parser.add_argument(
+        "-F",
+        "--format",
+        type=str,
+        dest="fmt",
+        default="csv",
+        choices=["csv", "tsv", "ndjson"],
+        required=False,
+    )
+    parser.add_argument("-j", "--jobs", type=int, dest="jobs", default=1, required=False)
+    parser.add_argument("--cache", type=int, dest="cache_size", default=0, required=False)
+    parser.add_argument(
+        "--cache-prefix", default=False, action="store_true", dest="cache_prefix", required=False
+    )
+    parser.add_argument("-d", "--database", type=str, dest="dbpath", default=None, required=False)
     args = parser.parse_args(sys.argv[1:])
 
-    dbpath = os.path.join(os.environ.get("HOME"), "database.cidr")
+    if args.dbpath:
+        dbpath = args.dbpath
+    elif args.engine == "mmdb":
+        dbpath = os.path.join(os.environ.get("HOME"), "database.mmdb")
+    else:
+        dbpath = os.path.join(os.environ.get("HOME"), "database.cidr")
     try:
-        conn = sqlite3.connect(dbpath)
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA case_sensitive_like=ON;")
-
-        if args.ipaddr:
-            do_eval_ipaddr(args.ipaddr, cursor)
+        if args.infile:
+            infd = sys.stdin if args.infile == "-" else open(args.infile, "r")
+            outfd = open(args.outfile, "w", buffering=1 << 20, newline="") if args.outfile else sys.stdout
+            if args.jobs > 1:
+                do_parallel_batch(
+                    infd, outfd, args.engine, dbpath, args.jobs, args.fmt,
+                    cache_size=args.cache_size, cache_prefix=args.cache_prefix,
+                )
+            else:
+                engine = cidr_open.open_engine(args.engine, dbpath, args.cache_size, args.cache_prefix)
+                do_batch(infd, outfd, engine, get_city_mode(engine), args.fmt)
+                if isinstance(engine, cidr_cache.CachedEngine):
+                    print("cache: %s" % engine.cache.stats(), file=sys.stderr)
+                engine.close()
+            if outfd is not sys.stdout:
+                outfd.close()
         else:
-            repl(cursor)
-        conn.close()
+            engine = cidr_open.open_engine(args.engine, dbpath, args.cache_size, args.cache_prefix)
+            if args.ipaddr:
+                do_eval_ipaddr(args.ipaddr, engine, get_city_mode(engine))
+            else:
+                repl(engine)
+            engine.close()
 
     except EOFError:
         sys.exit(0)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# Longest prefix match by path-compressed binary (Patricia) trie
+#
+# hidekuno@gmail.com
+#
+import cidr_engine
+
+COUNTRY, ASN, CITY = range(3)
+
+COUNTRY_SQL = "select addr, prefixlen, country, cidr, prefixlen from ipaddr_v%d"
+ASN_SQL = "select addr, prefixlen, provider, asn, prefixlen from asn_v%d"
+CITY_SQL = "select addr, prefixlen, city, prefixlen from city_v%d"
+
+EMPTY = (None, None, None)
+
+
+class Node(object):
+    __slots__ = ("key", "bits", "left", "right", "value")
+
+    def __init__(self, key, bits):
+        self.key = key
+        self.bits = bits
+        self.left = None
+        self.right = None
+        self.value = None
+
+
+class PatriciaTrie(object):
+    def __init__(self, width):
+        self.width = width
+        self.root = Node(0, 0)
+        self.size = 0
+        self.values = {}
+
+    def bit(self, key, pos):
+        return (key >> (self.width - 1 - pos)) & 1
+
+    def common_bits(self, a, b, limit):
+        return min(self.width - (a ^ b).bit_length(), limit)
+
+    def get_child(self, node, bit):
+        return node.right if bit else node.left
+
+    def set_child(self, node, bit, child):
+        if bit:
+            node.right = child
+        else:
+            node.left = child
+
+    def set_value(self, node, slot, row):
+        value = list(node.value or EMPTY)
+        value[slot] = row
+        # share the identical payload tuples between nodes
+        node.value = self.values.setdefault(tuple(value), tuple(value))
+
+    def insert(self, key, bits, slot, row):
+        node = self.root
+        while node.bits < bits:
+            b = self.bit(key, node.bits)
+            child = self.get_child(node, b)
+            if child is None:
+                child = Node(key, bits)
+                self.set_child(node, b, child)
+                self.size += 1
+                node = child
+                break
+
+            common = self.common_bits(child.key, key, min(child.bits, bits))
+            if common == child.bits:
+                node = child
+                continue
+
+            mid = Node(key & ~((1 << (self.width - common)) - 1), common)
+            self.set_child(node, b, mid)
+            self.set_child(mid, self.bit(child.key, common), child)
+            self.size += 1
+            node = mid
+            if common < bits:
+                leaf = Node(key, bits)
+                self.set_child(mid, self.bit(key, common), leaf)
+                self.size += 1
+                node = leaf
+            break
+
+        self.set_value(node, slot, row)
+
+    def search(self, key):
+        best = list(EMPTY)
+        node = self.root
+        while node is not None:
+            shift = self.width - node.bits
+            if (key >> shift) != (node.key >> shift):
+                break
+            if node.value:
+                for (i, row) in enumerate(node.value):
+                    if row is not None:
+                        best[i] = row
+            if node.bits == self.width:
+                break
+            node = self.get_child(node, self.bit(key, node.bits))
+        return best
+
+
+def load_trie(trie, cursor, stmt, version, slot):
+    cursor.execute(stmt % version)
+    for r in cursor:
+        trie.insert(int(r[0], 2), r[1], slot, tuple(r[2:]))
+
+
+class TrieEngine(cidr_engine.SearchEngine):
+    def __init__(self, cursor):
+        self.city_mode = cidr_engine.LikeEngine(cursor).has_city()
+        self.tries = {4: PatriciaTrie(32), 6: PatriciaTrie(128)}
+        for (version, trie) in self.tries.items():
+            load_trie(trie, cursor, COUNTRY_SQL, version, COUNTRY)
+            load_trie(trie, cursor, ASN_SQL, version, ASN)
+            if self.city_mode:
+                load_trie(trie, cursor, CITY_SQL, version, CITY)
+            trie.values.clear()
+
+    def has_city(self):
+        return self.city_mode
+
+    def search(self, ip):
+        return self.tries[ip.version].search(int(ip))
+
+    def find_country(self, ip):
+        return self.search(ip)[COUNTRY]
+
+    def find_asn(self, ip):
+        return self.search(ip)[ASN]
+
+    def find_city(self, ip):
+        return self.search(ip)[CITY]
+
+    def lookup(self, ip, city_mode=False):
+        (country, provider, city) = self.search(ip)
+        if not country:
+            return None
+        return cidr_engine.make_record(
+            ip, country, provider, city if city_mode else None, city_mode
+        )
@@ -0,0 +1,60 @@
+#
+# Small database.cidr for unit tests
+#
+# hidekuno@gmail.com
+#
+import sqlite3
+import ipaddress
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_codec
+
+COUNTRY = [
+    ("202.224.0.0/11", "JP"),
+    ("8.8.8.0/24", "US"),
+    ("1.0.0.0/24", "AU"),
+    ("2001:240::/32", "JP"),
+]
+ASN = [
+    ("202.232.0.0/15", 2497, "Internet Initiative Japan Inc."),
+    ("8.8.8.0/24", 15169, "GOOGLE"),
+    ("1.0.0.0/24", 13335, "CLOUDFLARENET"),
+    ("2001:240::/32", 2497, "Internet Initiative Japan Inc."),
+]
+CITY = [
+    ("202.232.2.0/24", "東京都和田"),
+    ("8.8.8.0/25", "アメリカ合衆国"),
+    ("2001:240:bb81::/48", "東京都"),
+]
+
+
+def make_row(cidr, *values):
+    net = ipaddress.ip_network(cidr)
+    return (net.version, cidr_codec.bin_addr(net.network_address), net.prefixlen, cidr) + values
+
+
+def make_database(dbpath):
+    conn = sqlite3.connect(dbpath)
+    cursor = conn.cursor()
+    for v in (4, 6):
+        cursor.execute(
+            "create table ipaddr_v%d (addr char(128), prefixlen smallint, cidr varchar(43), country char(2))" % v
+        )
+        cursor.execute(
+            "create table asn_v%d (addr char(128), prefixlen smallint, cidr varchar(43), asn int, provider text)" % v
+        )
+        cursor.execute(
+            "create table city_v%d (addr char(128), prefixlen smallint, cidr varchar(43), city text)" % v
+        )
+
+    for (table, data) in (("ipaddr_v%d", COUNTRY), ("asn_v%d", ASN), ("city_v%d", CITY)):
+        for rec in data:
+            row = make_row(*rec)
+            cursor.execute(
+                "insert into %s values (%s)" % (table % row[0], ",".join(["?"] * (len(row) - 1))),
+                row[1:],
+            )
+    conn.commit()
+    conn.close()
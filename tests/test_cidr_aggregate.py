@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_aggregate.py
+# 2) pytest -v tests/test_cidr_aggregate.py
+#
+import unittest
+import traceback
+import os
+import io
+import sqlite3
+import ipaddress
+import tempfile
+import contextlib
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_aggregate
+import cidr_codec
+import cidr_create_geoip
+import cidr_create_range
+import cidr_open
+from bench import geodata
+
+
+def nets(*items):
+    # ("10.0.0.0/24", "JP") -> [start, prefixlen, values, row]
+    result = []
+    for (cidr, value) in items:
+        net = ipaddress.ip_network(cidr)
+        result.append([int(net.network_address), net.prefixlen, (value,), cidr])
+    return result
+
+
+def cidrs(networks, version=4):
+    network = cidr_aggregate.NETWORK[version]
+    return [(str(network((n[0], n[1]))), n[2][0]) for n in networks]
+
+
+class TestMethods(unittest.TestCase):
+    def aggregate(self, *items):
+        return cidrs(cidr_aggregate.aggregate(nets(*items), 32))
+
+    def test_siblings(self):
+        self.assertEqual(
+            self.aggregate(
+                ("10.0.0.0/24", "JP"), ("10.0.1.0/25", "JP"), ("10.0.1.128/25", "JP"), ("10.0.2.0/23", "JP")
+            ),
+            [("10.0.0.0/22", "JP")],
+        )
+        # 10.0.1.0/24 and 10.0.2.0/24 are not siblings
+        self.assertEqual(
+            self.aggregate(("10.0.1.0/24", "JP"), ("10.0.2.0/24", "JP")),
+            [("10.0.1.0/24", "JP"), ("10.0.2.0/24", "JP")],
+        )
+        self.assertEqual(
+            self.aggregate(("10.0.0.0/24", "JP"), ("10.0.1.0/24", "US")),
+            [("10.0.0.0/24", "JP"), ("10.0.1.0/24", "US")],
+        )
+
+    def test_covered(self):
+        self.assertEqual(
+            self.aggregate(("10.0.0.0/16", "JP"), ("10.0.3.0/24", "JP"), ("10.1.0.0/16", "US")),
+            [("10.0.0.0/16", "JP"), ("10.1.0.0/16", "US")],
+        )
+        # a network in between with other values keeps them
+        self.assertEqual(
+            self.aggregate(("10.0.0.0/16", "JP"), ("10.0.0.0/20", "US"), ("10.0.3.0/24", "JP")),
+            [("10.0.0.0/16", "JP"), ("10.0.0.0/20", "US"), ("10.0.3.0/24", "JP")],
+        )
+        # the parent is there with other values
+        self.assertEqual(
+            self.aggregate(("10.0.0.0/23", "US"), ("10.0.0.0/24", "JP"), ("10.0.1.0/24", "JP")),
+            [("10.0.0.0/23", "US"), ("10.0.0.0/24", "JP"), ("10.0.1.0/24", "JP")],
+        )
+
+    def test_not_sorted(self):
+        with self.assertRaises(ValueError):
+            self.aggregate(("10.0.1.0/24", "JP"), ("10.0.0.0/24", "JP"))
+
+    def test_rows(self):
+        rows = []
+        for i in range(4):
+            net = ipaddress.ip_network("2001:db8:%x::/48" % i)
+            rows.append((cidr_codec.bin_addr(net.network_address), "48", str(net), "JP"))
+        rows.append((cidr_codec.bin_addr(ipaddress.ip_address("2001:db9::")), "32", "2001:db9::/32", "US"))
+
+        counts = {}
+        result = list(cidr_aggregate.aggregate_rows(iter(rows), 6, counts))
+        net = ipaddress.ip_network("2001:db8::/46")
+        self.assertEqual(result, [(cidr_codec.bin_addr(net.network_address), "46", "2001:db8::/46", "JP"), rows[-1]])
+        self.assertEqual(counts, {"before": 5, "after": 2})
+        self.assertEqual(cidr_aggregate.format_counts("ipaddr_v6", counts), "ipaddr_v6: 5 -> 2 rows (-60.0%)")
+
+    def test_database(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            g = cidr_create_geoip
+            g.WORK_DIR = workdir
+            data = geodata.GeoData(2000, 4)
+            data.write_zipfiles(workdir)
+
+            paths = []
+            stderr = io.StringIO()
+            for aggregate in (False, True):
+                paths.append(os.path.join(workdir, "aggregate.cidr" if aggregate else "database.cidr"))
+                writer = g.DatabaseWriter(paths[-1])
+                with contextlib.redirect_stderr(stderr):
+                    for (geofile, obj) in ((g.COUNTRY_CSV, g.Country()), (g.ASN_CSV, None), (g.CITY_CSV, g.City())):
+                        g.make_tables(geofile, obj, writer, aggregate)
+                writer.close()
+                conn = sqlite3.connect(paths[-1])
+                cidr_create_range.make_range_tables(conn)
+                conn.close()
+            self.assertIn("asn_v4: ", stderr.getvalue())
+
+            engines = [cidr_open.open_engine("memory", path) for path in paths]
+            self.assertLess(len(engines[1].asns[4]), len(engines[0].asns[4]))
+            self.assertLess(len(engines[1].countries[4]), len(engines[0].countries[4]))
+            for ip in [ipaddress.ip_address(a) for a in data.sample_addresses(1000)]:
+                (r1, r2) = [e.lookup(ip, True) for e in engines]
+                if r1 is None:
+                    self.assertIsNone(r2)
+                else:
+                    self.assertEqual(r1[1:5], r2[1:5])
+                    self.assertIn(ip, ipaddress.ip_network(r2.cidr))
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -4,8 +4,9 @@
 # pytest -v tests/test_cidr_api2.py
 #
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 import copy
 from pathlib import Path
 import sys
@@ -48,20 +49,18 @@ def createMySQL():
     host = "localhost"
     port = 33306
 
-    return create_engine(
-        f"mysql+mysqlconnector://{user}:{password}@{host}:{port}/{db_name}"
+    # TestClient runs each request on a new event loop, a pooled connection would belong to the old one
+    return create_async_engine(
+        f"mysql+aiomysql://{user}:{password}@{host}:{port}/{db_name}", poolclass=NullPool
     )
 
 
-TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=createMySQL())
+TestSessionLocal = sessionmaker(autoflush=False, bind=createMySQL(), class_=AsyncSession, expire_on_commit=False)
 
 
-def get_db_test():
-    db = TestSessionLocal()
-    try:
+async def get_db_test():
+    async with TestSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db] = get_db_test
@@ -452,6 +451,39 @@ def test_ipv6_search():
     }
 
 
+def test_batch_search():
+    response = client.post(
+        "/search",
+        headers=HEADERS,
+        json={"ipaddrs": ["fda6:eacc:b448:3:524:352e:ea4c:977d", "172.17.0.11", "abc", "fda6:eacc:b448:1::1"]},
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "ipaddr": "fda6:eacc:b448:3:524:352e:ea4c:977d",
+            "cidr": "fda6:eacc:b448:3::/64",
+            "country": "JP",
+            "asn": 10002,
+            "provider": "Mukogawa3 Net.",
+            "city": "兵庫県西宮市",
+        },
+        {"ipaddr": "172.17.0.11", "error": "IP not found"},
+        {"ipaddr": "abc", "error": "Not IP address"},
+        {
+            "ipaddr": "fda6:eacc:b448:1::1",
+            "cidr": "fda6:eacc:b448:1::/64",
+            "country": "JP",
+            "asn": 10000,
+            "provider": "Mukogawa Net.",
+            "city": "兵庫県尼崎市",
+        },
+    ]
+
+    response = client.post("/search", headers=HEADERS, json={"ipaddrs": ["172.17.0.11"] * 1001})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "too_long"
+
+
 def test_ipv6_delete():
     headers = {
         "x-api-key": "apitest",
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_bench.py
+# 2) pytest -v tests/test_cidr_bench.py
+#
+import unittest
+import traceback
+import json
+import argparse
+import tempfile
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_search
+import cidr_open
+from bench import geodata
+from bench import run
+
+
+class TestMethods(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.data = geodata.GeoData(300, 1)
+        (cls.build, cls.dbpath, cls.mmdbpath) = run.bench_build(cls.data, cls.tmpdir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_build(self):
+        rows = self.build["rows"]
+        # anonymous proxies have no country
+        self.assertLessEqual(rows["ipaddr_v4"], len(self.data.allocations[4]))
+        self.assertGreater(rows["ipaddr_v4"], len(self.data.allocations[4]) * 0.9)
+        self.assertGreater(rows["asn_v4"], rows["ipaddr_v4"])
+        self.assertGreater(rows["city_v6"], 0)
+        self.assertIn("city_regions", self.build)
+        self.assertLess(self.build["size"]["database.compact"], self.build["size"]["database.cidr"])
+
+    def test_search(self):
+        like = cidr_open.open_engine("like", self.dbpath)
+        mmdb = cidr_open.open_engine("mmdb", self.mmdbpath)
+        self.assertTrue(like.has_city())
+
+        found = 0
+        for ipaddr in self.data.sample_addresses(200):
+            try:
+                expected = cidr_search.eval_ipaddr(ipaddr, like, True)
+                found += 1
+            except cidr_search.EvalIpException as e:
+                expected = str(e)
+            try:
+                self.assertEqual(cidr_search.eval_ipaddr(ipaddr, mmdb, True), expected)
+            except cidr_search.EvalIpException as e:
+                self.assertEqual(str(e), expected)
+        self.assertGreater(found, 100)
+        like.close()
+        mmdb.close()
+
+    def test_run(self):
+        args = argparse.Namespace(
+            rows=100, seed=0, queries=50, engines=["range", "memory"], workdir=None, no_api=True
+        )
+        result = json.loads(json.dumps(run.run(args)))
+        self.assertEqual(result["queries"], 50)
+        self.assertEqual(result["lookup"]["range"]["found"], result["lookup"]["memory"]["found"])
+        self.assertIn("single_per_sec", result["lookup"]["memory"])
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_cache.py
+# 2) pytest -v tests/test_cidr_cache.py
+#
+import unittest
+import traceback
+import ipaddress
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_cache
+import cidr_engine
+
+
+class CountEngine(cidr_engine.SearchEngine):
+    def __init__(self, prefixlen=24):
+        self.prefixlen = prefixlen
+        self.count = 0
+
+    def has_city(self):
+        return False
+
+    def lookup(self, ip, city_mode=False):
+        self.count += 1
+        net = ipaddress.ip_network((ip, self.prefixlen), strict=False)
+        return cidr_engine.GeoRecord(str(net), "JP", "IIJ", 2497, None, self.prefixlen)
+
+
+def ip(addr):
+    return ipaddress.ip_address(addr)
+
+
+class TestMethods(unittest.TestCase):
+    def test_lru(self):
+        cache = cidr_cache.LookupCache(2)
+        cache.put(ip("1.1.1.1"), False, "a")
+        cache.put(ip("1.1.1.2"), False, "b")
+        self.assertEqual(cache.get(ip("1.1.1.1")), "a")
+        cache.put(ip("1.1.1.3"), False, "c")
+
+        self.assertIs(cache.get(ip("1.1.1.2")), cidr_cache.MISS)
+        self.assertEqual(cache.get(ip("1.1.1.1")), "a")
+        self.assertEqual(cache.get(ip("1.1.1.3")), "c")
+        self.assertIs(cache.get(ip("1.1.1.3"), True), cidr_cache.MISS)
+        self.assertEqual(
+            cache.stats(),
+            {"size": 2, "maxsize": 2, "hits": 3, "misses": 2, "evictions": 1, "generation": 0},
+        )
+
+    def test_disabled(self):
+        cache = cidr_cache.LookupCache(0)
+        cache.put(ip("1.1.1.1"), False, "a")
+        self.assertIs(cache.get(ip("1.1.1.1")), cidr_cache.MISS)
+
+    def test_prefix(self):
+        engine = cidr_cache.CachedEngine(CountEngine(), 10, True)
+        rec = engine.lookup(ip("202.232.2.1"))
+        self.assertEqual(engine.lookup(ip("202.232.2.200")), rec)
+        self.assertEqual(engine.lookup(ip("202.232.3.1")).cidr, "202.232.3.0/24")
+        self.assertEqual(engine.engine.count, 2)
+
+        recs = engine.lookup_many([ip("202.232.2.9"), ip("202.232.4.1"), ip("2001:240::1")])
+        self.assertEqual([r.cidr for r in recs], ["202.232.2.0/24", "202.232.4.0/24", "2001:200::/24"])
+        self.assertEqual(engine.engine.count, 4)
+        self.assertEqual(engine.cache.stats()["hits"], 2)
+
+    def test_prefix_none(self):
+        cache = cidr_cache.LookupCache(10, True)
+        cache.put(ip("9.9.9.9"), False, None)
+        self.assertIsNone(cache.get(ip("9.9.9.9")))
+        self.assertIs(cache.get(ip("9.9.9.8")), cidr_cache.MISS)
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
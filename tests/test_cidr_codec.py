@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_codec.py
+# 2) pytest -v tests/test_cidr_codec.py
+#
+import unittest
+import traceback
+import ipaddress
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_codec
+
+ADDRS = ["0.0.0.0", "1.2.3.4", "202.232.2.180", "255.255.255.255",
+         "::", "::1", "2001:240:bb81::10:180", "::ffff:1.2.3.4", "ffff::ffff"]
+
+
+def exploded_bin_addr(ip):
+    # the original IpAttribute.bin_addr
+    (delimiter, radix, fmt) = (".", 10, "08b") if ip.version == 4 else (":", 16, "016b")
+    return "".join([format(int(x, radix), fmt) for x in ip.exploded.split(delimiter)])
+
+
+class TestMethods(unittest.TestCase):
+    def test_bin_addr(self):
+        for a in ADDRS:
+            ip = ipaddress.ip_address(a)
+            self.assertEqual(cidr_codec.bin_addr(ip), exploded_bin_addr(ip))
+            self.assertEqual(cidr_codec.int_to_bin(cidr_codec.to_int(a), ip.version), exploded_bin_addr(ip))
+            self.assertEqual(cidr_codec.bin_to_int(cidr_codec.bin_addr(ip)), int(ip))
+            self.assertEqual(cidr_codec.pack(a), ip.packed)
+            self.assertEqual(cidr_codec.int_to_text(int(ip), ip.version), str(ip))
+            self.assertEqual(cidr_codec.int_to_packed(int(ip), ip.version), ip.packed)
+
+    def test_cidr(self):
+        for cidr in ["202.224.0.0/11", "8.8.8.0/24", "0.0.0.0/0", "1.2.3.4/32",
+                     "2001:240::/32", "2001:240:bb81::/48", "::/0"]:
+            net = ipaddress.ip_network(cidr)
+            self.assertEqual(cidr_codec.parse_cidr(cidr), (int(net.network_address), net.prefixlen))
+            self.assertEqual(
+                cidr_codec.cidr_range(cidr), (int(net.network_address), int(net.broadcast_address))
+            )
+        self.assertEqual(cidr_codec.parse_cidr("10.1.2.3/8"), (10 << 24, 8))
+        self.assertRaises(ValueError, cidr_codec.parse_cidr, "10.0.0.0/33")
+
+    def test_summarize_range(self):
+        for (start, end) in [("1.0.16.0", "1.0.31.255"), ("1.0.32.0", "1.0.43.255"), ("0.0.0.0", "255.255.255.255"),
+                             ("10.0.0.1", "10.0.0.1"), ("10.0.0.3", "10.0.1.9"), ("2001:200::", "2001:200::ff")]:
+            (start, end) = (ipaddress.ip_address(start), ipaddress.ip_address(end))
+            self.assertEqual(
+                cidr_codec.summarize_range(int(start), int(end), start.version),
+                [(int(n.network_address), n.prefixlen) for n in ipaddress.summarize_address_range(start, end)],
+            )
+
+    def test_prefix_addrs(self):
+        ip = ipaddress.ip_address("202.232.2.180")
+        prefixes = cidr_codec.prefix_addrs(ip, 8)
+        self.assertEqual(len(prefixes), 25)
+        self.assertEqual(prefixes[0], (exploded_bin_addr(ip), 32))
+        for (addr, prefixlen) in prefixes:
+            net = ipaddress.ip_network((ip, prefixlen), strict=False)
+            self.assertEqual(addr, exploded_bin_addr(net.network_address))
+        self.assertEqual(len(cidr_codec.prefix_addrs(ipaddress.ip_address("2001:db8::1"))), 129)
+
+    def test_encode_cidrs(self):
+        cidrs = ["202.224.0.0/11", "8.8.8.0/24", "1.0.0.0/24"]
+        self.assertEqual(
+            list(cidr_codec.encode_cidrs(cidrs, 4)),
+            [(exploded_bin_addr(ipaddress.ip_network(c).network_address), c.split("/")[1]) for c in cidrs],
+        )
+        self.assertEqual(
+            list(cidr_codec.encode_ranges(["2001:240::/32"], 6)),
+            [(ipaddress.ip_address("2001:240::").packed,
+              ipaddress.ip_address("2001:240:ffff:ffff:ffff:ffff:ffff:ffff").packed)],
+        )
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
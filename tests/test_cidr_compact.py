@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_compact.py
+# 2) pytest -v tests/test_cidr_compact.py
+#
+import unittest
+import traceback
+import os
+import sqlite3
+import ipaddress
+import tempfile
+import threading
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_compact
+import cidr_create_geoip
+import cidr_create_range
+import cidr_mmdb
+import cidr_open
+from bench import geodata
+
+
+class TestMethods(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        workdir = cls.tmpdir.name
+        g = cidr_create_geoip
+        g.WORK_DIR = workdir
+        data = geodata.GeoData(2000, 3)
+        data.write_zipfiles(workdir)
+        cls.ipaddrs = [ipaddress.ip_address(a) for a in data.sample_addresses(500)]
+
+        cls.dbpath = os.path.join(workdir, "database.cidr")
+        writer = g.DatabaseWriter(cls.dbpath)
+        g.make_tables(g.COUNTRY_CSV, g.Country(), writer)
+        g.make_tables(g.ASN_CSV, None, writer)
+        g.make_tables(g.CITY_CSV, g.City(), writer)
+        writer.close()
+
+        conn = sqlite3.connect(cls.dbpath)
+        cidr_create_range.make_range_tables(conn)
+        cls.compactpath = os.path.join(workdir, "database.compact")
+        cidr_compact.write_database(conn.cursor(), cls.compactpath)
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_schema(self):
+        self.assertLess(os.path.getsize(self.compactpath), os.path.getsize(self.dbpath) / 2)
+
+        conn = cidr_compact.connect(self.compactpath)
+        cursor = conn.cursor()
+        self.assertTrue(cidr_compact.is_compact(cursor))
+        cursor.execute("select count(*), count(distinct asn || provider) from providers")
+        (count, distinct) = cursor.fetchone()
+        self.assertEqual(count, distinct)
+
+        # the views have the rows of database.cidr
+        cursor.execute("attach database ? as cidr", (self.dbpath,))
+        for table in cidr_create_range.get_tables(cursor):
+            columns = "addr, prefixlen, cidr, %s, start_addr, end_addr" % ", ".join(
+                cidr_create_geoip.get_columns(table)[3:]
+            )
+            cursor.execute("select %s from main.%s order by addr" % (columns, table))
+            rows = cursor.fetchall()
+            cursor.execute("select %s from cidr.%s order by addr" % (columns, table))
+            self.assertEqual(rows, cursor.fetchall())
+        conn.close()
+
+        conn = sqlite3.connect(self.dbpath)
+        self.assertFalse(cidr_compact.is_compact(conn.cursor()))
+        conn.close()
+
+    def test_engines(self):
+        for name in ("like", "range", "memory", "trie"):
+            engine = cidr_open.open_engine(name, self.dbpath)
+            compact = cidr_open.open_engine(name, self.compactpath)
+            self.assertTrue(compact.has_city())
+            for ip in self.ipaddrs:
+                self.assertEqual(engine.lookup(ip, True), compact.lookup(ip, True))
+            self.assertEqual(engine.lookup_many(self.ipaddrs, True), compact.lookup_many(self.ipaddrs, True))
+            engine.close()
+            compact.close()
+
+    def test_compact_engine(self):
+        engine = cidr_open.open_engine("range", self.dbpath)
+        expected = [engine.lookup(ip, True) for ip in self.ipaddrs]
+        engine.close()
+
+        compact = cidr_compact.CompactEngine(self.compactpath)
+        results = {}
+
+        def search(n):
+            results[n] = [compact.lookup(ip, True) for ip in self.ipaddrs]
+
+        threads = [threading.Thread(target=search, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, dict([(n, expected) for n in range(4)]))
+        self.assertEqual(len(compact.engines), 5)
+        compact.close()
+
+    def test_mmdb(self):
+        mmdbpath = os.path.join(self.tmpdir.name, "compact.mmdb")
+        conn = cidr_compact.connect(self.compactpath)
+        cidr_mmdb.write_database(conn.cursor(), mmdbpath)
+        conn.close()
+
+        engine = cidr_open.open_engine("range", self.dbpath)
+        mmdb = cidr_mmdb.MmapEngine(mmdbpath)
+        for ip in self.ipaddrs:
+            self.assertEqual(engine.lookup(ip, True), mmdb.lookup(ip, True))
+        engine.close()
+        mmdb.close()
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_create_easy.py
+# 2) pytest -v tests/test_cidr_create_easy.py
+#
+import unittest
+import traceback
+import os
+import io
+import gzip
+import sqlite3
+import ipaddress
+import tempfile
+import subprocess
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "tool"))
+import cidr_create_easy
+import cidr_create_geoip
+
+CIDR_TXT = "JP\t1.0.16.0/20\nCN\t1.0.1.0/24\n\nUS\t3.0.0.0/8\n"
+
+
+class TestMethods(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cidr.txt.gz")
+        with gzip.open(self.path, "wt") as fd:
+            fd.write(CIDR_TXT)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_make_rows(self):
+        with open(self.path, "rb") as fd:
+            rows = list(cidr_create_easy.make_rows(fd))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(
+            rows[0], (format(int(ipaddress.ip_address("1.0.16.0")), "032b"), "20", "1.0.16.0/20", "JP")
+        )
+        self.assertEqual([r[3] for r in rows], ["JP", "CN", "US"])
+
+    def test_write_rows(self):
+        with open(self.path, "rb") as fd:
+            buf = io.StringIO()
+            # smaller batches than the file
+            cidr_create_easy.write_rows(cidr_create_easy.make_rows(fd), buf, 2)
+        lines = buf.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[2].split("\t")[1:], ["8", "3.0.0.0/8", "US"])
+
+    def test_database(self):
+        dbpath = os.path.join(self.tmpdir.name, "database.cidr")
+        with open(self.path, "rb") as fd:
+            rows = cidr_create_easy.make_rows(fd)
+            cidr_create_geoip.write_tables(dbpath, [(cidr_create_geoip.Country(), 4, rows)])
+        conn = sqlite3.connect(dbpath)
+        cursor = conn.cursor()
+        cursor.execute("select prefixlen, cidr, country from ipaddr_v4 order by addr")
+        self.assertEqual(cursor.fetchall(), [(24, "1.0.1.0/24", "CN"), (20, "1.0.16.0/20", "JP"), (8, "3.0.0.0/8", "US")])
+        conn.close()
+
+    def test_stdout(self):
+        tool = Path(__file__).parent.parent / "tool" / "cidr_create_easy.py"
+        result = subprocess.run(
+            [sys.executable, str(tool), "-u", "file://" + self.path], capture_output=True, text=True, check=True
+        )
+        self.assertEqual(len(result.stdout.splitlines()), 3)
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
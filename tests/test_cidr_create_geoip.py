@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_create_geoip.py
+# 2) pytest -v tests/test_cidr_create_geoip.py
+#
+import unittest
+import traceback
+import os
+import sqlite3
+import argparse
+import tempfile
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_create_geoip
+import cidr_create_range
+from bench import geodata
+
+
+class TestMethods(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.workdir = self.tmpdir.name
+        cidr_create_geoip.WORK_DIR = self.workdir
+        geodata.GeoData(100, 2).write_zipfiles(self.workdir)
+        self.zipfiles = sorted(os.listdir(self.workdir))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_database(self):
+        g = cidr_create_geoip
+        dbpath = os.path.join(self.workdir, "database.cidr")
+        writer = g.DatabaseWriter(dbpath)
+        g.make_tables(g.COUNTRY_CSV, g.Country(), writer)
+        g.make_tables(g.ASN_CSV, None, writer)
+        g.make_tables(g.CITY_CSV, g.City(), writer)
+        writer.close()
+
+        # nothing is extracted
+        self.assertEqual(sorted(os.listdir(self.workdir)), sorted(self.zipfiles + ["database.cidr"]))
+
+        conn = sqlite3.connect(dbpath)
+        cursor = conn.cursor()
+        cursor.execute("select addr, prefixlen, cidr, asn, provider from asn_v4 order by addr limit 1")
+        (addr, prefixlen, cidr, asn, provider) = cursor.fetchone()
+        self.assertEqual(len(addr), 32)
+        self.assertEqual(cidr.split("/")[1], str(prefixlen))
+        self.assertIsInstance(asn, int)
+        cursor.execute("select count(*) from city_v6 where city like '%\"%'")
+        self.assertEqual(cursor.fetchone()[0], 0)
+        conn.close()
+
+    def test_update(self):
+        g = cidr_create_geoip
+        dbpath = os.path.join(self.workdir, "database.cidr")
+        writer = g.DatabaseWriter(dbpath)
+        g.make_tables(g.COUNTRY_CSV, g.Country(), writer)
+        g.make_tables(g.ASN_CSV, None, writer)
+        writer.close()
+
+        conn = sqlite3.connect(dbpath)
+        conn.execute("create table ipgeo_v4 (start_addr blob)")
+        conn.execute("create index ipaddr_v4_idx2 on ipaddr_v4(cidr)")
+        conn.commit()
+        conn.close()
+        (tables, rows) = self.dump(dbpath)
+
+        # only ASN is rebuilt, the country tables and their indexes are kept
+        writer = g.DatabaseWriter(dbpath)
+        g.make_tables(g.ASN_CSV, None, writer)
+        writer.close()
+
+        (new_tables, new_rows) = self.dump(dbpath)
+        del rows["ipgeo_v4"]
+        self.assertEqual(new_rows, rows)
+        names = [t[1] for t in new_tables]
+        self.assertIn("ipaddr_v4_idx2", names)
+        self.assertIn("asn_v6_idx1", names)
+        self.assertNotIn("ipgeo_v4", names)
+
+        # the rebuilt tables have the range columns and index of cidr_create_range.py
+        self.assertIn("asn_v6_range_idx", names)
+        conn = sqlite3.connect(dbpath)
+        conn.create_function("net_start", 1, cidr_create_range.net_start)
+        conn.create_function("net_end", 1, cidr_create_range.net_end)
+        for table in ("asn_v4", "asn_v6"):
+            cursor = conn.execute(
+                "select count(*) from %s where start_addr = net_start(cidr) and end_addr = net_end(cidr)" % table
+            )
+            self.assertEqual(cursor.fetchone()[0], len(rows[table]))
+        self.assertGreater(conn.execute("select count(*) from sqlite_stat1").fetchone()[0], 0)
+        conn.close()
+        self.assertFalse(os.path.exists(dbpath + ".tmp"))
+
+    def test_diff(self):
+        g = cidr_create_geoip
+        editions = [(g.COUNTRY_CSV, g.Country()), (g.ASN_CSV, None)]
+        dbpath = os.path.join(self.workdir, "database.cidr")
+        writer = g.DatabaseWriter(dbpath)
+        for (geofile, obj) in editions:
+            g.make_tables(geofile, obj, writer)
+        writer.close()
+        conn = sqlite3.connect(dbpath)
+        cidr_create_range.make_range_tables(conn)
+        cidr_create_range.make_merged_tables(conn)
+        conn.close()
+        (tables, rows) = self.dump(dbpath)
+
+        # the old release: 3 networks less, 2 other countries, 1 network more
+        conn = sqlite3.connect(dbpath)
+        conn.execute("delete from ipaddr_v4 where rowid in (2, 4, 6)")
+        conn.execute("update ipaddr_v4 set country = 'XX' where rowid in (10, 11)")
+        conn.execute("insert into asn_v6 (addr, prefixlen, cidr, asn, provider) values ('0', 8, '::/8', 1, 'X')")
+        conn.execute("delete from ipgeo_v4")
+        conn.commit()
+        conn.close()
+
+        writer = g.DeltaWriter(sqlite3.connect(dbpath))
+        for (geofile, obj) in editions:
+            g.make_tables(geofile, obj, writer)
+        writer.stamps.update(g.get_stamps(g.ASN_CSV, "sha256", argparse.Namespace(aggregate=False)))
+        summary = writer.summary
+        writer.close()
+        self.assertEqual(g.read_stamps(dbpath), {"asn_v4": g.ASN_CSV + " sha256", "asn_v6": g.ASN_CSV + " sha256"})
+
+        self.assertEqual(summary["ipaddr_v4"]["insert"], 3)
+        self.assertEqual(summary["ipaddr_v4"]["update"], 2)
+        self.assertEqual(summary["ipaddr_v4"]["delete"], 0)
+        self.assertEqual(summary["asn_v6"], {"delete": 1, "update": 0, "insert": 0, "unchanged": len(rows["asn_v6"])})
+        self.assertEqual(summary["asn_v4"]["unchanged"], len(rows["asn_v4"]))
+
+        (new_tables, new_rows) = self.dump(dbpath)
+        self.assertEqual(new_tables, tables)
+        for (table, values) in rows.items():
+            self.assertEqual(sorted(new_rows[table], key=str), sorted(values, key=str))
+        self.assertFalse(os.path.exists(os.path.join(self.workdir, "delta.stage")))
+
+    def dump(self, dbpath):
+        conn = sqlite3.connect(dbpath)
+        cursor = conn.cursor()
+        cursor.execute("select type, name, sql from sqlite_master where name not like 'sqlite_%' order by name")
+        tables = cursor.fetchall()
+        rows = {}
+        for (_, table, _) in tables:
+            if table.endswith("_v4") or table.endswith("_v6"):
+                cursor.execute("select * from %s order by rowid" % table)
+                rows[table] = cursor.fetchall()
+        conn.close()
+        return (tables, rows)
+
+    def test_pipeline(self):
+        g = cidr_create_geoip
+        editions = [(g.COUNTRY_CSV, g.Country()), (g.ASN_CSV, None), (g.CITY_CSV, g.City())]
+
+        args = argparse.Namespace(
+            dbpath=os.path.join(self.workdir, "pipeline.cidr"), tsv=False, jobs=2, aggregate=False
+        )
+        dbpath = os.path.join(self.workdir, "database.cidr")
+        writer = g.DatabaseWriter(dbpath)
+        for (geofile, obj) in editions:
+            g.make_tables(geofile, obj, writer)
+            writer.stamps.update(g.get_stamps(geofile, "sha256", args))
+        writer.close()
+
+        (timings, built) = g.make_pipeline(editions, args, lambda geofile, args: "sha256")
+        self.assertIn("convert city_v6", timings)
+        self.assertEqual(len(built), 3)
+        self.assertIn("merge", timings)
+
+        (tables, rows) = self.dump(args.dbpath)
+        self.assertEqual(len(tables), 19)
+        self.assertEqual((tables, rows), self.dump(dbpath))
+        self.assertEqual(g.read_stamps(args.dbpath)["city_v6"], g.CITY_CSV + " sha256")
+        self.assertFalse([f for f in os.listdir(self.workdir) if f.endswith(".part")])
+
+    def test_read_regions(self):
+        g = cidr_create_geoip
+        regions = g.read_regions(g.CITY_CSV, g.City())
+        self.assertTrue(regions)
+        # given regions, the locations CSV is not read again
+        (z, names, ipvfile, ipv6file) = g.read_zipfile(g.CITY_CSV, g.City(), {})
+        z.close()
+        self.assertEqual(names, {})
+        self.assertTrue(ipvfile.endswith(g.GEOIP_CITY_IP_FILE))
+
+    def test_pipeline_not_changed(self):
+        g = cidr_create_geoip
+        editions = [(g.COUNTRY_CSV, g.Country()), (g.ASN_CSV, None)]
+        args = argparse.Namespace(
+            dbpath=os.path.join(self.workdir, "pipeline.cidr"), tsv=False, jobs=1, aggregate=False
+        )
+        g.make_pipeline(editions, args, lambda geofile, args: "sha256")
+        (tables, rows) = self.dump(args.dbpath)
+
+        # only ASN has a new release
+        (timings, built) = g.make_pipeline(
+            editions, args, lambda geofile, args: "sha256" if geofile == g.ASN_CSV else None
+        )
+        self.assertEqual(built, [(g.ASN_CSV, "sha256")])
+        self.assertNotIn("convert ipaddr_v4", timings)
+        self.assertEqual(self.dump(args.dbpath)[1], rows)
+
+        # nothing new, the database is not touched
+        mtime = os.stat(args.dbpath).st_mtime_ns
+        (timings, built) = g.make_pipeline(editions, args, lambda geofile, args: None)
+        self.assertEqual(built, [])
+        self.assertNotIn("merge", timings)
+        self.assertEqual(os.stat(args.dbpath).st_mtime_ns, mtime)
+
+    def test_tsv(self):
+        g = cidr_create_geoip
+        g.make_tables(g.ASN_CSV, None, g.TsvWriter())
+        g.make_tables(g.COUNTRY_CSV, g.Country(), g.TsvWriter())
+
+        with open(os.path.join(self.workdir, "asn.csv")) as fd:
+            rows = [line.rstrip("\n").split("\t") for line in fd]
+        self.assertTrue(all(len(r) == 5 for r in rows))
+        with open(os.path.join(self.workdir, "cidr6.txt")) as fd:
+            (addr, prefixlen, cidr, country) = fd.readline().rstrip("\n").split("\t")
+        self.assertEqual(len(addr), 128)
+        self.assertEqual(len(country), 2)
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
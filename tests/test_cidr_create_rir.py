@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_create_rir.py
+# 2) pytest -v tests/test_cidr_create_rir.py
+#
+import unittest
+import traceback
+import os
+import io
+import sqlite3
+import ipaddress
+import tempfile
+import threading
+import functools
+import contextlib
+import subprocess
+import http.server
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "tool"))
+import cidr_create_rir
+
+APNIC = """2|apnic|20240101|5|19830613|20240101|+1000
+# comment
+apnic|*|ipv4|*|3|summary
+apnic|*|ipv6|*|2|summary
+apnic|JP|ipv4|1.0.16.0|4096|20110412|allocated|A91872ED
+apnic|JP|ipv4|1.0.32.0|3072|20110412|allocated|A91872ED
+apnic|CN|ipv4|1.0.1.0|256|20110414|allocated|A92E1062
+apnic|JP|asn|173|1|20020801|allocated|A91A7381
+apnic|JP|ipv6|2001:200::|35|19990813|allocated|A91A7381
+apnic|JP|ipv6|2001:200:2000::|35|19990813|allocated|A91A7381
+"""
+RIPE = """2|ripencc|1704150000|3|19830705|20240101|+0100
+ripencc|DE|ipv4|2.16.0.0|1000|20100712|allocated|d3a5d4e0
+ripencc|GB|ipv6|2a00:1000::|29|20081106|allocated|b8ec9ff8
+"""
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class TestMethods(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.workdir = self.tmpdir.name
+        for (name, text) in (("apnic", APNIC), ("ripe", RIPE)):
+            with open(os.path.join(self.workdir, name), "w") as fd:
+                fd.write(text)
+
+        # a stand-in of ftp.ripe.net
+        handler = functools.partial(Handler, directory=self.workdir)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.urls = [
+            os.path.join(self.workdir, "apnic"),
+            "http://127.0.0.1:%d/ripe" % self.server.server_address[1],
+        ]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def fetch_all(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            return cidr_create_rir.fetch_all(self.urls)
+
+    def test_fetch_all(self):
+        networks = self.fetch_all()
+
+        expected = []
+        for (start, count, country) in (
+            ("1.0.1.0", 256, "CN"), ("1.0.16.0", 4096, "JP"), ("1.0.32.0", 3072, "JP"), ("2.16.0.0", 1000, "DE")
+        ):
+            start = ipaddress.ip_address(start)
+            for net in ipaddress.summarize_address_range(start, start + count - 1):
+                expected.append((int(net.network_address), net.prefixlen, country))
+        self.assertEqual(networks[4], expected)
+
+        self.assertEqual(
+            [(str(ipaddress.ip_network((n, p))), c) for (n, p, c) in networks[6]],
+            [("2001:200::/35", "JP"), ("2001:200:2000::/35", "JP"), ("2a00:1000::/29", "GB")],
+        )
+
+    def test_database(self):
+        dbpath = os.path.join(self.workdir, "database.cidr")
+        conn = sqlite3.connect(dbpath)
+        conn.execute("create table asn_v4 (addr char(32), prefixlen smallint, cidr varchar(18), asn int, provider text)")
+        conn.commit()
+        conn.close()
+
+        cidr_create_rir.write_database(self.fetch_all(), dbpath)
+        conn = sqlite3.connect(dbpath)
+        cursor = conn.cursor()
+        cursor.execute("select addr, prefixlen, cidr, country from ipaddr_v6 order by addr")
+        rows = cursor.fetchall()
+        self.assertEqual(rows[0][1:], (35, "2001:200::/35", "JP"))
+        self.assertEqual(rows[0][0], format(int(ipaddress.ip_address("2001:200::")), "0128b"))
+        cursor.execute("select count(*) from ipaddr_v4 where cidr like '2.16.%'")
+        self.assertEqual(cursor.fetchone()[0], len(list(ipaddress.summarize_address_range(
+            ipaddress.ip_address("2.16.0.0"), ipaddress.ip_address("2.16.0.0") + 999
+        ))))
+        # the other tables are kept
+        cursor.execute("select count(*) from sqlite_master where name = 'asn_v4'")
+        self.assertEqual(cursor.fetchone()[0], 1)
+        conn.close()
+
+    def test_aggregate(self):
+        networks = self.fetch_all()
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            rows = list(cidr_create_rir.get_rows(networks, 6, True))
+        # 2001:200::/35 and 2001:200:2000::/35 are siblings
+        self.assertEqual([r[2:] for r in rows], [("2001:200::/34", "JP"), ("2a00:1000::/29", "GB")])
+        self.assertIn("ipaddr_v6: 3 -> 2 rows", stderr.getvalue())
+
+    def test_stdout(self):
+        tool = Path(__file__).parent.parent / "tool" / "cidr_create_rir.py"
+        result = subprocess.run(
+            [sys.executable, str(tool), "-u", self.urls[0], "-u", "file://" + os.path.join(self.workdir, "ripe")],
+            capture_output=True, text=True, check=True,
+        )
+        lines = [line.split("\t") for line in result.stdout.splitlines()]
+        self.assertEqual(lines[0], [format(int(ipaddress.ip_address("1.0.1.0")), "032b"), "24", "1.0.1.0/24", "CN"])
+        self.assertTrue(all(len(line[0]) == 32 for line in lines))
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_download.py
+# 2) pytest -v tests/test_cidr_download.py
+#
+import unittest
+import traceback
+import os
+import hashlib
+import argparse
+import tempfile
+import threading
+import http.server
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_download
+import cidr_create_geoip
+from bench import geodata
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # a stand-in of download.maxmind.com with ETag, Last-Modified and Range
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        etag = '"%s"' % hashlib.md5(server.content).hexdigest()
+        last_modified = "Tue, 02 Jan 2024 00:00:00 GMT"
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        status = 200
+        if self.headers.get("Range") and self.headers.get("If-Range") == etag:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            if start >= len(server.content):
+                self.send_response(416)
+                self.end_headers()
+                return
+            status = 206
+
+        body = server.content[start:]
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(server.content) - 1, len(server.content)))
+        self.end_headers()
+
+        if server.truncate:
+            body = body[:server.truncate]
+            server.truncate = None
+        # counted before the client can see the end of the body
+        server.sent += len(body)
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMethods(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.workdir = self.tmpdir.name
+        self.cache_dir = os.path.join(self.workdir, "cache")
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.content = os.urandom(100000)
+        self.server.requests = []
+        self.server.truncate = None
+        self.server.sent = 0
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:%d/download" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def fetch(self):
+        return cidr_download.fetch(self.url, "GeoLite2-Test-CSV", self.cache_dir, 4096)
+
+    def read(self, path):
+        with open(path, "rb") as fd:
+            return fd.read()
+
+    def test_fetch(self):
+        artifact = self.fetch()
+        self.assertTrue(artifact.changed)
+        self.assertEqual(self.read(artifact.path), self.server.content)
+        self.assertEqual(artifact.sha256, hashlib.sha256(self.server.content).hexdigest())
+        self.assertEqual(os.path.basename(artifact.path), artifact.sha256 + ".zip")
+
+        # not modified, nothing is sent
+        self.server.sent = 0
+        self.assertEqual(self.fetch(), artifact._replace(changed=False))
+        self.assertIn("If-None-Match", self.server.requests[-1])
+        self.assertIn("If-Modified-Since", self.server.requests[-1])
+        self.assertEqual(self.server.sent, 0)
+
+        # a new release replaces the old file
+        self.server.content = os.urandom(50000)
+        new = self.fetch()
+        self.assertTrue(new.changed)
+        self.assertEqual(self.read(new.path), self.server.content)
+        self.assertFalse(os.path.exists(artifact.path))
+
+    def test_resume(self):
+        self.server.truncate = 30000
+        with self.assertRaises(cidr_download.DownloadError):
+            self.fetch()
+        partpath = os.path.join(self.cache_dir, "GeoLite2-Test-CSV.part")
+        self.assertEqual(os.path.getsize(partpath), 30000)
+
+        # only the rest is sent
+        self.server.sent = 0
+        artifact = self.fetch()
+        self.assertEqual(self.server.requests[-1]["Range"], "bytes=30000-")
+        self.assertEqual(self.server.sent, 70000)
+        self.assertEqual(self.read(artifact.path), self.server.content)
+        self.assertFalse(os.path.exists(partpath))
+
+    def test_resume_changed(self):
+        self.server.truncate = 30000
+        with self.assertRaises(cidr_download.DownloadError):
+            self.fetch()
+
+        # If-Range does not match, the new file is sent from the start
+        self.server.content = os.urandom(100000)
+        artifact = self.fetch()
+        self.assertEqual(self.read(artifact.path), self.server.content)
+
+    def test_built(self):
+        artifact = self.fetch()
+        (name, sha256) = ("GeoLite2-Test-CSV", artifact.sha256)
+        self.assertFalse(cidr_download.is_built(self.cache_dir, name, sha256, "sqlite:/a"))
+        cidr_download.mark_built(self.cache_dir, name, sha256, "sqlite:/a")
+        self.assertTrue(cidr_download.is_built(self.cache_dir, name, sha256, "sqlite:/a"))
+        self.assertFalse(cidr_download.is_built(self.cache_dir, name, sha256, "tsv:/tmp"))
+
+        # a new release is built again
+        self.server.content = os.urandom(1000)
+        new = self.fetch()
+        self.assertFalse(cidr_download.is_built(self.cache_dir, name, new.sha256, "sqlite:/a"))
+
+    def test_create_geoip(self):
+        g = cidr_create_geoip
+        g.WORK_DIR = self.workdir
+        (zip_filename, _, _) = geodata.GeoData(100, 2).write_zipfiles(self.workdir)
+        self.server.content = self.read(zip_filename)
+        os.remove(zip_filename)
+
+        csv_url = g.CSV_URL
+        g.CSV_URL = self.url + "?edition_id=%s&license_key=%s"
+        try:
+            args = argparse.Namespace(
+                token="test", cache_dir=self.cache_dir, force=False, tsv=False, mysql=None,
+                aggregate=False,
+                dbpath=os.path.join(self.workdir, "database.cidr"),
+            )
+            sha256 = g.download_zipfile(g.COUNTRY_CSV, args)
+            self.assertTrue(os.path.islink(zip_filename))
+            writer = g.DatabaseWriter(args.dbpath)
+            g.make_tables(g.COUNTRY_CSV, g.Country(), writer)
+            writer.stamps.update(g.get_stamps(g.COUNTRY_CSV, sha256, args))
+            writer.close()
+
+            # same release, not built again
+            self.assertIsNone(g.download_zipfile(g.COUNTRY_CSV, args))
+            args.aggregate = True
+            self.assertEqual(g.download_zipfile(g.COUNTRY_CSV, args), sha256)
+            args.aggregate = False
+            args.force = True
+            self.assertEqual(g.download_zipfile(g.COUNTRY_CSV, args), sha256)
+            args.force = False
+
+            # the tables were rebuilt from something else (cidr_create_rir.py)
+            writer = g.DatabaseWriter(args.dbpath)
+            g.make_tables(g.COUNTRY_CSV, g.Country(), writer)
+            writer.close()
+            self.assertEqual(g.read_stamps(args.dbpath), {})
+            self.assertEqual(g.download_zipfile(g.COUNTRY_CSV, args), sha256)
+
+            # the stamps are in the database, not in the cache
+            writer = g.DatabaseWriter(args.dbpath)
+            g.make_tables(g.COUNTRY_CSV, g.Country(), writer)
+            writer.stamps.update(g.get_stamps(g.COUNTRY_CSV, sha256, args))
+            writer.close()
+            self.assertIsNone(g.download_zipfile(g.COUNTRY_CSV, args))
+            os.remove(args.dbpath)
+            self.assertEqual(g.download_zipfile(g.COUNTRY_CSV, args), sha256)
+
+            # --tsv: the cache, and the files must be there
+            args.tsv = True
+            g.mark_built([(g.COUNTRY_CSV, sha256)], args)
+            self.assertEqual(g.download_zipfile(g.COUNTRY_CSV, args), sha256)
+            g.make_tables(g.COUNTRY_CSV, g.Country(), g.TsvWriter())
+            self.assertIsNone(g.download_zipfile(g.COUNTRY_CSV, args))
+        finally:
+            g.CSV_URL = csv_url
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
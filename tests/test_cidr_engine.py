@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_engine.py
+# 2) pytest -v tests/test_cidr_engine.py
+#
+import unittest
+import traceback
+import os
+import sqlite3
+import ipaddress
+import tempfile
+import io
+import json
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+from cidr_search import eval_ipaddr, eval_ipaddrs, get_city_mode, do_batch, do_parallel_batch, EvalIpException
+from cidr_open import open_engine
+import cidr_engine
+import cidr_codec
+import cidr_ipattr
+import cidr_create_range
+import cidr_index
+import cidr_dir248
+import cidr_mmdb
+import cidr_trie
+import cidr_testdata
+
+IPADDRS = [
+    "202.232.2.180",
+    "202.233.1.1",
+    "202.224.0.1",
+    "8.8.8.8",
+    "8.8.8.200",
+    "1.0.0.1",
+    "2001:240:bb81::10:180",
+    "2001:240:1::1",
+    "9.9.9.9",
+    "2001:db9::1",
+]
+
+
+class TestMethods(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.dbpath = os.path.join(cls.tmpdir.name, "database.cidr")
+        cidr_testdata.make_database(cls.dbpath)
+
+        conn = sqlite3.connect(cls.dbpath)
+        cidr_create_range.make_range_tables(conn)
+        cidr_create_range.make_merged_tables(conn)
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def setUp(self):
+        self.conn = sqlite3.connect(self.dbpath)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("PRAGMA case_sensitive_like=ON;")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def eval_all(self, engine, city_mode):
+        result = []
+        for ipaddr in IPADDRS:
+            try:
+                result.append(eval_ipaddr(ipaddr, engine, city_mode))
+            except EvalIpException as e:
+                result.append(str(e))
+        return result
+
+    def test_like(self):
+        r = eval_ipaddr("202.232.2.180", self.cursor)
+        self.assertEqual(r, "JP,202.224.0.0/11,Internet Initiative Japan Inc.,AS2497")
+
+    def test_range(self):
+        engine = cidr_engine.RangeEngine(self.cursor)
+        r = eval_ipaddr("202.232.2.180", engine, True)
+        self.assertEqual(
+            r, "JP,202.224.0.0/11,Internet Initiative Japan Inc.,AS2497,東京都和田"
+        )
+        r = eval_ipaddr("2001:240:bb81::10:180", engine)
+        self.assertEqual(r, "JP,2001:240::/32,Internet Initiative Japan Inc.,AS2497")
+        self.assertRaises(EvalIpException, eval_ipaddr, "9.9.9.9", engine)
+
+    def test_range_same_as_like(self):
+        like = cidr_engine.LikeEngine(self.cursor)
+        engine = cidr_engine.RangeEngine(self.cursor)
+        self.assertTrue(get_city_mode(engine))
+        for city_mode in (False, True):
+            self.assertEqual(
+                self.eval_all(like, city_mode), self.eval_all(engine, city_mode)
+            )
+
+    def test_range_prefixlen(self):
+        engine = cidr_engine.RangeEngine(self.cursor)
+        rec = engine.lookup(ipaddress.ip_address("202.233.1.1"))
+        self.assertEqual(rec.prefixlen, 15)
+        rec = engine.lookup(ipaddress.ip_address("202.233.1.1"), True)
+        self.assertEqual(rec.prefixlen, 32)
+
+    def test_memory_same_as_like(self):
+        like = cidr_engine.LikeEngine(self.cursor)
+        expected = [self.eval_all(like, city_mode) for city_mode in (False, True)]
+
+        engine = cidr_index.MemoryEngine(self.cursor)
+        self.conn.close()
+        self.assertTrue(get_city_mode(engine))
+        for city_mode in (False, True):
+            self.assertEqual(expected[city_mode], self.eval_all(engine, city_mode))
+
+    def test_match_prefix(self):
+        # the batch search of the REST APIs, "addr in (...)" on the addr index
+        like = cidr_engine.LikeEngine(self.cursor)
+        cursor = self.conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        for ipaddr in IPADDRS:
+            ip = ipaddress.ip_address(ipaddr)
+            prefixes = cidr_codec.prefix_addrs(ip, cidr_ipattr.IpAttribute(ip.version).matches)
+            cursor.execute(
+                "select addr, prefixlen, cidr from asn_v%d where addr in (%s)"
+                % (ip.version, ",".join(["?"] * len(prefixes))),
+                [addr for (addr, _) in prefixes],
+            )
+            row = cidr_engine.match_prefix(prefixes, dict([((r["addr"], r["prefixlen"]), r) for r in cursor.fetchall()]))
+            expected = like.find_asn(ip)
+            self.assertEqual(row["prefixlen"] if row else None, expected[-1] if expected else None)
+
+        # 10.0.0.0/8 and 10.0.0.0/16 have the same addr
+        ip = ipaddress.ip_address("10.0.1.1")
+        rows = {}
+        for cidr in ("10.0.0.0/8", "10.0.0.0/16"):
+            net = ipaddress.ip_network(cidr)
+            rows[(cidr_codec.bin_addr(net.network_address), net.prefixlen)] = cidr
+        self.assertEqual(cidr_engine.match_prefix(cidr_codec.prefix_addrs(ip, 8), rows), "10.0.0.0/16")
+
+    def test_api_batch(self):
+        # POST /search of cidr_api on the tables (plain and merged) through databases,
+        # GET /search finds the same for each address
+        try:
+            import asyncio
+            import databases
+            import cidr_api
+        except ImportError as e:
+            self.skipTest(str(e))
+
+        ips = [ipaddress.ip_address(ipaddr) for ipaddr in IPADDRS]
+        like = cidr_engine.LikeEngine(self.cursor)
+        merged = cidr_engine.MergedEngine(self.cursor)
+        expected = {
+            False: [cidr_engine.record_to_dict(like.lookup(ip, True)) for ip in ips],
+            True: [merged.lookup(ip, True) for ip in ips],
+        }
+        expected[True] = [
+            dict([(k, getattr(r, k)) for k in cidr_api.RECORD_COLUMNS]) if r else None for r in expected[True]
+        ]
+
+        async def search(is_merged):
+            database = databases.Database("sqlite:///" + self.dbpath)
+            await database.connect()
+            try:
+                backend = cidr_api.Backend(database, None, is_merged)
+                results = await cidr_api.search_ipgeo_many(backend, ips)
+                singles = [await cidr_api.search_ipgeo(backend, ip) for ip in ips]
+            finally:
+                await database.disconnect()
+            return [
+                [dict([(k, r[k]) for k in cidr_api.RECORD_COLUMNS]) if r else None for r in rows]
+                for rows in (results, singles)
+            ]
+
+        for is_merged in (False, True):
+            (results, singles) = asyncio.run(search(is_merged))
+            self.assertEqual(results, expected[is_merged])
+            self.assertEqual(singles, results)
+
+    def test_sorted_index_ipv6(self):
+        index = cidr_index.SortedIndex(6)
+        for (cidr, row) in (("2001:db8::/64", "a"), ("2001:db8:0:0:8000::/65", "b"), ("2001:db9::/32", "c")):
+            net = ipaddress.ip_network(cidr)
+            index.append(int(net.network_address), int(net.broadcast_address), row)
+
+        def find(addr):
+            return index.find(int(ipaddress.ip_address(addr)))
+
+        self.assertEqual(find("2001:db8::1"), "a")
+        self.assertEqual(find("2001:db8::8000:0:0:1"), "b")
+        self.assertEqual(find("2001:db8:0:1::1"), None)
+        self.assertEqual(find("2001:db9:ffff::1"), "c")
+        self.assertEqual(find("2001:db7::1"), None)
+
+    def test_trie_same_as_like(self):
+        like = cidr_engine.LikeEngine(self.cursor)
+        engine = cidr_trie.TrieEngine(self.cursor)
+        for city_mode in (False, True):
+            self.assertEqual(
+                self.eval_all(like, city_mode), self.eval_all(engine, city_mode)
+            )
+
+    def test_trie_longest_prefix(self):
+        trie = cidr_trie.PatriciaTrie(32)
+        for (cidr, row) in (("10.0.0.0/8", "a"), ("10.1.2.0/24", "c"), ("10.1.0.0/16", "b"), ("10.1.3.0/24", "d")):
+            net = ipaddress.ip_network(cidr)
+            trie.insert(int(net.network_address), net.prefixlen, cidr_trie.COUNTRY, row)
+
+        def find(addr):
+            return trie.search(int(ipaddress.ip_address(addr)))[cidr_trie.COUNTRY]
+
+        self.assertEqual(find("10.1.2.3"), "c")
+        self.assertEqual(find("10.1.3.3"), "d")
+        self.assertEqual(find("10.1.4.3"), "b")
+        self.assertEqual(find("10.2.0.1"), "a")
+        self.assertEqual(find("11.0.0.1"), None)
+        self.assertEqual(trie.size, 5)
+
+    def test_mmdb_same_as_like(self):
+        like = cidr_engine.LikeEngine(self.cursor)
+        mmdbpath = os.path.join(self.tmpdir.name, "database.mmdb")
+        cidr_mmdb.write_database(self.cursor, mmdbpath)
+
+        engine = cidr_mmdb.MmapEngine(mmdbpath)
+        self.assertTrue(get_city_mode(engine))
+        for city_mode in (False, True):
+            self.assertEqual(
+                self.eval_all(like, city_mode), self.eval_all(engine, city_mode)
+            )
+        self.assertEqual(
+            cidr_engine.record_to_dict(engine.lookup(ipaddress.ip_address("8.8.8.8"), True)),
+            {
+                "cidr": "8.8.8.0/24",
+                "country": "US",
+                "provider": "GOOGLE",
+                "asn": 15169,
+                "city": "アメリカ合衆国",
+            },
+        )
+        self.assertIsNone(
+            cidr_engine.record_to_dict(engine.lookup(ipaddress.ip_address("1.0.0.1"), True))
+        )
+        engine.close()
+
+    def test_mmdb_nested_prefix(self):
+        tree = cidr_mmdb.TreeWriter(32)
+        tree.insert(int(ipaddress.ip_address("10.0.0.0")), 8, 0)
+        tree.insert(int(ipaddress.ip_address("10.1.0.0")), 16, 10)
+        data = tree.to_bytes()
+        count = len(tree)
+
+        def find(addr):
+            n = int(ipaddress.ip_address(addr))
+            node = 0
+            depth = 0
+            while node < count:
+                node = cidr_mmdb.NODE.unpack_from(data, node * 8)[(n >> (31 - depth)) & 1]
+                depth += 1
+            return None if node == count else node - count - 1
+
+        self.assertEqual(find("10.1.2.3"), 10)
+        self.assertEqual(find("10.2.2.3"), 0)
+        self.assertEqual(find("11.2.2.3"), None)
+
+    def test_dir248_same_as_like(self):
+        like = cidr_engine.LikeEngine(self.cursor)
+        engine = cidr_dir248.Dir248Engine(self.cursor)
+        for city_mode in (False, True):
+            self.assertEqual(
+                self.eval_all(like, city_mode), self.eval_all(engine, city_mode)
+            )
+
+    def test_dir248_table(self):
+        table = cidr_dir248.Dir248Table()
+        for (cidr, result) in (("10.0.0.0/8", "a"), ("11.0.0.0/25", "b"), ("11.0.0.192/26", "c"), ("12.0.0.0/23", "a")):
+            net = ipaddress.ip_network(cidr)
+            table.add(int(net.network_address), int(net.broadcast_address), result)
+
+        def find(addr):
+            return table.find(int(ipaddress.ip_address(addr)))
+
+        self.assertEqual(find("10.255.255.255"), "a")
+        self.assertEqual(find("11.0.0.127"), "b")
+        self.assertEqual(find("11.0.0.128"), None)
+        self.assertEqual(find("11.0.0.192"), "c")
+        self.assertEqual(find("12.0.1.1"), "a")
+        self.assertEqual(find("12.0.2.1"), None)
+        self.assertEqual(len(table.results), 4)
+        self.assertEqual(len(table.tbl8), 256)
+
+    def test_merge_indexes(self):
+        indexes = [cidr_index.SortedIndex(4), cidr_index.SortedIndex(4)]
+        for (k, start, end, row) in ((0, 0, 99, "a"), (1, 50, 59, "x"), (1, 100, 109, "y"), (0, 200, 209, "b")):
+            indexes[k].append(start, end, row)
+        self.assertEqual(
+            list(cidr_index.merge_indexes(indexes)),
+            [
+                (0, 49, ("a", None)),
+                (50, 59, ("a", "x")),
+                (60, 99, ("a", None)),
+                (100, 109, (None, "y")),
+                (200, 209, ("b", None)),
+            ],
+        )
+
+    def test_range_lookup_many(self):
+        engine = cidr_engine.RangeEngine(self.cursor)
+        ips = [ipaddress.ip_address(ipaddr) for ipaddr in IPADDRS]
+        for city_mode in (False, True):
+            self.assertEqual(
+                engine.lookup_many(ips, city_mode),
+                [engine.lookup(ip, city_mode) for ip in ips],
+            )
+
+    def test_like_lookup_many(self):
+        engine = cidr_engine.LikeEngine(self.cursor)
+        ips = [ipaddress.ip_address(ipaddr) for ipaddr in IPADDRS]
+        for city_mode in (False, True):
+            self.assertEqual(
+                engine.lookup_many(ips, city_mode),
+                [engine.lookup(ip, city_mode) for ip in ips],
+            )
+
+    def test_open_readonly(self):
+        engine = open_engine("like", self.dbpath)
+        ips = [ipaddress.ip_address(ipaddr) for ipaddr in IPADDRS]
+        # the temp tables of the batch statements
+        self.assertEqual(engine.lookup_many(ips), [engine.lookup(ip) for ip in ips])
+        self.assertRaises(sqlite3.OperationalError, engine.cursor.execute, "delete from ipaddr_v4")
+        engine.close()
+
+        dbpath = os.path.join(self.tmpdir.name, "missing.cidr")
+        self.assertRaises(sqlite3.OperationalError, open_engine, "like", dbpath)
+        self.assertFalse(os.path.exists(dbpath))
+
+    def test_eval_ipaddrs(self):
+        results = eval_ipaddrs(["8.8.8.8", "192.168.1.1", "abc", "9.9.9.9"], self.cursor)
+        self.assertEqual(results[0].cidr, "8.8.8.0/24")
+        self.assertEqual([str(e) for e in results[1:]], ["Private IP address", "Not IP address", "Not Found"])
+
+    def test_batch(self):
+        engine = cidr_engine.RangeEngine(self.cursor)
+        infd = io.StringIO("8.8.8.8\n\n2001:240:bb81::1\n9.9.9.9\n")
+
+        outfd = io.StringIO()
+        self.assertEqual(do_batch(infd, outfd, engine, True, "csv", 2), 3)
+        self.assertEqual(
+            outfd.getvalue().splitlines(),
+            [
+                "ipaddr,country,cidr,provider,asn,city,error",
+                "8.8.8.8,US,8.8.8.0/24,GOOGLE,15169,アメリカ合衆国,",
+                "2001:240:bb81::1,JP,2001:240::/32,Internet Initiative Japan Inc.,2497,東京都,",
+                "9.9.9.9,,,,,,Not Found",
+            ],
+        )
+
+        infd.seek(0)
+        outfd = io.StringIO()
+        do_batch(infd, outfd, engine, False, "ndjson")
+        lines = [json.loads(line) for line in outfd.getvalue().splitlines()]
+        self.assertEqual(
+            lines[0],
+            {"ipaddr": "8.8.8.8", "cidr": "8.8.8.0/24", "country": "US", "provider": "GOOGLE", "asn": 15169},
+        )
+        self.assertEqual(lines[2], {"ipaddr": "9.9.9.9", "error": "Not Found"})
+
+    def test_merged_same_as_like(self):
+        like = cidr_engine.LikeEngine(self.cursor)
+        engine = cidr_engine.MergedEngine(self.cursor)
+        ips = [ipaddress.ip_address(ipaddr) for ipaddr in IPADDRS]
+        for city_mode in (False, True):
+            self.assertEqual(
+                self.eval_all(like, city_mode), self.eval_all(engine, city_mode)
+            )
+            self.assertEqual(
+                engine.lookup_many(ips, city_mode),
+                [like.lookup(ip, city_mode) for ip in ips],
+            )
+
+    def test_merged_table(self):
+        self.cursor.execute("select count(*) from ipgeo_v4")
+        # 1.0.0.0/24, 8.8.8.0/25, 8.8.8.128/25, 202.224.0.0-202.231.255.255,
+        # 202.232.0.0-202.232.1.255, 202.232.2.0/24, 202.232.3.0-202.233.255.255, 202.234.0.0-202.255.255.255
+        self.assertEqual(self.cursor.fetchone()[0], 8)
+
+    def test_parallel_batch(self):
+        engine = cidr_engine.RangeEngine(self.cursor)
+        data = "\n".join(IPADDRS * 5)
+
+        expected = io.StringIO()
+        do_batch(io.StringIO(data), expected, engine, True, "tsv", 4)
+
+        outfd = io.StringIO()
+        count = do_parallel_batch(io.StringIO(data), outfd, "range", self.dbpath, 2, "tsv", 4)
+        self.assertEqual(count, len(IPADDRS) * 5)
+        self.assertEqual(outfd.getvalue(), expected.getvalue())
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
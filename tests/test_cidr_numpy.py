@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_numpy.py
+# 2) pytest -v tests/test_cidr_numpy.py
+#
+import unittest
+import traceback
+import os
+import sqlite3
+import ipaddress
+import tempfile
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_create_range
+import cidr_testdata
+
+try:
+    import numpy as np
+    import cidr_numpy
+except ImportError:
+    np = None
+
+IPV4 = ["202.232.2.180", "8.8.8.8", "8.8.8.200", "1.0.0.1", "9.9.9.9", "202.233.1.1"]
+IPV6 = ["2001:240:bb81::10:180", "2001:240:1::1", "2001:db9::1"]
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestMethods(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        dbpath = os.path.join(cls.tmpdir.name, "database.cidr")
+        cidr_testdata.make_database(dbpath)
+
+        conn = sqlite3.connect(dbpath)
+        cidr_create_range.make_range_tables(conn)
+        cls.index = cidr_numpy.VectorIndex(conn.cursor())
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_ipv4(self):
+        addrs = np.array([int(ipaddress.ip_address(a)) for a in IPV4], dtype=np.uint32)
+        (country, asn, city) = self.index.lookup_ipv4(addrs)
+
+        self.assertEqual(
+            list(self.index.take(4, "country", country)), ["JP", "US", "US", "AU", None, "JP"]
+        )
+        self.assertEqual(
+            list(self.index.take(4, "country", country, 1)),
+            ["202.224.0.0/11", "8.8.8.0/24", "8.8.8.0/24", "1.0.0.0/24", None, "202.224.0.0/11"],
+        )
+        self.assertEqual(
+            list(self.index.take(4, "asn", asn, 1)), [2497, 15169, 15169, 13335, None, 2497]
+        )
+        self.assertEqual(
+            list(self.index.take(4, "city", city)),
+            ["東京都和田", "アメリカ合衆国", None, None, None, None],
+        )
+        self.assertEqual(city.dtype, np.int64)
+
+    def test_ipv6(self):
+        ints = [int(ipaddress.ip_address(a)) for a in IPV6]
+        hi = np.array([n >> 64 for n in ints], dtype=np.uint64)
+        lo = np.array([n & ((1 << 64) - 1) for n in ints], dtype=np.uint64)
+        (country, asn, city) = self.index.lookup_ipv6(hi, lo)
+
+        self.assertEqual(list(self.index.take(6, "country", country)), ["JP", "JP", None])
+        self.assertEqual(list(self.index.take(6, "asn", asn, 1)), [2497, 2497, None])
+        self.assertEqual(list(self.index.take(6, "city", city)), ["東京都", None, None])
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# IP Address Search Tool
+#
+# hidekuno@gmail.com
+#
+# Test howto
+# 1) python tests/test_cidr_reload.py
+# 2) pytest -v tests/test_cidr_reload.py
+#
+import unittest
+import traceback
+import os
+import io
+import asyncio
+import ipaddress
+import tempfile
+import contextlib
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_cache
+import cidr_reload
+
+
+class Resource(object):
+    def __init__(self, path):
+        with open(path) as fd:
+            self.value = fd.read()
+        if self.value == "broken":
+            raise ValueError(self.value)
+        self.closed = False
+
+
+class TestMethods(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "database.mmdb")
+        self.replace("1")
+        self.cache = cidr_cache.LookupCache(10)
+        self.closed = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def replace(self, value):
+        with open(self.path + ".tmp", "w") as fd:
+            fd.write(value)
+        os.replace(self.path + ".tmp", self.path)
+
+    def close(self, resource):
+        resource.closed = True
+        self.closed.append(resource.value)
+
+    def test_swap(self):
+        reloader = cidr_reload.Reloader(self.path, Resource, self.close, 1e-9, self.cache.clear)
+        with reloader.use() as old:
+            generation = self.cache.generation
+            self.replace("2")
+            with reloader.use() as new:
+                self.assertEqual(new.value, "2")
+            # in flight on the old one
+            self.assertFalse(old.closed)
+            self.cache.put(ipaddress.ip_address("1.1.1.1"), False, old.value, generation)
+        self.assertTrue(old.closed)
+        self.assertEqual(self.closed, ["1"])
+        self.assertEqual(self.cache.stats()["size"], 0)
+        self.assertEqual(reloader.stats()["generation"], 2)
+
+        reloader.close()
+        self.assertEqual(self.closed, ["1", "2"])
+
+    def test_request(self):
+        reloader = cidr_reload.Reloader(self.path, Resource, self.close, 0)
+        self.replace("2")
+        with reloader.use() as r:
+            self.assertEqual(r.value, "1")
+        reloader.request()
+        with reloader.use() as r:
+            self.assertEqual(r.value, "2")
+        self.assertEqual(self.closed, ["1"])
+
+    def test_broken(self):
+        reloader = cidr_reload.Reloader(self.path, Resource, self.close, 0)
+        self.replace("broken")
+        reloader.request()
+        with contextlib.redirect_stderr(io.StringIO()):
+            with reloader.use() as r:
+                self.assertEqual(r.value, "1")
+        self.assertFalse(reloader.pending)
+        self.assertRaises(ValueError, reloader.reload)
+
+    def test_async(self):
+        async def opener(path):
+            return Resource(path)
+
+        async def closer(resource):
+            self.close(resource)
+
+        async def run():
+            reloader = cidr_reload.AsyncReloader(self.path, opener, closer, 1e-9, self.cache.clear)
+            await reloader.open()
+            async with reloader.use() as old:
+                self.replace("2")
+                async with reloader.use() as new:
+                    self.assertEqual((old.value, new.value), ("1", "2"))
+                self.assertEqual(self.closed, [])
+            self.assertEqual(self.closed, ["1"])
+            await reloader.close()
+
+        asyncio.run(run())
+        self.assertEqual(self.closed, ["1", "2"])
+        self.assertEqual(self.cache.generation, 1)
+
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+
+    except Exception as e:
+        print(e, traceback.format_exc(), file=sys.stderr)
+        sys.exit(1)
@@ -2,13 +2,26 @@
 #
 # IP Address Search Tool
 #
+# Country table from cidr.txt.gz of nami.jp. The response is decompressed and decoded
+# as a stream, the memory use does not depend on the size of the file.
+#
+# ex.) python tool/cidr_create_easy.py > /var/jvn/tmp/cidr.txt
+#      python tool/cidr_create_easy.py -d ${HOME}/database.cidr (ipaddr_v4)
+#
 # hidekuno@gmail.com
 #
+import io
 import sys
-import traceback
 import gzip
-import urllib.request
-from io import StringIO
+import argparse
+import itertools
+import traceback
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_codec
+import cidr_download
+import cidr_create_geoip
 
 """
 CREATE TEMPORARY TABLE jvn_ipaddr_tmp (
@@ -21,17 +34,43 @@ copy jvn_ipaddr_tmp from '/var/jvn/tmp/cidr.txt';
 delete from jvn_ipaddr;
 insert into jvn_ipaddr select * from jvn_ipaddr_tmp;
 """
+NAMI_URL = "http://nami.jp/ipv4bycc/cidr.txt.gz"
+BATCH_SIZE = 10000
+
+
+def make_rows(fd):
+    # fd: the gzip file, yields (addr, prefixlen, cidr, country) line by line
+    encode = cidr_codec.encoder(4)
+    with gzip.GzipFile(fileobj=fd) as gz:
+        for line in io.TextIOWrapper(gz, encoding="utf-8"):
+            line = line.rstrip()
+            if line == "":
+                continue
+            (country, subnet) = line.split("\t")
+            (addr, prefixlen) = encode(subnet)
+            yield (addr, prefixlen, subnet, country)
+
+
+def write_rows(rows, outfd, batch_size=BATCH_SIZE):
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        outfd.write("".join("\t".join(row) + "\n" for row in batch))
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--database", type=str, dest="dbpath", default=None, required=False)
+    parser.add_argument("-u", "--url", type=str, dest="url", default=NAMI_URL, required=False)
+    args = parser.parse_args(sys.argv[1:])
+
     try:
-        url = urllib.request.urlopen("http://nami.jp/ipv4bycc/cidr.txt.gz")
-        data = gzip.decompress(url.read()).decode("utf-8")
-        url.close()
-
-        for line in StringIO(data):
-            country, subnet = line.rstrip().split("\t")
-            ipaddr, mask = subnet.split("/")
-            addr = "".join([format(int(x), "08b") for x in ipaddr.split(".")])
-            print(addr + "\t" + mask + "\t" + subnet + "\t" + country)
+        with cidr_download.open_url(args.url) as fd:
+            if args.dbpath:
+                cidr_create_geoip.write_tables(args.dbpath, [(cidr_create_geoip.Country(), 4, make_rows(fd))])
+            else:
+                write_rows(make_rows(fd), sys.stdout)
 
     except Exception as e:
         print(e, traceback.format_exc(), file=sys.stderr)
@@ -2,12 +2,26 @@
 #
 # IP Address Search Tool
 #
+# Country tables from the delegation files of the five RIRs. The files are fetched and
+# parsed at once (a thread for each), the ranges are split into networks on integers.
+#
+# ex.) python tool/cidr_create_rir.py > /tmp/cidr.txt         (IPv4 rows for init.sql)
+#      python tool/cidr_create_rir.py -d ${HOME}/database.cidr (ipaddr_v4 and ipaddr_v6)
+#
 # hidekuno@gmail.com
 #
+import io
 import sys
+import argparse
 import traceback
-import ipaddress
-import urllib.request
+import concurrent.futures
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+import cidr_codec
+import cidr_aggregate
+import cidr_download
+import cidr_create_geoip
 
 # https://www.apnic.net/about-apnic/corporate-documents/documents/resource-guidelines/
 
@@ -18,39 +32,95 @@ RIR_STATISTICS_URL = [
     "http://ftp.lacnic.net/pub/stats/lacnic/delegated-lacnic-extended-latest",
     "http://ftp.afrinic.net/pub/stats/afrinic/delegated-afrinic-extended-latest",
 ]
+VERSIONS = {"ipv4": 4, "ipv6": 6}
 
 
 def make_data(rir_url):
-    url = urllib.request.urlopen(rir_url)
+    # {4: [(start, prefixlen, country)], 6: [...]}, the value of ipv4 is the number
+    # of addresses, the value of ipv6 the prefix length
+    networks = {4: [], 6: []}
+    with cidr_download.open_url(rir_url) as fd:
+        for line in io.TextIOWrapper(fd, encoding="utf-8", errors="replace"):
+            item = line.split("|")
 
-    for line in url:
-        item = line.decode("utf-8").split("|")
+            if len(item) < 5 or item[0][0] == "#" or item[1] == "*" or item[2] not in VERSIONS:
+                continue
 
-        if len(item) < 5 or item[0][0] == "#" or item[1] == "*" or item[2] != "ipv4":
-            continue
+            version = VERSIONS[item[2]]
+            start = cidr_codec.to_int(item[3], version)
+            if version == 4:
+                for (n, prefixlen) in cidr_codec.summarize_range(start, start + int(item[4]) - 1, 4):
+                    networks[4].append((n, prefixlen, item[1]))
+            else:
+                networks[6].append((start, int(item[4]), item[1]))
+    return networks
 
-        start = ipaddress.IPv4Address(item[3])
-        end = start + (int(item[4]) - 1)
-        for ipaddr in ipaddress.summarize_address_range(start, end):
-            bin_addr = "".join(
-                [format(int(x), "08b") for x in str(ipaddr.network_address).split(".")]
-            )
-            print(
-                format(
-                    "%s\t%s\t%s\t%s"
-                    % (bin_addr, ipaddr.prefixlen, ipaddr.with_prefixlen, item[1])
-                )
+
+def fetch_all(urls):
+    networks = {4: [], 6: []}
+    with concurrent.futures.ThreadPoolExecutor(len(urls)) as executor:
+        futures = {executor.submit(make_data, url): url for url in urls}
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            sys.stderr.write(
+                "done %s (%d, %d)\n" % (futures[future], len(result[4]), len(result[6]))
             )
+            for version in (4, 6):
+                networks[version].extend(result[version])
+
+    for version in (4, 6):
+        networks[version].sort()
+    return networks
+
+
+def make_rows(networks, version):
+    for (start, prefixlen, country) in networks:
+        yield (
+            cidr_codec.int_to_bin(start, version),
+            str(prefixlen),
+            "%s/%d" % (cidr_codec.int_to_text(start, version), prefixlen),
+            country,
+        )
 
-    url.close()
+
+def get_rows(networks, version, aggregate):
+    rows = make_rows(networks[version], version)
+    if not aggregate:
+        return rows
+
+    # the siblings of the split ranges with the same country are merged
+    counts = {}
+
+    def aggregated():
+        yield from cidr_aggregate.aggregate_rows(rows, version, counts)
+        sys.stderr.write(cidr_aggregate.format_counts("ipaddr_v%d" % version, counts) + "\n")
+
+    return aggregated()
+
+
+def write_database(networks, dbpath, aggregate=False):
+    country = cidr_create_geoip.Country()
+    cidr_create_geoip.write_tables(
+        dbpath, [(country, version, get_rows(networks, version, aggregate)) for version in (4, 6)]
+    )
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-a", "--aggregate", default=False, action="store_true", required=False
+    )
+    parser.add_argument("-d", "--database", type=str, dest="dbpath", default=None, required=False)
+    parser.add_argument("-u", "--url", type=str, dest="urls", action="append", required=False)
+    args = parser.parse_args(sys.argv[1:])
+
     try:
-        for r in RIR_STATISTICS_URL:
-            sys.stderr.write("start " + r + "\n")
-            make_data(r)
-            sys.stderr.write("done. \n")
+        networks = fetch_all(args.urls or RIR_STATISTICS_URL)
+        if args.dbpath:
+            write_database(networks, args.dbpath, args.aggregate)
+        else:
+            for row in get_rows(networks, 4, args.aggregate):
+                print("\t".join(row))
     except Exception as e:
         print(e, traceback.format_exc(), file=sys.stderr)
         sys.exit(1)